@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module is the long-lived sleuth agent. It imports dnspython and the
+probes once, then keeps its resolvers, DNS answer cache, HTTP connection
+pool and NetElement freshness caches warm while it answers check requests
+over a Unix domain socket, so interactive scripts (gohan, the apps) start
+instantly as thin clients (module client), and every operator connected to
+the agent shares one set of caches and pools.
+
+Requests and answers are one JSON object per line:
+
+    {"op": "check", "check": "check_dns", "args": ["google.com", ["8.8.8.8"], "a"]}
+    {"op": "report", "element": {"name": "google.com", "kind": "Web server"}}
+    {"op": "status"}
+    -> {"ok": true, "result": ...} or {"ok": false, "error": "..."}
+
+Check results are records encoded with results.to_wire. The socket is
+created with mode 0600; give several operators access with --mode 660 and a
+socket in a directory of their shared group.
+
+    python3 agent.py --socket /run/sleuth/agent.sock --mode 660
+
+>>> from agent import Agent
+>>> Agent('/tmp/sleuth.sock').serve_forever()
+"""
+
+import argparse
+import json
+import os
+import signal
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+import inventory
+from client import CHECKS, AgentClient, AgentError, default_socket
+from results import to_wire
+from toolkit import Toolkit
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        _agent = self.server.agent
+        for _line in self.rfile:
+            try:
+                _answer = {'ok': True, 'result': _agent.handle(json.loads(_line))}
+            except Exception as e:
+                _answer = {'ok': False,
+                           'error': '{}: {}'.format(type(e).__name__, e)}
+            self.wfile.write((json.dumps(_answer) + '\n').encode())
+            self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+
+class Agent:
+
+    def __init__(self, path=None, toolkit=None, mode=0o600, elements=1024,
+                 idle=None):
+        """
+        :param path: string or None, Unix socket to listen on; defaults to
+        client.default_socket().
+        :param toolkit: toolkit.Toolkit or None, shared by every request.
+        :param mode: integer, permissions of the socket file.
+        :param elements: integer, number of NetElement objects (and their
+        freshness caches) kept for report requests.
+        :param idle: number or None, seconds without requests after which
+        serve_forever() returns; None serves until shutdown().
+        """
+        try:
+            assert type(elements) is int and elements > 0,\
+                'Validation error; expected a positive int for elements, received {}.'\
+                .format(elements)
+
+            assert idle is None or idle > 0,\
+                'Validation error; expected a positive idle timeout, received {}.'\
+                .format(idle)
+        except AssertionError as e:
+            print(e)
+            exit()
+        self.path = path or default_socket()
+        self.toolkit = toolkit or Toolkit()
+        self.mode = mode
+        self.elements = elements
+        self.idle = idle
+        self.requests = 0
+        self.started = time.time()
+        self._last_request = time.monotonic()
+        self._elements = OrderedDict()  # definition -> (NetElement, Lock)
+        self._elements_lock = threading.Lock()
+        self._server = None
+
+    def handle(self, request):
+        """
+        Answer one decoded request.
+
+        :param request: dict with op 'check', 'report' or 'status'.
+        :return: JSON-ready result; raises on a bad request.
+        """
+        self.requests += 1
+        self._last_request = time.monotonic()
+        _op = request.get('op')
+        if _op == 'check':
+            if request.get('check') not in CHECKS:
+                raise ValueError('unknown check {!r}'.format(request.get('check')))
+            return to_wire(getattr(self.toolkit, request['check'])(
+                *request.get('args', ()), **request.get('kwargs', {})))
+        if _op == 'report':
+            _element, _lock = self._element(request['element'],
+                                            bool(request.get('concurrent')))
+            with _lock:  # an element builds its report in place
+                return str(_element)
+        if _op == 'status':
+            _cache = self.toolkit.dns_cache
+            return {'pid': os.getpid(), 'uptime': time.time() - self.started,
+                    'requests': self.requests, 'elements': len(self._elements),
+                    'dns_hits': _cache.hits if _cache is not None else 0,
+                    'dns_misses': _cache.misses if _cache is not None else 0}
+        raise ValueError('unknown op {!r}'.format(_op))
+
+    def _element(self, definition, concurrent):
+        _key = json.dumps([definition, concurrent], sort_keys=True)
+        with self._elements_lock:
+            _entry = self._elements.get(_key)
+            if _entry is not None:
+                self._elements.move_to_end(_key)
+                return _entry
+        _entry = (inventory.build(definition, toolkit=self.toolkit,
+                                  concurrent=concurrent), threading.Lock())
+        with self._elements_lock:
+            _entry = self._elements.setdefault(_key, _entry)
+            while len(self._elements) > self.elements:
+                self._elements.popitem(last=False)
+        return _entry
+
+    def _claim_socket(self):
+        # A socket file nobody answers on is left over from a dead agent.
+        if not os.path.exists(self.path):
+            return
+        try:
+            with AgentClient(self.path, timeout=1) as _client:
+                _client.status()
+        except (AgentError, OSError, ValueError):
+            os.unlink(self.path)
+            return
+        raise OSError('a sleuth agent is already listening on {}'.format(
+            self.path))
+
+    def serve_forever(self):
+        """ Listen on self.path until shutdown() or the idle timeout."""
+        _directory = os.path.dirname(self.path)
+        if _directory and not os.path.isdir(_directory):
+            # e.g. /tmp/sleuth-<uid>, which clients only trust when it is
+            # this user's alone (client.check_owner).
+            os.makedirs(_directory, mode=0o700)
+        self._claim_socket()
+        _umask = os.umask(0o177)  # no window with a world-writable socket
+        try:
+            self._server = _Server(self.path, _Handler)
+        finally:
+            os.umask(_umask)
+        os.chmod(self.path, self.mode)
+        self._server.agent = self
+        if self.idle is not None:
+            threading.Thread(target=self._watch_idle, daemon=True).start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def _watch_idle(self):
+        while time.monotonic() - self._last_request < self.idle:
+            time.sleep(min(self.idle, 5))
+        self.shutdown()
+
+    def shutdown(self):
+        """ Make serve_forever() return; call from another thread."""
+        if self._server is not None:
+            self._server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve sleuth checks from warm caches over a Unix socket.')
+    parser.add_argument('--socket', default=default_socket(),
+                        help='Unix socket to listen on')
+    parser.add_argument('--mode', default='600',
+                        help='octal permissions of the socket file')
+    parser.add_argument('--idle', type=float,
+                        help='exit after this many seconds without requests')
+    args = parser.parse_args()
+    agent = Agent(args.socket, mode=int(args.mode, 8), idle=args.idle)
+    # shutdown() waits for the serving loop, so it cannot run in the handler.
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(
+        target=agent.shutdown).start())
+    try:
+        agent.serve_forever()
+    except OSError as e:
+        print(e)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,22 @@
 #!/usr/bin/env python3
 
-import element
+import client
 
 __author__ = 'rafael'
 
-
-google = element.NetElement('google.com',
-                    'Web server',
-                    dns_types=('a',),
-                    dns_servers=('8.8.8.8',),
-                    ports=('t80', 't443'),
-                    urls=('http://www.google.com', 'https://google.com'),
-                    note=None)
+# Element definitions (see module inventory); the sleuth agent checks them.
+google = {'name': 'google.com',
+          'kind': 'Web server',
+          'dns_types': ('a',),
+          'dns_servers': ('8.8.8.8',),
+          'ports': ('t80', 't443'),
+          'urls': ('http://www.google.com', 'https://google.com'),
+          'note': None}
 
 
 def main():
     print('Checking application1; please wait...')
-    print(google)
+    print(client.report(google, concurrent=True))
 
 
 if __name__ == '__main__':
@@ -8,7 +8,9 @@ import readline
 # TODO scp -r username@ip:/path/to/remote/server/source/folder .
 
 index = {1: 'APP1',
-         2: 'APP2'}
+         2: 'APP2',
+         3: 'MONITOR',
+         4: 'INVENTORY'}
 
 intro = '''\nWelcome to Sleuth.\n
 Enter the number of the system you wish to test or Ctrl+C to exit:'''
@@ -33,6 +35,12 @@ def main():
             elif application == 'APP2':
                 import application2
                 application2.main()
+            elif application == 'MONITOR':
+                import monitor
+                monitor.main()
+            elif application == 'INVENTORY':
+                import inventory
+                inventory.main(input('Inventory file (.jsonl, .csv, .yaml) > '))
             else:
                 print('\n'+application)
                 main()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module provides an asyncio-native counterpart of toolkit.Toolkit. Every
+check is a coroutine, so a single event loop can keep tens of thousands of
+DNS, socket, ICMP and HTTP probes in flight without a thread per probe or a
+ping process per host.
+
+Checks return the same result records as their Toolkit counterparts (module
+results) and keep no per-call state, so concurrent coroutines can share one
+AsyncToolkit.
+
+>>> import asyncio
+>>> from asynctoolkit import AsyncToolkit
+>>> tool = AsyncToolkit()
+>>> async def probe():
+...     return await asyncio.gather(
+...         tool.check_dns('google.com', ('8.8.8.8',), 'a'),
+...         tool.check_socket('google.com', 't80'),
+...         tool.check_http_code('https://google.com'))
+>>> print([str(result) for result in asyncio.run(probe())])
+['74.125.138.139, 74.125.138.102', 'open', '200']
+"""
+
+import asyncio
+import dns.asyncresolver
+import dns.exception
+import dns.rdatatype
+import dns.resolver
+import dns.reversename
+import email.message
+import ssl
+import urllib.error
+import urllib.parse
+from dnscache import answer_cache, answer_records, negative_ttl
+from eyeballs import CONNECTION_ATTEMPT_DELAY
+from httpprobe import Hop
+from icmp import IcmpEngine
+from portscan import OPEN_FILTERED, UDP_PAYLOADS
+from results import (DnsResult, HeaderResult, HttpResult, PingResult,
+                     SocketResult)
+
+# TODO sudo pip3 install dnspython (2.0 or later for dns.asyncresolver)
+
+
+class AsyncToolkit:
+
+    _max_redirects = 10  # Same limit as urllib.request.HTTPRedirectHandler
+    _user_agent = 'sleuth/{}'.format(__version__)
+
+    def __init__(self, limit=None, timeout=3, dns_cache=answer_cache):
+        """
+        :param limit: integer or None, maximum number of probes in flight at
+        once across all checks of this instance; None means unbounded.
+        :param timeout: number, seconds allowed for a socket connect or an
+        HTTP exchange.
+        :param dns_cache: dnscache.AnswerCache or None, cache shared with
+        Toolkit.check_dns; None disables caching.
+        """
+        self.timeout = timeout
+        self.dns_cache = dns_cache
+        self._resolvers = {}  # name server tuple -> async resolver
+        self._limit = asyncio.Semaphore(limit) if limit else None
+
+    async def _bounded(self, coroutine):
+        if self._limit is None:
+            return await coroutine
+        async with self._limit:
+            return await coroutine
+
+    async def check_dns(self, node, nservers, qtype):
+        """
+        Awaitable version of Toolkit.check_dns.
+
+        :param node: string, IP address or hostname in DNS.
+        :param nservers: list or tuple of strings, DNS servers.
+        :param qtype: string, one of the these query types: A/CNAME, MX, PTR.
+        :return: results.DnsResult.
+        """
+        try:
+            if type(node) is not str:
+                raise TypeError('a string is required')
+            if type(nservers) is not tuple:
+                if type(nservers) is not list:
+                    raise TypeError('a list or tuple is required')
+            if type(qtype) is not str:
+                raise TypeError('a string is required')
+            assert qtype.lower() == 'a' or qtype.lower() == 'mx' or\
+                qtype.lower() == 'ptr', 'unrecognized record type'
+            _key = (node.lower(), qtype.lower(), tuple(nservers))
+            if self.dns_cache is not None:
+                _found, _value, _remaining = self.dns_cache.get(_key)
+                if _found:
+                    return DnsResult.from_value(node, qtype, _value,
+                                                int(_remaining))
+            _resolver = self._resolvers.get(_key[2])
+            if _resolver is None:
+                _resolver = dns.asyncresolver.Resolver(configure=False)
+                _resolver.nameservers = list(nservers)
+                self._resolvers[_key[2]] = _resolver
+            _qname = node
+            if qtype.lower() == 'ptr':
+                _qname = dns.reversename.from_address(node)
+            _answer = await self._bounded(_resolver.resolve(_qname, qtype))
+            _records = answer_records(_answer, qtype)
+            if self.dns_cache is not None:
+                self.dns_cache.put(_key, _records, _answer.rrset.ttl)
+            return DnsResult(node=node, qtype=qtype, records=_records,
+                             ttl=_answer.rrset.ttl)
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+            if self.dns_cache is not None:
+                self.dns_cache.put_negative(_key, e)
+            return DnsResult(node=node, qtype=qtype, ttl=negative_ttl(e),
+                             error=e)
+        except (dns.exception.SyntaxError, dns.rdatatype.UnknownRdatatype,
+                dns.resolver.NoNameservers, dns.exception.Timeout,
+                AssertionError, TypeError, ValueError) as e:
+            return DnsResult(node=node, qtype=qtype, error=e)
+
+    async def check_socket(self, node, port):
+        """
+        Awaitable version of Toolkit.check_socket.
+
+        :param node: string, IP address or hostname in DNS.
+        :param port: string, TCP/UDP port number prepended with 't' or 'u'
+        :return: results.SocketResult, with a state of 'open',
+        'unreachable' or 'open|filtered' (UDP only).
+        """
+        try:
+            if type(node) is not str:
+                raise TypeError('a string is required')
+            if type(port) is not str:
+                raise TypeError('a string is required')
+            assert port[0].lower() == 'u' or port[0].lower() == 't',\
+                'port must be prepended with u or t, received {}'.format(port)
+            assert 0 < int(port[1:]) < 65536, \
+                'port must be an integer 0-65536, received {}'.format(port[1:])
+            if port[0].lower() == 'u':
+                _state = await self._bounded(self._probe_udp(node, int(port[1:])))
+                if isinstance(_state, Exception):
+                    raise _state
+                return SocketResult(node=node, port=port, state=_state)
+            _transport, _ = await self._bounded(asyncio.wait_for(
+                asyncio.get_running_loop().create_connection(
+                    asyncio.Protocol, node, int(port[1:]),
+                    happy_eyeballs_delay=CONNECTION_ATTEMPT_DELAY),
+                self.timeout))
+        except (asyncio.TimeoutError, ConnectionError):
+            return SocketResult(node=node, port=port, state='unreachable')
+        except (OSError, OverflowError, AssertionError, TypeError,
+                ValueError) as e:
+            return SocketResult(node=node, port=port, error=e)
+        _transport.close()
+        return SocketResult(node=node, port=port, state='open')
+
+    async def _probe_udp(self, node, port, retries=2):
+        """
+        Send a datagram (see portscan.UDP_PAYLOADS) and wait for a reply or
+        an ICMP port unreachable, retransmitting up to retries times.
+        """
+        _loop = asyncio.get_running_loop()
+        _answer = _loop.create_future()
+
+        class _Probe(asyncio.DatagramProtocol):
+            def datagram_received(self, data, address):
+                if not _answer.done():
+                    _answer.set_result('open')
+
+            def error_received(self, exc):
+                if not _answer.done():
+                    _answer.set_result('unreachable' if isinstance(
+                        exc, ConnectionRefusedError) else exc)
+
+        _transport, _ = await _loop.create_datagram_endpoint(
+            _Probe, remote_addr=(node, port))
+        try:
+            for _ in range(retries + 1):
+                # Datagram transports silently drop empty payloads.
+                _transport.sendto(UDP_PAYLOADS.get(port) or b'\x00')
+                try:
+                    return await asyncio.wait_for(asyncio.shield(_answer),
+                                                  self.timeout / (retries + 1))
+                except asyncio.TimeoutError:
+                    continue
+            return OPEN_FILTERED
+        finally:
+            _transport.close()
+
+    async def check_ping(self, node, count=9, frame_size=1000):
+        """
+        Awaitable version of Toolkit.check_ping.
+
+        :param node: string, IP address or hostname in DNS.
+        :param count: integer, number of echo requests.
+        :param frame_size: integer, frame size 56-1500.
+        :return: results.PingResult, loss ratio and RTT statistics in ms.
+        """
+        try:
+            if type(count) is not int or type(frame_size) is not int:
+                raise TypeError('an integer is required')
+            assert 1 <= count <= 10000, 'count must be from 1-10000'
+            assert 56 <= frame_size <= 1500, 'frame-size must be from 56-1500'
+            _size = frame_size - 28  # 20 IP header, 8 ICMP header, in bytes.
+            with IcmpEngine() as _engine:
+                _stats = await self._bounded(
+                    _engine.ping_async([node], count, .2, _size))
+        except (OSError, AssertionError, TypeError, ValueError) as e:
+            return PingResult(node=node, error=e)
+        return PingResult.from_stats(node, _stats[node])
+
+    async def _request(self, url, method, verify=True, host_header=None):
+        """
+        Send one HTTP/1.1 request and read the status line and headers.
+
+        :return: tuple, (status line, status code, headers).
+        """
+        _parts = urllib.parse.urlsplit(url)
+        if _parts.scheme not in ('http', 'https') or not _parts.hostname:
+            raise ValueError('unknown url type: {!r}'.format(url))
+        _tls = None
+        if _parts.scheme == 'https':
+            _tls = ssl.create_default_context()
+            if not verify:
+                _tls.check_hostname = False
+                _tls.verify_mode = ssl.CERT_NONE
+        _port = _parts.port or (443 if _tls else 80)
+        _reader, _writer = await asyncio.wait_for(asyncio.open_connection(
+            _parts.hostname, _port, ssl=_tls,
+            happy_eyeballs_delay=CONNECTION_ATTEMPT_DELAY), self.timeout)
+        try:
+            _target = urllib.parse.urlunsplit(
+                ('', '', _parts.path or '/', _parts.query, ''))
+            _host = host_header or _parts.netloc.rpartition('@')[2]
+            _writer.write('{} {} HTTP/1.1\r\nHost: {}\r\nUser-Agent: {}\r\n'
+                          'Accept: */*\r\nConnection: close\r\n\r\n'.format(
+                              method, _target, _host, self._user_agent)
+                          .encode('latin-1'))
+            _status_line = (await asyncio.wait_for(
+                _reader.readline(), self.timeout)).decode('latin-1').strip()
+            _headers = email.message.Message()
+            while True:
+                _line = (await asyncio.wait_for(
+                    _reader.readline(), self.timeout)).decode('latin-1')
+                if _line in ('\r\n', '\n', ''):
+                    break
+                _name, _, _value = _line.partition(':')
+                _headers[_name.strip()] = _value.strip()
+        finally:
+            _writer.close()
+        try:
+            _status = int(_status_line.split()[1])
+        except (IndexError, ValueError):
+            raise ConnectionResetError('malformed status line {!r}'.format(
+                _status_line))
+        return _status_line, _status, _headers
+
+    async def _follow(self, url, method, verify=True, host_header=None):
+        """
+        Follow redirects like urllib/curl -L; returns every hop as an
+        httpprobe.Hop (without timings).
+        """
+        _hops = []
+        for _ in range(self._max_redirects + 1):
+            _status_line, _status, _headers = await self._request(
+                url, method, verify, host_header)
+            _version, _, _reason = (_status_line.split(' ', 2) + ['', ''])[:3]
+            _location = _headers.get('Location')
+            _hops.append(Hop(url, _version.partition('/')[2] or '1.1', _status,
+                             _reason, _location, False))
+            if _status not in (301, 302, 303, 307, 308) or not _location:
+                break
+            url = urllib.parse.urljoin(url, _location)
+        return _hops
+
+    async def check_http_code(self, url):
+        """
+        Awaitable version of Toolkit.check_http_code.
+
+        :param url: string, URL/URI to check.
+        :return: results.HttpResult, status code and reason of the last hop.
+        """
+        try:
+            if type(url) is not str:
+                raise TypeError('a string is required')
+            _hops = await self._bounded(self._follow(url, 'GET'))
+        except asyncio.TimeoutError:
+            return HttpResult(url=url, error=urllib.error.URLError('timed out'))
+        except ssl.SSLError as e:
+            return HttpResult(url=url, error=urllib.error.URLError(e))
+        except (ConnectionError, TypeError, ValueError) as e:
+            return HttpResult(url=url, error=e)
+        except OSError as e:
+            return HttpResult(url=url, error=urllib.error.URLError(e))
+        return HttpResult(url=url, status=_hops[-1].status,
+                          reason=_hops[-1].reason, hops=tuple(_hops))
+
+    async def check_header(self, uri, extra_fqdn=None):
+        """
+        Awaitable version of Toolkit.check_header; the HTTP status line and
+        Location header of every hop are reported the way curl -I -L shows
+        them, with certificate checks disabled like curl -k.
+
+        :param uri: string, URI, hostname, or IP address web services dependant.
+        :param extra_fqdn: string, value for the Host header.
+        :return: results.HeaderResult; str() gives the HTTP code and redirect
+        information of every hop.
+        """
+        try:
+            if type(uri) is not str:
+                raise TypeError('a string is required')
+            if extra_fqdn is not None:
+                if type(extra_fqdn) is not str:
+                    raise TypeError('a string is required 1')
+            _hops = await self._bounded(
+                self._follow(uri, 'HEAD', verify=False, host_header=extra_fqdn))
+        except (asyncio.TimeoutError, OSError, TypeError, ValueError) as e:
+            return HeaderResult(url=uri, error=e)
+        return HeaderResult(url=uri, hops=tuple(_hops))
+
+
+async def _main():
+    tool = AsyncToolkit()
+    results = await asyncio.gather(
+        tool.check_dns('campus.com', ['8.8.8.8'], 'a'),
+        tool.check_socket('google.com', 't80'),
+        tool.check_ping('google.com', 3, 56),
+        tool.check_http_code('https://yahoo.com'),
+        tool.check_header('http://173.194.219.102', 'www.google.com'))
+    for result in results:
+        print(result)
+
+
+def main():
+    asyncio.run(_main())
+
+
+if __name__ == "__main__":
+    main()
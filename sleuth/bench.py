@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module benchmarks the Toolkit checks and NetElement.load_data against
+local stand-ins, so runs are reproducible and never leave the host: a TCP
+listener (plus a port with nothing listening), a UDP echo listener, an HTTP
+server with redirect chains, a stub DNS server answering A, MX and PTR
+queries, and localhost for ICMP.
+
+Every benchmark reports latency percentiles from sequential calls and the
+throughput of calls issued from a thread pool. Results are written as JSON
+and can be compared against an earlier run to catch regressions; the exit
+status is 1 when a benchmark got slower than the tolerance allows, and 2 when
+the baseline cannot be compared with. --repeat runs the suite several times
+and keeps the median of every figure, which steadies the comparison.
+
+    python3 bench.py --output bench.json --repeat 3
+    python3 bench.py --output new.json --baseline bench.json --repeat 3
+
+Only runs of the same --scale are comparable.
+
+>>> from bench import StandIns, run_benchmarks
+>>> with StandIns() as stand_ins:
+...     results = run_benchmarks(stand_ins)
+>>> results['check_socket tcp open']['p50_ms']
+0.061
+"""
+
+import argparse
+import datetime
+import http.server
+import json
+import math
+import platform
+import socket
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import dns.exception
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+from dnscache import ResolverPool
+from element import NetElement
+from httpprobe import HttpProbe
+from toolkit import Toolkit
+
+
+class _HttpHandler(http.server.BaseHTTPRequestHandler):
+    """ /ok answers 200, /missing 404, /r<n> redirects n times to /ok."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _reply(self, status, headers=(), body=b''):
+        self.send_response(status)
+        for _name, _value in headers:
+            self.send_header(_name, _value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith('/r') and self.path[2:].isdigit():
+            _left = int(self.path[2:])
+            return self._reply(301, [('Location', '/r{}'.format(_left - 1)
+                                      if _left > 1 else '/ok')])
+        if self.path == '/ok':
+            return self._reply(200, body=b'ok')
+        return self._reply(404)
+
+    do_HEAD = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+class StandIns:
+
+    def __init__(self):
+        """
+        Local servers for every check, started on ephemeral ports of
+        127.0.0.1 by start() (or the with statement).
+        """
+        self.host = '127.0.0.1'
+        self.tcp_port = self.closed_port = self.udp_port = None
+        self.http_port = self.dns_port = None
+        self._sockets = []
+        self._http = None
+        self._running = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _thread(self, target, *args):
+        threading.Thread(target=target, args=args, daemon=True).start()
+
+    def start(self):
+        self._running = True
+        _tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        _tcp.bind((self.host, 0))
+        _tcp.listen(1024)
+        self.tcp_port = _tcp.getsockname()[1]
+        self._sockets.append(_tcp)
+        self._thread(self._accept, _tcp)
+
+        # Bind and close to find a port with nothing listening on it.
+        _closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        _closed.bind((self.host, 0))
+        self.closed_port = _closed.getsockname()[1]
+        _closed.close()
+
+        _udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        _udp.bind((self.host, 0))
+        self.udp_port = _udp.getsockname()[1]
+        self._sockets.append(_udp)
+        self._thread(self._echo, _udp)
+
+        _dns = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        _dns.bind((self.host, 0))
+        self.dns_port = _dns.getsockname()[1]
+        self._sockets.append(_dns)
+        self._thread(self._answer_dns, _dns)
+
+        self._http = http.server.ThreadingHTTPServer((self.host, 0),
+                                                     _HttpHandler)
+        self._http.daemon_threads = True
+        self.http_port = self._http.server_address[1]
+        self._thread(self._http.serve_forever)
+
+    def stop(self):
+        self._running = False
+        if self._http is not None:
+            self._http.shutdown()
+            self._http.server_close()
+        for _sock in self._sockets:
+            _sock.close()
+
+    def url(self, path):
+        return 'http://{}:{}{}'.format(self.host, self.http_port, path)
+
+    def _accept(self, sock):
+        while self._running:
+            try:
+                _connection, _ = sock.accept()
+            except OSError:
+                return
+            _connection.close()
+
+    def _echo(self, sock):
+        while self._running:
+            try:
+                _data, _address = sock.recvfrom(65535)
+                sock.sendto(_data, _address)
+            except OSError:
+                return
+
+    def _answer_dns(self, sock):
+        """ A and MX for any name, PTR for any address, NXDOMAIN for nx*."""
+        while self._running:
+            try:
+                _wire, _address = sock.recvfrom(65535)
+            except OSError:
+                return
+            try:
+                _query = dns.message.from_wire(_wire)
+            except dns.exception.DNSException:
+                continue
+            _response = dns.message.make_response(_query)
+            _question = _query.question[0]
+            if _question.name.to_text().startswith('nx'):
+                _response.set_rcode(dns.rcode.NXDOMAIN)
+                _response.authority.append(dns.rrset.from_text(
+                    'bench.', 300, 'IN', 'SOA',
+                    'ns.bench. admin.bench. 1 3600 600 86400 30'))
+            elif _question.rdtype == dns.rdatatype.A:
+                _response.answer.append(dns.rrset.from_text(
+                    _question.name, 300, 'IN', 'A', '10.0.0.1', '10.0.0.2'))
+            elif _question.rdtype == dns.rdatatype.MX:
+                _response.answer.append(dns.rrset.from_text(
+                    _question.name, 300, 'IN', 'MX', '10 mx1.bench.',
+                    '20 mx2.bench.'))
+            elif _question.rdtype == dns.rdatatype.PTR:
+                _response.answer.append(dns.rrset.from_text(
+                    _question.name, 300, 'IN', 'PTR', 'host.bench.'))
+            try:
+                sock.sendto(_response.to_wire(), _address)
+            except OSError:
+                return
+
+
+def _percentile(ordered, p):
+    _rank = (len(ordered) - 1) * p / 100
+    _low = math.floor(_rank)
+    _high = math.ceil(_rank)
+    return ordered[_low] + (ordered[_high] - ordered[_low]) * (_rank - _low)
+
+
+def measure(call, iterations, threads=8, duration=0.5, warmup=3):
+    """
+    Time call: latency percentiles over iterations sequential calls, then
+    throughput of threads workers calling it back to back for duration
+    seconds.
+
+    :param call: callable without arguments.
+    :param iterations: integer, calls timed for the latency percentiles.
+    :param threads: integer, workers for the throughput phase.
+    :param duration: number, seconds the throughput phase lasts (at least
+    one call per worker).
+    :param warmup: integer, untimed calls made first.
+    :return: dict with iterations, mean_ms, p50_ms, p90_ms, p99_ms, max_ms
+    and ops_per_s.
+    """
+    for _ in range(warmup):
+        call()
+    _latencies = []
+    for _ in range(iterations):
+        _start = time.perf_counter()
+        call()
+        _latencies.append((time.perf_counter() - _start) * 1000)
+    _latencies.sort()
+
+    def _worker(deadline):
+        _calls = 0
+        while True:
+            call()
+            _calls += 1
+            if time.perf_counter() >= deadline:
+                return _calls
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        _start = time.perf_counter()
+        _calls = sum(future.result() for future in [
+            pool.submit(_worker, _start + duration) for _ in range(threads)])
+        _elapsed = time.perf_counter() - _start
+
+    return {'iterations': iterations,
+            'mean_ms': round(sum(_latencies) / len(_latencies), 3),
+            'p50_ms': round(_percentile(_latencies, 50), 3),
+            'p90_ms': round(_percentile(_latencies, 90), 3),
+            'p99_ms': round(_percentile(_latencies, 99), 3),
+            'max_ms': round(_latencies[-1], 3),
+            'ops_per_s': round(_calls / _elapsed, 1)}
+
+
+def run_benchmarks(stand_ins, scale=1.0, only=None):
+    """
+    Run every benchmark against stand_ins.
+
+    :param stand_ins: StandIns object, already started.
+    :param scale: number, multiplies the iterations of every benchmark.
+    :param only: string or None, run only benchmarks whose name contains it.
+    :return: dict, benchmark name -> measure() result.
+    """
+    _host = stand_ins.host
+    _nservers = (_host,)
+    _resolvers = ResolverPool(port=stand_ins.dns_port)
+    _http = HttpProbe()
+    _cached = Toolkit(resolvers=_resolvers, http=_http)
+    _uncached = Toolkit(dns_cache=None, resolvers=_resolvers, http=_http)
+    _element = NetElement(_host, 'Benchmark', dns_types=('a', 'mx'),
+                          dns_servers=_nservers,
+                          ports=('t{}'.format(stand_ins.tcp_port),
+                                 't{}'.format(stand_ins.closed_port)),
+                          urls=(stand_ins.url('/ok'), stand_ins.url('/r2')),
+                          note=None, concurrent=True, toolkit=_uncached,
+                          freshness={'dns': 0, 'socket': 0, 'url': 0})
+    _batch = [('host{}.bench'.format(i), 'a') for i in range(100)]
+
+    def _load_data():
+        _element.load_data()
+        _element.reset_attributes()
+
+    _benchmarks = [
+        ('check_dns a', 400, lambda: _uncached.check_dns(
+            'www.bench', _nservers, 'a')),
+        ('check_dns mx', 400, lambda: _uncached.check_dns(
+            'bench', _nservers, 'mx')),
+        ('check_dns ptr', 400, lambda: _uncached.check_dns(
+            '10.0.0.1', _nservers, 'ptr')),
+        ('check_dns cached', 2000, lambda: _cached.check_dns(
+            'www.bench', _nservers, 'a')),
+        ('check_dns_many 100', 20, lambda: _uncached.check_dns_many(
+            _batch, _nservers)),
+        ('check_socket tcp open', 400, lambda: _uncached.check_socket(
+            _host, 't{}'.format(stand_ins.tcp_port))),
+        ('check_socket tcp closed', 400, lambda: _uncached.check_socket(
+            _host, 't{}'.format(stand_ins.closed_port))),
+        ('check_socket udp open', 200, lambda: _uncached.check_socket(
+            _host, 'u{}'.format(stand_ins.udp_port))),
+        ('check_ping', 100, lambda: _uncached.check_ping(_host, 1, 56)),
+        ('check_http_code', 400, lambda: _uncached.check_http_code(
+            stand_ins.url('/ok'))),
+        ('check_http_code redirects', 200, lambda: _uncached.check_http_code(
+            stand_ins.url('/r3'))),
+        ('check_header', 200, lambda: _uncached.check_header(
+            stand_ins.url('/r3'))),
+        # Dominated by the element's 9 pings at 200ms intervals; one thread,
+        # since an element builds its report in place.
+        ('NetElement.load_data', 3, _load_data),
+    ]
+    _serial = ('NetElement.load_data',)
+    _results = {}
+    try:
+        for _name, _iterations, _call in _benchmarks:
+            if only and only not in _name:
+                continue
+            _results[_name] = measure(
+                _call, max(1, int(_iterations * scale)),
+                threads=1 if _name in _serial else 8,
+                duration=0.5 * scale, warmup=1 if _name in _serial else 3)
+    finally:
+        _http.close()
+    return _results
+
+
+def median_results(runs):
+    """
+    Merge the results of repeated run_benchmarks calls into the median of
+    every figure.
+
+    :param runs: list of run_benchmarks results.
+    :return: dict, benchmark name -> measure() result.
+    """
+    return {_name: {_key: round(statistics.median(
+                        _run[_name][_key] for _run in runs), 3)
+                    for _key in _result}
+            for _name, _result in runs[0].items()}
+
+
+def compare(results, baseline, tolerance=0.2, slack_ms=0.05, gate_ms=1.0):
+    """
+    Compare results against baseline results.
+
+    :param tolerance: number, allowed slowdown as a fraction (0.2 = 20%) of
+    the baseline p50 latency and throughput.
+    :param slack_ms: number, p50 increases smaller than this are noise.
+    :param gate_ms: number, throughput is only compared for benchmarks whose
+    baseline p50 is at least this; below it, a short throughput phase
+    measures thread scheduling more than the check and varies severalfold
+    between identical runs.
+    :return: list of (name, metric, baseline value, new value) tuples, one
+    per regression.
+    """
+    _regressions = []
+    for _name, _old in baseline.items():
+        _new = results.get(_name)
+        if _new is None:
+            continue
+        if _new['p50_ms'] > _old['p50_ms'] * (1 + tolerance) + slack_ms:
+            _regressions.append((_name, 'p50_ms', _old['p50_ms'],
+                                 _new['p50_ms']))
+        if _old['p50_ms'] >= gate_ms and \
+                _new['ops_per_s'] < _old['ops_per_s'] / (1 + tolerance):
+            _regressions.append((_name, 'ops_per_s', _old['ops_per_s'],
+                                 _new['ops_per_s']))
+    return _regressions
+
+
+def print_results(results, baseline=None):
+    print('{:<28}{:>10}{:>10}{:>10}{:>10}{:>12}'.format(
+        'benchmark', 'p50 ms', 'p90 ms', 'p99 ms', 'mean ms', 'ops/s'))
+    for _name, _result in results.items():
+        print('{:<28}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}{:>12.1f}'.format(
+            _name, _result['p50_ms'], _result['p90_ms'], _result['p99_ms'],
+            _result['mean_ms'], _result['ops_per_s']), end='')
+        if baseline and _name in baseline:
+            print('  ({:+.0%} p50, {:+.0%} ops/s)'.format(
+                _result['p50_ms'] / baseline[_name]['p50_ms'] - 1
+                if baseline[_name]['p50_ms'] else 0,
+                _result['ops_per_s'] / baseline[_name]['ops_per_s'] - 1
+                if baseline[_name]['ops_per_s'] else 0), end='')
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the sleuth checks against local stand-ins.')
+    parser.add_argument('--output', default='bench.json',
+                        help='file the results are written to')
+    parser.add_argument('--baseline',
+                        help='results file of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown, as a fraction of the baseline')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiplier for the number of iterations')
+    parser.add_argument('--only',
+                        help='run only benchmarks whose name contains this')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='runs of the suite; the median is kept')
+    args = parser.parse_args()
+
+    # Check the baseline before spending minutes on the suite.
+    baseline = None
+    if args.baseline:
+        try:
+            with open(args.baseline) as f:
+                _saved = json.load(f)
+            baseline = _saved['results']
+        except (OSError, ValueError, KeyError) as e:
+            print('Cannot read the baseline {}: {}'.format(args.baseline, e),
+                  file=sys.stderr)
+            sys.exit(2)
+        if _saved.get('scale', 1.0) != args.scale:
+            print('The baseline was run with --scale {}; compare runs of the '
+                  'same scale.'.format(_saved.get('scale', 1.0)),
+                  file=sys.stderr)
+            sys.exit(2)
+
+    with StandIns() as stand_ins:
+        results = median_results([run_benchmarks(stand_ins, args.scale,
+                                                 args.only)
+                                  for _ in range(max(1, args.repeat))])
+    print_results(results, baseline)
+
+    with open(args.output, 'w') as f:
+        json.dump({'sleuth': __version__,
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                   'scale': args.scale,
+                   'repeat': max(1, args.repeat),
+                   'results': results}, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for name, metric, old, new in regressions:
+            print('REGRESSION {}: {} {} -> {}'.format(name, metric, old, new),
+                  file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
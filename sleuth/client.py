@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module is the thin client of the sleuth agent (module agent). It only
+imports the standard library and module results, so scripts using it start
+in milliseconds; the checks run in the agent, whose resolvers, connection
+pools and caches stay warm between runs and are shared by every operator
+connected to it.
+
+AgentClient has the check methods of Toolkit and returns the same result
+records, with errors rebuilt as results.RemoteError. connect() returns a
+client of a running agent, starting one in the background when there is
+none, and falls back to an in-process Toolkit when no agent can be reached.
+
+>>> import client
+>>> tool = client.connect()
+>>> print(tool.check_dns('google.com', ('8.8.8.8',), 'a'))
+142.250.80.46
+>>> print(client.report({'name': 'google.com', 'kind': 'Web server',
+...                      'urls': ['https://google.com']}))
+"""
+
+import functools
+import json
+import os
+import socket
+import stat
+import subprocess
+import sys
+import threading
+import time
+from results import from_wire
+
+# Toolkit methods the agent runs. The SSH checks are left out: the agent's
+# pooled SSH masters would let any operator reuse another one's sessions.
+CHECKS = ('check_dns', 'check_dns_many', 'check_socket', 'check_dual_stack',
+          'scan_sockets', 'check_ping', 'check_ping_many', 'check_http_code',
+          'check_header', 'check_tls', 'check_trace', 'check_pmtu')
+
+
+def default_socket():
+    """
+    Path of the agent's Unix socket: $SLEUTH_AGENT, else sleuth.sock in
+    $XDG_RUNTIME_DIR, else agent.sock in /tmp/sleuth-<uid>, a directory the
+    agent creates with mode 0700.
+    """
+    if os.environ.get('SLEUTH_AGENT'):
+        return os.environ['SLEUTH_AGENT']
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'sleuth.sock')
+    return os.path.join('/tmp', 'sleuth-{}'.format(os.getuid()), 'agent.sock')
+
+
+class AgentError(ConnectionError):
+    """ The agent could not be reached, or refused a request."""
+
+
+def check_owner(path):
+    """
+    Make sure the socket at path and its directory belong to this user and
+    that nobody else may write to the directory, so that no other local
+    user can have put an agent there that answers with forged results.
+
+    Raises AgentError otherwise.
+    """
+    _uid = os.getuid()
+    try:
+        _directory = os.lstat(os.path.dirname(path) or '.')
+        _socket = os.lstat(path)
+    except OSError as e:
+        raise AgentError('no sleuth agent at {}: {}'.format(path, e))
+    if not stat.S_ISDIR(_directory.st_mode) or _directory.st_uid != _uid or \
+            _directory.st_mode & 0o022:
+        raise AgentError('{} is not a directory only this user may write '
+                         'to'.format(os.path.dirname(path)))
+    if not stat.S_ISSOCK(_socket.st_mode) or _socket.st_uid != _uid:
+        raise AgentError('{} is not a socket of this user'.format(path))
+
+
+class AgentClient:
+
+    def __init__(self, path=None, timeout=None):
+        """
+        Client of one sleuth agent; the connection is opened on first use
+        and shared by every thread using the client.
+
+        :param path: string or None, the agent's Unix socket; defaults to
+        default_socket(). Only a socket given here or in $SLEUTH_AGENT may
+        belong to another user (a shared agent); a default one must pass
+        check_owner.
+        :param timeout: number or None, seconds to wait for an answer.
+        """
+        self.path = path or default_socket()
+        self._trusted = path is not None or bool(
+            os.environ.get('SLEUTH_AGENT'))
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name in CHECKS:
+            return functools.partial(self.call, name)
+        raise AttributeError(name)
+
+    def _connect(self):
+        if not self._trusted:
+            check_owner(self.path)
+        _sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        _sock.settimeout(self.timeout)
+        try:
+            _sock.connect(self.path)
+        except OSError as e:
+            _sock.close()
+            raise AgentError('no sleuth agent at {}: {}'.format(self.path, e))
+        self._sock = _sock
+        self._reader = _sock.makefile('rb')
+
+    def request(self, message):
+        """
+        Send one request and wait for its answer.
+
+        :param message: dict, see module agent for the operations.
+        :return: the answer's result; raises AgentError when the agent
+        refused the request or went away.
+        """
+        _line = (json.dumps(message) + '\n').encode()
+        with self._lock:
+            if self._sock is None:
+                self._connect()
+            try:
+                self._sock.sendall(_line)
+                _answer = self._reader.readline()
+            except OSError as e:
+                self.close()
+                raise AgentError('sleuth agent went away: {}'.format(e))
+            if not _answer:
+                self.close()
+                raise AgentError('sleuth agent closed the connection')
+        _answer = json.loads(_answer)
+        if not _answer['ok']:
+            raise AgentError(_answer['error'])
+        return _answer['result']
+
+    def call(self, check, *args, **kwargs):
+        """ Run a Toolkit check (see CHECKS) in the agent."""
+        return from_wire(self.request({'op': 'check', 'check': check,
+                                       'args': args, 'kwargs': kwargs}))
+
+    def report(self, definition, concurrent=True):
+        """
+        The report of the element an inventory record describes (see module
+        inventory), as str(NetElement) gives it. The agent keeps the element,
+        so cached results are shared with every later request for it.
+        """
+        return self.request({'op': 'report', 'element': definition,
+                             'concurrent': concurrent})
+
+    def status(self):
+        """ The agent's pid, uptime, request count and cache counters."""
+        return self.request({'op': 'status'})
+
+    def close(self):
+        if self._sock is not None:
+            self._reader.close()
+            self._sock.close()
+            self._sock = self._reader = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def spawn(path=None, idle=1800, wait=5):
+    """
+    Start an agent in the background and wait for its socket.
+
+    :param idle: number, seconds without requests after which it exits.
+    :param wait: number, seconds to wait for it to listen.
+    :return: AgentClient; raises AgentError when it did not come up.
+    """
+    _path = path or default_socket()
+    subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(
+            __file__)), 'agent.py'), '--socket', _path, '--idle', str(idle)],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL, start_new_session=True)
+    _deadline = time.monotonic() + wait
+    while True:
+        _client = AgentClient(path)
+        try:
+            _client.status()
+            return _client
+        except AgentError:
+            if time.monotonic() >= _deadline:
+                raise
+            time.sleep(0.05)
+
+
+def connect(path=None, start=True):
+    """
+    A client of the agent at path, starting one if start is True and none
+    is running; without an agent, an in-process toolkit.Toolkit.
+
+    :return: AgentClient or toolkit.Toolkit.
+    """
+    _client = AgentClient(path)
+    try:
+        _client.status()
+        return _client
+    except AgentError:
+        pass
+    if start:
+        try:
+            return spawn(path)
+        except AgentError:
+            pass
+    from toolkit import Toolkit
+    return Toolkit()
+
+
+def report(definition, path=None, start=True, concurrent=True):
+    """
+    The report of the element an inventory record describes, produced by
+    the agent when one is reachable (see connect), else in this process.
+
+    :return: string.
+    """
+    _tool = connect(path, start)
+    if isinstance(_tool, AgentClient):
+        with _tool:
+            return _tool.report(definition, concurrent)
+    import inventory
+    return str(inventory.build(definition, concurrent=concurrent))
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module resolves many (name, qtype) questions in one call. Queries are
+pipelined over a single non-blocking UDP socket per address family, up to a
+window of queries in flight at once, and responses are matched back to their
+question by message id, question section and server address as they arrive.
+Unanswered queries are retransmitted to the next name server.
+
+Answers are read from and written to the same dnscache.AnswerCache used by
+Toolkit.check_dns, so batch and single lookups share one cache.
+
+>>> from dnsbatch import resolve_many
+>>> [str(result) for result in resolve_many(
+...     [('google.com', 'a'), ('8.8.8.8', 'ptr')], ('8.8.8.8',))]
+['142.250.80.46', 'dns.google.']
+"""
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.query
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.resolver
+import dns.reversename
+import random
+import selectors
+import socket
+import time
+from collections import deque
+from dnscache import answer_cache, answer_records, negative_ttl
+from results import DnsResult
+
+
+class _Query:
+    """ One distinct question and its send state."""
+
+    __slots__ = ('key', 'qname', 'qtype', 'request', 'attempts', 'server',
+                 'wire')
+
+    def __init__(self, key, qname, qtype):
+        self.key = key
+        self.qname = qname
+        self.qtype = qtype
+        self.request = dns.message.make_query(qname, qtype)
+        self.attempts = 0
+        self.server = None
+        self.wire = None
+
+
+class BatchResolver:
+
+    def __init__(self, nservers, port=53, timeout=2.0, retries=2, window=512,
+                 cache=answer_cache):
+        """
+        :param nservers: list or tuple of strings, DNS servers; retransmits
+        rotate through them.
+        :param port: integer, DNS server port.
+        :param timeout: number, seconds to wait for each response.
+        :param retries: integer, retransmits per query after the first send.
+        :param window: integer, maximum number of queries in flight.
+        :param cache: dnscache.AnswerCache or None.
+        """
+        if type(nservers) is not tuple and type(nservers) is not list:
+            raise TypeError('a list or tuple is required')
+        if not nservers:
+            raise ValueError('at least one name server is required')
+        self.nservers = tuple(nservers)
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.window = window
+        self.cache = cache
+
+    def _key(self, node, qtype):
+        return node.lower(), qtype, self.nservers
+
+    def resolve(self, queries):
+        """
+        Resolve every (node, qtype) pair; qtype is one of A/CNAME, MX, PTR and
+        node is an IP address for PTR queries.
+
+        :param queries: iterable of (string, string) tuples.
+        :return: list of results.DnsResult aligned with queries; failed
+        queries carry their exception in the error field.
+        """
+        _queries = list(queries)
+        _results = [None] * len(_queries)
+        _waiting = {}  # cache key -> [result indexes]
+        _todo = deque()
+        for _index, (_node, _qtype) in enumerate(_queries):
+            try:
+                if type(_node) is not str or type(_qtype) is not str:
+                    raise TypeError('a string is required')
+                assert _qtype.lower() in ('a', 'mx', 'ptr'), \
+                    'unrecognized record type'
+                _key = self._key(_node, _qtype.lower())
+                if self.cache is not None:
+                    _found, _value, _remaining = self.cache.get(_key)
+                    if _found:
+                        _results[_index] = DnsResult.from_value(
+                            _node, _qtype, _value, int(_remaining))
+                        continue
+                if _key in _waiting:
+                    _waiting[_key].append(_index)
+                    continue
+                if _qtype.lower() == 'ptr':
+                    _qname = dns.reversename.from_address(_node)
+                else:
+                    _qname = dns.name.from_text(_node)
+            except (AssertionError, TypeError, ValueError,
+                    dns.exception.SyntaxError) as e:
+                _results[_index] = DnsResult(node=_node, qtype=_qtype, error=e)
+                continue
+            _waiting[_key] = [_index]
+            _todo.append(_Query(_key, _qname, _qtype.lower()))
+
+        for _query, _value, _ttl in self._exchange(_todo):
+            for _index in _waiting[_query.key]:
+                _node, _qtype = _queries[_index]
+                _results[_index] = DnsResult.from_value(_node, _qtype, _value,
+                                                        _ttl)
+        return _results
+
+    def _store(self, query, value, ttl=None):
+        if isinstance(value, (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)):
+            ttl = negative_ttl(value, self.cache.negative_default
+                               if self.cache is not None else 60)
+        if self.cache is not None and ttl is not None:
+            self.cache.put(query.key, value, ttl)
+        return query, value, ttl
+
+    def _answer(self, query, response):
+        """ Turn a matched response into a result, or None to retry."""
+        if response.flags & dns.flags.TC:
+            # Too big for UDP; fetch this one over TCP.
+            try:
+                response = dns.query.tcp(query.request, query.server,
+                                         timeout=self.timeout, port=self.port)
+            except (OSError, dns.exception.DNSException):
+                return None
+        _rcode = response.rcode()
+        if _rcode == dns.rcode.NXDOMAIN:
+            return self._store(query, dns.resolver.NXDOMAIN(
+                qnames=[query.qname], responses={query.qname: response}))
+        if _rcode != dns.rcode.NOERROR:
+            return None
+        _answer = dns.resolver.Answer(query.qname, query.request.question[0].rdtype,
+                                      dns.rdataclass.IN, response)
+        if _answer.rrset is None:
+            return self._store(query, dns.resolver.NoAnswer(response=response))
+        return self._store(query, answer_records(_answer.rrset, query.qtype),
+                           _answer.chaining_result.minimum_ttl)
+
+    def _exchange(self, todo):
+        """ Pipeline the queries in todo; yields (query, result, ttl)."""
+        if not todo:
+            return
+        _selector = selectors.DefaultSelector()
+        _sockets = {}  # address family -> socket
+        _in_flight = {}  # (message id, server) -> query
+        _deadlines = deque()  # (deadline, message id, server, attempt)
+        _next_id = random.randrange(0x10000)
+
+        def _socket(server):
+            _family = socket.AF_INET6 if ':' in server else socket.AF_INET
+            if _family not in _sockets:
+                _sock = socket.socket(_family, socket.SOCK_DGRAM)
+                _sock.setblocking(False)
+                _selector.register(_sock, selectors.EVENT_READ)
+                _sockets[_family] = _sock
+            return _sockets[_family]
+
+        def _send(query):
+            nonlocal _next_id
+            while True:
+                _next_id = (_next_id + 1) & 0xffff
+                _server = self.nservers[query.attempts % len(self.nservers)]
+                if (_next_id, _server) not in _in_flight:
+                    break
+            query.request.id = _next_id
+            query.server = _server
+            query.wire = query.request.to_wire()
+            query.attempts += 1
+            _in_flight[(_next_id, _server)] = query
+            _deadlines.append((time.monotonic() + self.timeout, _next_id,
+                               _server, query.attempts))
+            try:
+                _socket(_server).sendto(query.wire, (_server, self.port))
+            except OSError:
+                # Leave it in flight; the deadline retries or fails it.
+                pass
+
+        def _retry_or_fail(query, error):
+            if query.attempts <= self.retries:
+                _send(query)
+                return None
+            return query, error, None
+
+        try:
+            while todo or _in_flight:
+                while todo and len(_in_flight) < self.window:
+                    _send(todo.popleft())
+
+                _wait = max(0.0, _deadlines[0][0] - time.monotonic()) \
+                    if _deadlines else self.timeout
+                for _key, _ in _selector.select(_wait):
+                    while True:
+                        try:
+                            _wire, _source = _key.fileobj.recvfrom(65535)
+                        except (BlockingIOError, InterruptedError):
+                            break
+                        except OSError:
+                            # ICMP errors surface here on some systems.
+                            continue
+                        try:
+                            _response = dns.message.from_wire(_wire)
+                        except dns.exception.DNSException:
+                            continue
+                        _query = _in_flight.get((_response.id, _source[0]))
+                        if _query is None or not _query.request.is_response(
+                                _response):
+                            continue
+                        del _in_flight[(_response.id, _source[0])]
+                        _done = self._answer(_query, _response)
+                        if _done is None:
+                            _done = _retry_or_fail(_query, dns.resolver.NoNameservers(
+                                request=_query.request,
+                                errors=[(_source[0], False, self.port,
+                                         dns.rcode.to_text(_response.rcode()),
+                                         _response)]))
+                        if _done is not None:
+                            yield _done
+
+                _now = time.monotonic()
+                while _deadlines and _deadlines[0][0] <= _now:
+                    _, _id, _server, _attempt = _deadlines.popleft()
+                    _query = _in_flight.get((_id, _server))
+                    if _query is None or _query.attempts != _attempt:
+                        continue
+                    del _in_flight[(_id, _server)]
+                    _done = _retry_or_fail(_query, dns.exception.Timeout(
+                        timeout=self.timeout * _query.attempts))
+                    if _done is not None:
+                        yield _done
+        finally:
+            for _sock in _sockets.values():
+                _selector.unregister(_sock)
+                _sock.close()
+            _selector.close()
+
+
+def resolve_many(queries, nservers, **kwargs):
+    """
+    Convenience wrapper around BatchResolver(nservers, **kwargs).resolve().
+    """
+    return BatchResolver(nservers, **kwargs).resolve(queries)
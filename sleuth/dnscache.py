@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module provides the shared DNS plumbing used by Toolkit.check_dns: a pool
+of dnspython resolvers keyed by name server tuple, and a bounded LRU answer
+cache that honors record TTLs and caches negative answers (NXDOMAIN, NoAnswer)
+for the negative TTL found in the zone's SOA record.
+
+>>> from dnscache import answer_cache
+>>> from toolkit import Toolkit
+>>> tool = Toolkit()
+>>> result = tool.check_dns('google.com', ('8.8.8.8',), 'a')
+>>> result = tool.check_dns('google.com', ('8.8.8.8',), 'a')  # cached
+>>> print(answer_cache.hits, answer_cache.misses)
+1 1
+"""
+
+import dns.rdatatype
+import dns.resolver
+import threading
+import time
+from collections import OrderedDict
+
+
+def answer_records(answer, qtype):
+    """
+    Render each record of a dnspython answer or rrset the way check_dns
+    reports it.
+
+    :return: tuple of strings, one per record.
+    """
+    if qtype.lower() == 'mx':
+        return tuple('Host {} preferance {}'.format(
+            rdata.exchange, rdata.preference) for rdata in answer)
+    # Handles A, CNAME and PTR records
+    return tuple(str(record) for record in answer)
+
+
+def format_answer(answer, qtype):
+    """ Render a dnspython answer or rrset as one comma separated string."""
+    return ', '.join(answer_records(answer, qtype))
+
+
+def negative_ttl(error, default=60):
+    """
+    TTL for caching an NXDOMAIN or NoAnswer exception: the smaller of the SOA
+    record TTL and its MINIMUM field (RFC 2308), or default when the response
+    carries no SOA record.
+
+    :param error: dns.resolver.NXDOMAIN or dns.resolver.NoAnswer instance.
+    :param default: number, seconds used when no SOA record is found.
+    :return: number, seconds.
+    """
+    _responses = []
+    try:
+        if isinstance(error, dns.resolver.NXDOMAIN):
+            _responses = list(error.responses().values())
+        else:
+            _responses = [error.response()]
+    except (AttributeError, KeyError, TypeError):
+        pass
+    for _response in _responses:
+        for _rrset in getattr(_response, 'authority', ()):
+            if _rrset.rdtype == dns.rdatatype.SOA:
+                return min(_rrset.ttl, _rrset[0].minimum)
+    return default
+
+
+class ResolverPool:
+
+    def __init__(self, port=53):
+        """
+        One dnspython Resolver per name server tuple, built on first use.
+
+        :param port: integer, DNS server port the resolvers query.
+        """
+        self.port = port
+        self._resolvers = {}
+        self._lock = threading.Lock()
+
+    def get(self, nservers):
+        """
+        :param nservers: list or tuple of strings, DNS servers.
+        :return: dns.resolver.Resolver using exactly those name servers.
+        """
+        _key = tuple(nservers)
+        _resolver = self._resolvers.get(_key)
+        if _resolver is None:
+            with self._lock:
+                _resolver = self._resolvers.get(_key)
+                if _resolver is None:
+                    _resolver = dns.resolver.Resolver(configure=False)
+                    _resolver.nameservers = list(_key)
+                    _resolver.port = self.port
+                    self._resolvers[_key] = _resolver
+        return _resolver
+
+    def __len__(self):
+        return len(self._resolvers)
+
+
+class AnswerCache:
+
+    def __init__(self, maxsize=10000, negative_default=60):
+        """
+        Thread-safe LRU cache of DNS results with per-entry expiry. Values
+        are tuples of record strings (see answer_records) or the negative
+        answer exception.
+
+        :param maxsize: integer, maximum number of entries kept.
+        :param negative_default: number, seconds a negative answer is kept
+        when its response has no SOA record.
+        """
+        self.maxsize = maxsize
+        self.negative_default = negative_default
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expiry, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :return: tuple, (found, value, remaining ttl in seconds); found is
+        False on a miss or an expired entry.
+        """
+        with self._lock:
+            _entry = self._entries.get(key)
+            if _entry is not None:
+                _remaining = _entry[0] - time.monotonic()
+                if _remaining > 0:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, _entry[1], _remaining
+                del self._entries[key]
+            self.misses += 1
+            return False, None, 0
+
+    def put(self, key, value, ttl):
+        """
+        Store value for ttl seconds; entries with a TTL of 0 are not stored.
+        The least recently used entry is evicted once maxsize is reached.
+        """
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def put_negative(self, key, error):
+        """ Store an NXDOMAIN or NoAnswer exception for its negative TTL."""
+        self.put(key, error, negative_ttl(error, self.negative_default))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return 'AnswerCache(size={}, maxsize={}, hits={}, misses={})'.format(
+            len(self), self.maxsize, self.hits, self.misses)
+
+
+resolver_pool = ResolverPool()
+answer_cache = AnswerCache()
@@ -3,26 +3,85 @@
 __author__ = 'rafael'
 __version__ = '0.0.0'
 
+import dns.resolver
+import errno
+import os
+import socket
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from metrics import is_timeout
+from results import HttpResult, SocketResult
 from toolkit import Toolkit
 
 # TODO place package in /usr/local/bin
 
+# Checks keep no state on the Toolkit, so every element shares this one.
+toolkit = Toolkit()
+
+# Check kinds in report order; see NetElement.run_check.
+CHECKS = ('dns', 'ping', 'socket', 'url', 'tls')
+
+# Seconds a result is served from the cache when an element is printed; None
+# for DNS follows the record TTL (or the negative TTL of NXDOMAIN/NoAnswer).
+# TLS results stay fresh for an hour; certificates change rarely.
+FRESHNESS = {'dns': None, 'ping': 0, 'socket': 60, 'url': 30, 'tls': 3600}
+
+# What load_data does with the port and URL checks of a host that DNS and
+# ping show to be down: run them anyway (None), infer their results without
+# probing ('skip'), or probe with SHORT_TIMEOUT and mark failures as
+# inferred ('shorten'). A host whose name does not resolve is skipped in
+# both modes.
+DEPENDENCIES = (None, 'skip', 'shorten')
+SHORT_TIMEOUT = 0.5  # seconds
+
+# An element's name is resolved once per load_data (see NetElement.addresses)
+# and the ping, port and URL probes go to those addresses: the first IPv4
+# address, or the first IPv6 one for a name without A records. With
+# per_address they probe every one of them, and report lines say which
+# address answered, e.g. 'Port t443 at 142.250.80.46: open'. With dual_stack
+# ports and URLs race IPv6 and IPv4 instead (module eyeballs), e.g.
+# 'Port t443: open (IPv6 12.311ms, IPv4 13.877ms; IPv6 won)'. Pings are IPv4.
+
+# tls is a tuple of TCP ports whose TLS service and certificate are inspected
+# (Toolkit.check_tls) with the element's name as the server name, e.g.
+# 'TLS port 443: TLSv1.3 TLS_AES_256_GCM_SHA384, certificate expires in 61
+# days (handshake 11.730ms, resumed)'. Like ports, they go to the first
+# address, or to every address with per_address.
+
 
 class NetElement:
     def __init__(self, name, element_kind, **kwargs):
-        self.Toolkit = Toolkit()
+        self.Toolkit = kwargs.get('toolkit', toolkit)
         self.name = name
         self.element_kind = element_kind
         self.nservers = kwargs['dns_servers']
         self.ports = kwargs['ports']
         self.urls = kwargs['urls']
+        self.tls = kwargs.get('tls', None)
         self.qtypes = kwargs['dns_types']
         self.note = kwargs['note']
+        self.concurrent = kwargs.get('concurrent', False)
+        self.workers = kwargs.get('workers', None)
+        self.intervals = kwargs.get('intervals', None)
+        self.freshness = dict(FRESHNESS, **(kwargs.get('freshness') or {}))
+        self.dependencies = kwargs.get('dependencies', None)
+        self.per_address = kwargs.get('per_address', False)
+        self.dual_stack = kwargs.get('dual_stack', False)
+        self._addresses = None  # resolved addresses while load_data runs
+        self._down = None  # (reason, certain) while load_data runs
+        self._dns_records = None
+        self._ping_records = None
+        self._cache = {}  # (check, item) -> (result, checked at, expires at)
+        self._cache_lock = threading.Lock()
         #self._ping_result = None
         self._packet_loss = None
         self._rtt = None
         self._socket_result = None
         self._url_result = None
+        self._tls_result = None
         self._dns_result = None
         self._data = []
         try:
@@ -57,6 +116,48 @@ class NetElement:
             assert type(self.urls) is tuple or self.urls is None,\
                 'Validation error; expected a tuple for URLs, received {}.'\
                 .format(type(self.urls))
+
+            assert self.tls is None or (type(self.tls) is tuple and all(
+                type(port) is int and 0 < port < 65536 for port in self.tls)),\
+                'Validation error; expected a tuple of TCP ports for tls, received {}.'\
+                .format(self.tls)
+
+            assert type(self.concurrent) is bool,\
+                'Validation error; expected a bool for concurrent, received {}.'\
+                .format(type(self.concurrent))
+
+            assert self.workers is None or \
+                (type(self.workers) is int and self.workers > 0),\
+                'Validation error; expected a positive int for workers, received {}.'\
+                .format(self.workers)
+
+            assert self.intervals is None or (type(self.intervals) is dict and
+                all(check in CHECKS and interval > 0
+                    for check, interval in self.intervals.items())),\
+                'Validation error; expected a dict of check: seconds for intervals, '\
+                'received {}.'.format(self.intervals)
+
+            assert set(self.freshness) == set(CHECKS) and all(
+                (seconds is None and check == 'dns') or
+                (type(seconds) in (int, float) and seconds >= 0)
+                for check, seconds in self.freshness.items()),\
+                'Validation error; expected a dict of check: seconds for freshness, '\
+                'received {}.'.format(kwargs.get('freshness'))
+
+            assert self.dependencies in DEPENDENCIES,\
+                "Validation error; expected None, 'skip' or 'shorten' for "\
+                'dependencies, received {}.'.format(self.dependencies)
+
+            assert type(self.per_address) is bool,\
+                'Validation error; expected a bool for per_address, received {}.'\
+                .format(type(self.per_address))
+
+            assert type(self.dual_stack) is bool,\
+                'Validation error; expected a bool for dual_stack, received {}.'\
+                .format(type(self.dual_stack))
+
+            assert not (self.per_address and self.dual_stack),\
+                'Validation error; per_address and dual_stack are exclusive.'
         except AssertionError as e:
             print(e)
             exit()
@@ -66,7 +167,12 @@ class NetElement:
         self._rtt = None
         self._socket_result = None
         self._url_result = None
+        self._tls_result = None
         self._dns_result = None
+        self._down = None
+        self._dns_records = None
+        self._ping_records = None
+        self._addresses = None
         self._data = []
 
     def __str__(self):
@@ -77,33 +183,400 @@ class NetElement:
         return _results
 
     def get_dns(self):
-        self._dns_result =['DNS {} record: {}'.format(qtype.upper(), self.Toolkit.check_dns(
-            self.name, self.nservers, qtype)) for qtype in self.qtypes]
+        self._dns_result = self._dns_lines()
         return self._dns_result
 
     def get_ping(self):
-        _output = self.Toolkit.check_ping(self.name)
-        try:
-            self._packet_loss = 'Packet loss: {}'.format(_output.split(',')[0])
-            self._rtt = _output.split(',')[1]
-        except IndexError:
-            return 'connection error'
-        return self._packet_loss
+        return self._ping_line()
 
     def get_rtt(self):
-        return 'Latency (RTTms): {}'.format(self._rtt)
+        return self._rtt
 
     def get_socket(self):
-        self._socket_result = ['Port {}: {}'.format(port, self.Toolkit.check_socket(
-            self.name, port)) for port in self.ports]
+        self._socket_result = self._socket_lines()
         return self._socket_result
 
     def get_url(self):
-        self._url_result = ['URL {}: {}'.format(url, self.Toolkit.check_http_code(
-            url)) for url in self.urls]
+        self._url_result = [self._url_line(url) for url in self.urls]
         return self._url_result
 
+    def get_tls(self):
+        self._tls_result = self._cached_lines('tls')
+        return self._tls_result
+
+    @property
+    def checks(self):
+        """ Check kinds this element is configured for, in report order."""
+        _checks = []
+        if self.nservers is not None and self.qtypes is not None:
+            _checks.append('dns')
+        _checks.append('ping')
+        if self.ports is not None:
+            _checks.append('socket')
+        if self.urls is not None:
+            _checks.append('url')
+        if self.tls is not None:
+            _checks.append('tls')
+        return _checks
+
+    def addresses(self):
+        """
+        IPv4 and IPv6 addresses of this element's name from the system
+        resolver, in the resolver's order. While load_data runs they are
+        resolved once and shared by every probe.
+
+        :return: tuple of strings; empty when the name does not resolve.
+        """
+        if self._addresses is not None:
+            return self._addresses
+        try:
+            _infos = socket.getaddrinfo(self.name, None, 0, socket.SOCK_STREAM)
+        except (OSError, UnicodeError):
+            return ()
+        return tuple(dict.fromkeys(info[4][0] for info in _infos))
+
+    def _on_host(self, url):
+        return (urllib.parse.urlsplit(url).hostname or '') == self.name.lower()
+
+    def _items(self, check, addresses=None):
+        _addresses = self.addresses() if addresses is None else addresses
+        _expand = self.per_address and _addresses
+        if check == 'dns':
+            return self.qtypes
+        if check == 'ping':
+            # ICMP echo is IPv4 only.
+            _ipv4 = [address for address in _addresses if ':' not in address]
+            return _ipv4 if _expand and _ipv4 else (self.name,)
+        if check in ('socket', 'tls'):
+            _ports = self.ports if check == 'socket' else self.tls
+            if _expand and _ports is not None:
+                return [(port, address) for port in _ports
+                        for address in _addresses]
+            return _ports
+        if check == 'url':
+            if _expand and self.urls is not None:
+                return [_item for url in self.urls
+                        for _item in self._url_items(url, _addresses)]
+            return self.urls
+        raise ValueError('unknown check {!r}'.format(check))
+
+    def _url_items(self, url, addresses):
+        if self.per_address and addresses and self._on_host(url):
+            return [(url, address) for address in addresses]
+        return [url]
+
+    def _targets(self, check, items, addresses):
+        # Where each item is probed: the node of a ping, (port, node) of a
+        # port or a TLS port and (url, address(es) or None) of a URL. Items of per_address
+        # carry their address; others go to the first IPv4 address (IPv6
+        # when there is none), or to the name itself when it does not
+        # resolve, so the probe reports why. dual_stack races them all.
+        _ipv4 = [address for address in addresses if ':' not in address]
+        _first = (_ipv4 or addresses or [None])[0]
+        if check == 'ping':
+            return [(_ipv4[0] if _ipv4 else item) if item == self.name else item
+                    for item in items]
+        if check in ('socket', 'tls'):
+            return [item if type(item) is tuple else (item, _first or self.name)
+                    for item in items]
+        _pin = tuple(addresses) if self.dual_stack and addresses else _first
+        return [item if type(item) is tuple else
+                (item, _pin if self._on_host(item) else None)
+                for item in items]
+
+    def _span(self, stage):
+        # Stages are recorded in the registry of the element's Toolkit.
+        _metrics = getattr(self.Toolkit, 'metrics', None)
+        if _metrics is None:
+            return nullcontext()
+        return _metrics.span('stage', stage)
+
+    def probe(self, check, items=None):
+        """
+        Run one kind of check (see CHECKS) on its own, bypassing the
+        freshness cache; used by the monitor to probe each kind on its own
+        interval.
+
+        :param check: string, 'dns', 'ping', 'socket', 'url' or 'tls'.
+        :param items: list or None, the query types, ports, URLs or TLS
+        ports to check; defaults to all of them. With per_address, ports,
+        URLs and TLS ports are (port or URL, address) tuples and pings are
+        addresses.
+        :return: list of result records (module results), one per query
+        type, port, URL or TLS port, or a single PingResult (one per address with
+        per_address).
+        """
+        _addresses = self.addresses()
+        _items = self._items(check, _addresses) if items is None else items
+        _metrics = getattr(self.Toolkit, 'metrics', None)
+        if _metrics is None:
+            return self._probe(check, _items, _addresses)
+        return _metrics.record('stage', check, self._probe, check, _items,
+                               _addresses)
+
+    def _probe(self, check, items, addresses):
+        if check == 'dns':
+            return self.Toolkit.check_dns_many(
+                [(self.name, qtype) for qtype in items], self.nservers)
+        _targets = self._targets(check, items, addresses)
+        if self._down is not None and check in ('socket', 'url'):
+            return self._probe_down(check, _targets)
+        if check == 'ping':
+            if len(_targets) == 1:
+                return [self.Toolkit.check_ping(_targets[0])]
+            _results = self.Toolkit.check_ping_many(_targets)
+            return [_results[node] for node in _targets]
+        if check == 'socket':
+            if self.dual_stack:
+                with ThreadPoolExecutor(max_workers=len(_targets) or 1) as pool:
+                    return list(pool.map(
+                        lambda target: self.Toolkit.check_dual_stack(
+                            self.name, target[0], addresses=addresses or None),
+                        _targets))
+            return self.Toolkit.scan_sockets(
+                [(node, port) for port, node in _targets])
+        if check == 'tls':
+            # The name goes in SNI and is matched against the certificate.
+            return [self.Toolkit.check_tls(
+                        self.name, port,
+                        address=None if node == self.name else node)
+                    for port, node in _targets]
+        return [self.Toolkit.check_http_code(url, address=address)
+                for url, address in _targets]
+
+    def _host_down(self):
+        """
+        Why the DNS and ping results of this load_data show the host is
+        down, as a (reason, certain) tuple, or None. Only a name that does
+        not resolve is certain; a host may just drop ICMP.
+        """
+        _nxdomain = any(
+            result.qtype.lower() == 'a' and
+            isinstance(result.error, dns.resolver.NXDOMAIN)
+            for result in self._dns_records or ())
+        _pings = self._ping_records
+        if not _pings:
+            return None
+        for _ping in _pings:
+            if isinstance(_ping.error, socket.gaierror):
+                if self.addresses():
+                    return None  # IPv6 only; ping cannot tell
+                return 'ping: {}'.format(_ping.error), True
+        # With per_address, the host is down only when no address answers.
+        if all(_ping.error is None and not _ping.received for _ping in _pings):
+            if _nxdomain:
+                return 'no A record and no reply to ping', True
+            return 'no reply to ping', False
+        return None
+
+    def _probe_down(self, check, targets):
+        _reason, _certain = self._down
+        _skip = _certain or self.dependencies == 'skip'
+        if check == 'socket':
+            if _skip:
+                return [SocketResult(node=node, port=port,
+                                     state='unreachable', inferred=_reason)
+                        for port, node in targets]
+            # 'shorten': one quick attempt; what fails is put down to the host.
+            return [result.replace(inferred=_reason)
+                    if result.state == 'filtered' else result
+                    for result in self.Toolkit.scan_sockets(
+                        [(node, port) for port, node in targets],
+                        timeout=SHORT_TIMEOUT)]
+        _results = []
+        for _url, _address in targets:
+            if not self._on_host(_url):
+                # Only URLs on this host depend on it being up.
+                _results.append(self.Toolkit.check_http_code(_url))
+            elif _skip:
+                _results.append(HttpResult(
+                    url=_url, address=_address,
+                    error=OSError(errno.EHOSTDOWN,
+                                  os.strerror(errno.EHOSTDOWN)),
+                    inferred=_reason))
+            else:
+                _result = self.Toolkit.check_http_code(
+                    _url, connect_timeout=SHORT_TIMEOUT, address=_address)
+                _results.append(_result.replace(inferred=_reason)
+                                if is_timeout(_result.error) else _result)
+        return _results
+
+    def _lifetime(self, check, result):
+        if check == 'dns' and self.freshness['dns'] is None:
+            return result.ttl or 0
+        if getattr(result, 'inferred', None):
+            return 0  # inferred results are checked again next time
+        if result.error is not None and check != 'dns':
+            return 0  # failures are checked again next time
+        return self.freshness[check]
+
+    def collect(self, check, items=None):
+        """
+        Like probe(), but results still within their freshness period (see
+        FRESHNESS) are served from the cache and only stale ones are probed.
+
+        :return: list of (result, age in seconds) tuples aligned with items;
+        the age is 0 for results probed just now.
+        """
+        _items = list(self._items(check) if items is None else items)
+        _now = time.monotonic()
+        _fresh = {}
+        with self._cache_lock:
+            for _item in _items:
+                _entry = self._cache.get((check, _item))
+                if _entry is not None and _entry[2] > _now:
+                    _fresh[_item] = (_entry[0], _now - _entry[1])
+        _stale = [_item for _item in _items if _item not in _fresh]
+        if _stale:
+            _results = self.probe(check, _stale)
+            _now = time.monotonic()
+            with self._cache_lock:
+                for _item, _result in zip(_stale, _results):
+                    _fresh[_item] = (_result, 0.0)
+                    _lifetime = self._lifetime(check, _result)
+                    if _lifetime > 0:
+                        self._cache[(check, _item)] = (_result, _now,
+                                                       _now + _lifetime)
+        return [_fresh[_item] for _item in _items]
+
+    def invalidate(self, check=None):
+        """ Drop cached results of one check kind, or of every check."""
+        with self._cache_lock:
+            for _key in [key for key in self._cache
+                         if check is None or key[0] == check]:
+                del self._cache[_key]
+
+    @staticmethod
+    def _age(age):
+        return ' (cached {:.0f}s ago)'.format(age) if age else ''
+
+    @staticmethod
+    def _inferred(result):
+        if getattr(result, 'inferred', None):
+            return ' (inferred: {})'.format(result.inferred)
+        return ''
+
+    def _at(self, address):
+        # Report lines of per_address say which address they are about.
+        if self.per_address and address and address != self.name:
+            return ' at {}'.format(address)
+        return ''
+
+    def _families(self, result):
+        # Per-family outcome of a dual-stack port or the family of a URL.
+        if getattr(result, 'attempts', None):
+            _parts = ', '.join(
+                '{} {:.3f}ms'.format(attempt.family, attempt.connect)
+                if attempt.state == 'open' else '{} {}'.format(
+                    attempt.family, attempt.error or attempt.state)
+                for attempt in result.attempts)
+            if result.only:
+                return ' ({}; {} only)'.format(_parts, result.only)
+            if result.family and len(result.attempts) > 1:
+                return ' ({}; {} won)'.format(_parts, result.family)
+            return ' ({})'.format(_parts)
+        if self.dual_stack and getattr(result, 'hops', None) and \
+                result.hops[0].family:
+            return ' (over {})'.format(result.hops[0].family)
+        return ''
+
+    @staticmethod
+    def _handshake(result):
+        if result.handshake is None:
+            return ''
+        return ' (handshake {:.3f}ms{})'.format(
+            result.handshake, ', resumed' if result.resumed else '')
+
+    def report(self, check, results, ages=None):
+        """
+        Format the records probe(check) returned as report lines.
+
+        :param ages: list or None, the age of each result in seconds (see
+        collect); lines of cached results say how old they are.
+        :return: list of strings.
+        """
+        _ages = [self._age(age) for age in ages] if ages else \
+            [''] * len(results)
+        if check == 'dns':
+            return ['DNS {} record: {}{}'.format(result.qtype.upper(), result, age)
+                    for result, age in zip(results, _ages)]
+        if check == 'ping':
+            # Loss and latency lines of every address, in that order.
+            return ['Packet loss{}: {}{}'.format(
+                        self._at(result.address), result.loss_text, age)
+                    for result, age in zip(results, _ages)] + \
+                ['Latency (RTTms){}: {}{}'.format(
+                    self._at(result.address), result.rtt_text, age)
+                 for result, age in zip(results, _ages)]
+        if check == 'socket':
+            return ['Port {}{}: {}{}{}{}'.format(result.port,
+                                                 self._at(result.node), result,
+                                                 self._families(result),
+                                                 self._inferred(result), age)
+                    for result, age in zip(results, _ages)]
+        if check == 'url':
+            return ['URL {}{}: {}{}{}{}'.format(result.url,
+                                                self._at(result.address), result,
+                                                self._families(result),
+                                                self._inferred(result), age)
+                    for result, age in zip(results, _ages)]
+        if check == 'tls':
+            return ['TLS port {}{}: {}{}{}'.format(result.port,
+                                                   self._at(result.address),
+                                                   result, self._handshake(result),
+                                                   age)
+                    for result, age in zip(results, _ages)]
+        raise ValueError('unknown check {!r}'.format(check))
+
+    def run_check(self, check):
+        """
+        Run one kind of check on its own and return its report lines.
+
+        :param check: string, 'dns', 'ping', 'socket', 'url' or 'tls'.
+        :return: list of strings.
+        """
+        return self.report(check, self.probe(check))
+
+    def _cached_lines(self, check, items=None):
+        _pairs = self.collect(check, items)
+        return self.report(check, [result for result, _ in _pairs],
+                           [age for _, age in _pairs])
+
+    def _dns_lines(self):
+        _pairs = self.collect('dns')
+        self._dns_records = [result for result, _ in _pairs]
+        return self.report('dns', self._dns_records, [age for _, age in _pairs])
+
+    def _ping_line(self):
+        _pairs = self.collect('ping')
+        self._ping_records = [result for result, _ in _pairs]
+        _lines = self.report('ping', self._ping_records,
+                             [age for _, age in _pairs])
+        self._packet_loss = '\n\t'.join(_lines[:len(_pairs)])
+        self._rtt = '\n\t'.join(_lines[len(_pairs):])
+        return self._packet_loss
+
+    def _socket_lines(self):
+        return self._cached_lines('socket')
+
+    def _url_line(self, url):
+        return '\n\t'.join(self._cached_lines(
+            'url', self._url_items(url, self.addresses())))
+
     def load_data(self):
+        with self._span('load_data'):
+            self._addresses = None
+            self._addresses = self.addresses()
+            try:
+                if self.concurrent:
+                    return self._load_data_concurrent()
+                return self._load_data()
+            finally:
+                self._addresses = None
+                self._down = None
+
+    def _load_data(self):
+
         self._data.append('\nElement: '+self.name)
 
         self._data.append('Type: '+self.element_kind)
@@ -115,15 +588,140 @@ class NetElement:
 
         self._data.append(self.get_rtt())
 
+        if self.dependencies is not None:
+            self._down = self._host_down()
+
         if self.ports is not None:
             self._data.append('\n\t'.join(self.get_socket()))
 
         if self.urls is not None:
             self._data.append('\n\t'.join(self.get_url()))
 
+        if self.tls is not None:
+            self._data.append('\n\t'.join(self.get_tls()))
+
+        if self.note is not None:
+            self._data.append('Notes: '+self.note)
+
+    def _load_data_concurrent(self):
+        """
+        Run every probe of this element (the batched DNS queries, the ping,
+        the port scan and each URL) at the same time on a thread pool, so the
+        element takes roughly as long as its slowest probe instead of the sum
+        of all. Fresh cached results come back without probing.
+
+        All probes share self.Toolkit. Results are collected in submission
+        order, which keeps the report identical to the sequential one.
+
+        With dependencies set, the port and URL probes start once DNS and
+        ping are done, since those decide whether the host is down.
+        """
+        _dns = self.qtypes if self.nservers is not None and \
+            self.qtypes is not None else ()
+        _ports = self.ports or ()
+        _urls = self.urls or ()
+        _workers = self.workers or len(_urls) + 4
+
+        with ThreadPoolExecutor(max_workers=_workers) as pool:
+            _dns_job = pool.submit(self._dns_lines) if _dns else None
+            _ping_job = pool.submit(self._ping_line)
+            if self.dependencies is not None:
+                wait([job for job in (_dns_job, _ping_job) if job is not None])
+                self._down = self._host_down()
+            _socket_job = pool.submit(self._socket_lines) if _ports else None
+            _url_jobs = [pool.submit(self._url_line, url) for url in _urls]
+            _tls_job = pool.submit(self.get_tls) if self.tls else None
+
+            self._data.append('\nElement: '+self.name)
+
+            self._data.append('Type: '+self.element_kind)
+
+            if _dns_job is not None:
+                self._dns_result = _dns_job.result()
+                self._data.append('\n\t'.join(self._dns_result))
+
+            self._data.append(_ping_job.result())
+
+            self._data.append(self.get_rtt())
+
+            if self.ports is not None:
+                self._socket_result = _socket_job.result() if _socket_job \
+                    else []
+                self._data.append('\n\t'.join(self._socket_result))
+
+            if self.urls is not None:
+                self._url_result = [job.result() for job in _url_jobs]
+                self._data.append('\n\t'.join(self._url_result))
+
+            if self.tls is not None:
+                self._data.append('\n\t'.join(
+                    _tls_job.result() if _tls_job else []))
+
         if self.note is not None:
             self._data.append('Notes: '+self.note)
 
+    def _results(self, check, items=None):
+        # Collected results of one check; DNS and ping are kept for the
+        # dependencies decision.
+        _results = [result for result, _ in self.collect(check, items)]
+        if check == 'dns':
+            self._dns_records = _results
+        elif check == 'ping':
+            self._ping_records = _results
+        return _results
+
+    def stream(self, emit):
+        """
+        Run every check of this element and hand the results of each to
+        emit as soon as it completes, instead of building the report; see
+        module emit. Nothing is kept once emit returns.
+
+        With concurrent, the checks run at the same time as in load_data and
+        every URL is emitted on its own.
+
+        :param emit: callable(NetElement, check kind, list of result
+        records); called from pool threads when concurrent.
+        """
+        with self._span('stream'):
+            self._addresses = None
+            self._addresses = self.addresses()
+            try:
+                if self.concurrent:
+                    self._stream_concurrent(emit)
+                    return
+                _decided = self.dependencies is None
+                for _check in self.checks:
+                    if _check in ('socket', 'url') and not _decided:
+                        self._down = self._host_down()
+                        _decided = True
+                    emit(self, _check, self._results(_check))
+            finally:
+                self._addresses = None
+                self._down = None
+                self._dns_records = None
+                self._ping_records = None
+
+    def _stream_concurrent(self, emit):
+        def _run(check, items=None):
+            emit(self, check, self._results(check, items))
+
+        _urls = self.urls or ()
+        with ThreadPoolExecutor(max_workers=self.workers or len(_urls) + 4) \
+                as pool:
+            _jobs = [pool.submit(_run, check) for check in self.checks
+                     if check in ('dns', 'ping')]
+            if self.dependencies is not None:
+                wait(_jobs)
+                self._down = self._host_down()
+            if self.ports is not None:
+                _jobs.append(pool.submit(_run, 'socket'))
+            _jobs.extend(pool.submit(_run, 'url', self._url_items(
+                url, self.addresses())) for url in _urls)
+            if self.tls is not None:
+                _jobs.append(pool.submit(_run, 'tls'))
+            for _job in _jobs:
+                _job.result()  # errors raised by a check or by emit
+
 
 def main():
 
@@ -133,7 +731,8 @@ def main():
                         dns_servers=('8.8.8.8',),
                         ports=('t80', 't443'),
                         urls=('http://www.google.com', 'https://google.com'),
-                        note=None)
+                        note=None,
+                        concurrent=True)
 
     print(google)
 
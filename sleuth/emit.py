@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module streams probe results as they complete, one row per result, as
+NDJSON or CSV, instead of holding every element's report until a sweep is
+done. Each row carries the time the check completed, the element name, the
+check kind (dns, ping, socket, url or tls), the target (DNS query type,
+port, URL or TLS port), the address probed when known, the value (records,
+packet loss, port state, HTTP status or TLS session and certificate expiry),
+the latency in ms when measured (the handshake for TLS), and the error
+text.
+
+Emitters are callables of (element, check, results), the signature
+NetElement.stream and Fleet.stream hand results to, and write and flush one
+line per result under a lock, so a sweep of any size keeps memory flat and a
+consumer tailing the output sees each row right away.
+
+>>> from emit import NdjsonEmitter
+>>> from fleet import Fleet
+>>> from inventory import load
+>>> Fleet().stream(load('inventory.jsonl', concurrent=True), NdjsonEmitter())
+{"time": "2026-10-18T09:12:44.081Z", "element": "google.com", "check": "ping", "target": "google.com", "address": "142.250.80.46", "value": "0%", "ms": 12.04, "error": null}
+{"time": "2026-10-18T09:12:44.093Z", "element": "google.com", "check": "socket", "target": "t443", "address": "google.com", "value": "open", "ms": 12.311, "error": null}
+"""
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import sys
+import threading
+
+FIELDS = ('time', 'element', 'check', 'target', 'address', 'value', 'ms',
+          'error')
+
+FORMATS = ('ndjson', 'csv')
+
+
+def _timestamp():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(
+        timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def _ms(check, result):
+    # Latency of a result in ms, or None where the check measured none.
+    if check == 'ping':
+        return result.rtt
+    if check == 'tls':
+        return result.handshake
+    if check == 'socket':
+        for _attempt in result.attempts or ():
+            if _attempt.state == 'open':
+                return _attempt.connect
+        return None
+    _timings = [_timing for _hop in result.hops or ()
+                for _timing in (_hop.dns, _hop.connect, _hop.tls, _hop.ttfb)
+                if _timing is not None]
+    return sum(_timings) if _timings else None
+
+
+def row(element, check, result, time=None):
+    """
+    The row of one result of one check of element.
+
+    :param element: NetElement or anything with a name.
+    :param check: string, 'dns', 'ping', 'socket', 'url' or 'tls', or
+    'error' for the exception an element raised (see Fleet.stream).
+    :param result: results record, or an exception.
+    :param time: string or None, ISO 8601 UTC timestamp; defaults to now.
+    :return: dict of FIELDS.
+    """
+    _row = dict.fromkeys(FIELDS)
+    _row['time'] = time or _timestamp()
+    _row['element'] = element.name
+    _row['check'] = check
+    if isinstance(result, Exception):
+        _row['error'] = '{}: {}'.format(type(result).__name__, result)
+        return _row
+    if check == 'dns':
+        _row['target'] = result.qtype.upper()
+    elif check == 'ping':
+        _row['target'] = result.node
+        _row['address'] = result.address
+    elif check == 'socket':
+        _row['target'] = result.port
+        _row['address'] = result.node
+    elif check == 'tls':
+        _row['target'] = result.port
+        _row['address'] = result.address
+    else:
+        _row['target'] = result.url
+        _row['address'] = result.address or next(
+            (_hop.peer for _hop in result.hops or () if _hop.peer), None)
+    if result.error is not None:
+        _row['error'] = str(result.error)
+        return _row
+    _row['value'] = result.loss_text if check == 'ping' else str(result)
+    if check != 'dns':
+        _latency = _ms(check, result)
+        _row['ms'] = None if _latency is None else round(_latency, 3)
+    return _row
+
+
+class _Emitter:
+
+    def __init__(self, stream=None):
+        """
+        :param stream: text file or None, written and flushed one line per
+        result; defaults to sys.stdout.
+        """
+        self.stream = sys.stdout if stream is None else stream
+        self.rows = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, element, check, results):
+        """ Write a row for each of results; safe to call from any thread."""
+        _time = _timestamp()
+        _rows = [row(element, check, _result, _time) for _result in results]
+        with self._lock:
+            for _row in _rows:
+                self._write(_row)
+            self.stream.flush()
+            self.rows += len(_rows)
+
+    def _write(self, row):
+        raise NotImplementedError
+
+
+class NdjsonEmitter(_Emitter):
+
+    def _write(self, row):
+        self.stream.write(json.dumps(row) + '\n')
+
+
+class CsvEmitter(_Emitter):
+
+    def __init__(self, stream=None, header=True):
+        """
+        :param stream: as for NdjsonEmitter.
+        :param header: bool, write the FIELDS header before the first row.
+        """
+        super().__init__(stream)
+        self._writer = csv.DictWriter(self.stream, FIELDS,
+                                      lineterminator='\n')
+        self._header = header
+
+    def _write(self, row):
+        if self._header:
+            self._writer.writeheader()
+            self._header = False
+        self._writer.writerow(row)
+
+
+def emitter(kind='ndjson', stream=None):
+    """
+    An emitter of kind, one of FORMATS, writing to stream.
+    """
+    try:
+        assert kind in FORMATS,\
+            'Validation error; expected one of {} for kind, received {}.'\
+            .format(FORMATS, kind)
+    except AssertionError as e:
+        print(e)
+        exit()
+    return NdjsonEmitter(stream) if kind == 'ndjson' else CsvEmitter(stream)
+
+
+def main():
+    from fleet import Fleet
+    from inventory import load
+
+    parser = argparse.ArgumentParser(
+        description='Sweep an inventory and stream every result to stdout.')
+    parser.add_argument('inventory', help='JSONL, CSV or YAML inventory')
+    parser.add_argument('--format', choices=FORMATS, default='ndjson')
+    parser.add_argument('--workers', type=int, default=64,
+                        help='elements probed at once')
+    parser.add_argument('--per-host', type=int, default=1,
+                        help='elements of one host probed at once')
+    args = parser.parse_args()
+    if not os.path.isfile(args.inventory):
+        print('No such inventory file: {}'.format(args.inventory),
+              file=sys.stderr)
+        return
+
+    Fleet(workers=args.workers, per_host=args.per_host).stream(
+        load(args.inventory, concurrent=True,
+             on_error=lambda error: print(error, file=sys.stderr)),
+        emitter(args.format))
+
+
+if __name__ == '__main__':
+    main()
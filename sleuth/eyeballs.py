@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module connects to dual-stack hosts the way Happy Eyeballs v2 (RFC 8305)
+describes. A host's IPv6 and IPv4 addresses are interleaved, connection
+attempts start CONNECTION_ATTEMPT_DELAY apart (or as soon as the previous one
+fails) and race on one selector, and the first socket to connect wins. A host
+with a broken IPv6 path is then reached over IPv4 after 250ms instead of
+after a full connect timeout.
+
+compare() starts the first address of each family at once instead, and
+reports every family's connect latency, which family won, and a family that
+refuses or drops a port the other one serves.
+
+>>> import eyeballs
+>>> sock, attempts = eyeballs.connect('google.com', 443)
+>>> print(attempts[0])
+IPv6 2607:f8b0:4006:80b::200e: open (12.104ms)
+>>> for attempt in eyeballs.compare('google.com', 443):
+...     print(attempt)
+IPv6 2607:f8b0:4006:80b::200e: open (12.311ms)
+IPv4 142.250.80.46: open (13.877ms)
+"""
+
+import errno
+import heapq
+import itertools
+import selectors
+import socket
+import time
+from portscan import CLOSED, FILTERED, OPEN, port_state
+from results import Attempt
+
+# Seconds between connection attempts; the default RFC 8305 recommends.
+CONNECTION_ATTEMPT_DELAY = 0.25
+
+FAMILIES = {socket.AF_INET6: 'IPv6', socket.AF_INET: 'IPv4'}
+
+# States of attempts that were still connecting when the race ended: cut
+# short after the settle time, or abandoned once another attempt won.
+PENDING = 'pending'
+CANCELLED = 'cancelled'
+
+
+def interleave(targets):
+    """
+    Order (family, sockaddr) targets by alternating address families,
+    starting with the family of the first target (RFC 8305 section 4);
+    getaddrinfo has already sorted them by preference (RFC 6724).
+    """
+    _queues = {}
+    for _target in targets:
+        _queues.setdefault(_target[0], []).append(_target)
+    _queues = [iter(queue) for queue in _queues.values()]
+    return [_target for _round in itertools.zip_longest(*_queues)
+            for _target in _round if _target is not None]
+
+
+def resolve(host, port, family=socket.AF_UNSPEC, addresses=None):
+    """
+    The (family, sockaddr) targets of host, interleaved by family.
+
+    :param host: string, hostname or IP address.
+    :param port: integer, TCP port.
+    :param family: socket.AF_UNSPEC, AF_INET or AF_INET6.
+    :param addresses: iterable of IP address strings or None, used instead
+    of resolving host.
+    :return: list of tuples; raises socket.gaierror.
+    """
+    if addresses:
+        _infos = [_info for _address in addresses
+                  for _info in socket.getaddrinfo(
+                      _address, port, family, socket.SOCK_STREAM, 0,
+                      socket.AI_NUMERICHOST)]
+    else:
+        _infos = socket.getaddrinfo(host, port, family, socket.SOCK_STREAM)
+    _targets = list(dict.fromkeys(
+        (_family, _sockaddr) for _family, _, _, _, _sockaddr in _infos
+        if _family in FAMILIES))
+    if not _targets:
+        raise socket.gaierror(socket.EAI_NONAME,
+                              'no IPv4 or IPv6 address for {}'.format(host))
+    return interleave(_targets)
+
+
+def race(targets, timeout=3, delay=CONNECTION_ATTEMPT_DELAY, settle=None,
+         timeouts=None):
+    """
+    Race non-blocking connects to targets.
+
+    :param targets: list of (family, sockaddr) tuples in the order to try.
+    :param timeout: number, seconds each attempt may take.
+    :param delay: number, seconds between starting attempts; the next one
+    also starts as soon as every started attempt failed.
+    :param settle: number or None, seconds attempts still connecting may
+    take after the first one connected; None abandons them right away.
+    Attempts not started by then are not started.
+    :param timeouts: rtt.HostTimeouts or None; when set, each attempt waits
+    as long as its address's observed RTT calls for (timeout at most) and
+    every answer updates the address's estimate.
+    :return: (connected blocking socket or None, list of results.Attempt in
+    start order).
+    """
+    if len(targets) == 1:
+        return _connect_one(targets[0], timeout, timeouts)
+    _selector = selectors.DefaultSelector()
+    _attempts = []
+    _deadlines = []  # heap of (deadline, attempt index, socket)
+    _in_flight = {}  # socket -> (attempt index, start time)
+    _todo = list(reversed(targets))
+    _next_start = time.monotonic()
+    _winner = None
+    _settle_until = None
+
+    def _record(index, state, start, sockaddr, family):
+        _connect = (time.monotonic() - start) * 1000 \
+            if state in (OPEN, CLOSED) else None
+        if isinstance(state, Exception):
+            _attempts[index] = Attempt(family=FAMILIES[family],
+                                       address=sockaddr[0], error=state)
+        else:
+            _attempts[index] = Attempt(family=FAMILIES[family],
+                                       address=sockaddr[0], state=state,
+                                       connect=_connect)
+        if timeouts is not None:
+            if state == FILTERED:
+                timeouts.backoff(sockaddr[0])
+            elif state in (OPEN, CLOSED):
+                timeouts.observe(sockaddr[0], _connect / 1000)
+
+    def _finish(sock, state):
+        _index, _start = _in_flight.pop(sock)
+        _selector.unregister(sock)
+        _record(_index, state, _start, _sockaddrs[_index], sock.family)
+        if state == OPEN and _winner is None:
+            return sock
+        sock.close()
+        return None
+
+    _sockaddrs = []
+    try:
+        while True:
+            _now = time.monotonic()
+            while _winner is None and _todo and (
+                    _now >= _next_start or not _in_flight):
+                _family, _sockaddr = _todo.pop()
+                _index = len(_attempts)
+                _attempts.append(None)
+                _sockaddrs.append(_sockaddr)
+                _sock = socket.socket(_family, socket.SOCK_STREAM)
+                _sock.setblocking(False)
+                _start = time.monotonic()
+                _error = _sock.connect_ex(_sockaddr)
+                if _error in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    _in_flight[_sock] = (_index, _start)
+                    _selector.register(_sock, selectors.EVENT_WRITE)
+                    _timeout = timeout if timeouts is None else \
+                        timeouts.timeout(_sockaddr[0], timeout)
+                    heapq.heappush(_deadlines, (_start + _timeout, _index,
+                                                _sock))
+                    _next_start = _start + delay
+                elif _error == 0:  # loopback may connect at once
+                    _record(_index, OPEN, _start, _sockaddr, _family)
+                    _winner = _sock
+                    if settle is not None:
+                        _settle_until = time.monotonic() + settle
+                else:
+                    # Failed at once (no route, ...): go on with the next.
+                    _record(_index, port_state(_error), _start, _sockaddr,
+                            _family)
+                    _sock.close()
+                    _next_start = time.monotonic()
+                _now = time.monotonic()
+            if not _in_flight or (_winner is not None and (
+                    settle is None or _now >= _settle_until)):
+                break
+
+            _wake = _deadlines[0][0]
+            if _winner is None and _todo:
+                _wake = min(_wake, _next_start)
+            if _settle_until is not None:
+                _wake = min(_wake, _settle_until)
+            for _key, _ in _selector.select(max(0.0, _wake - _now)):
+                _sock = _key.fileobj
+                _state = port_state(_sock.getsockopt(socket.SOL_SOCKET,
+                                                     socket.SO_ERROR))
+                if _finish(_sock, _state) is not None:
+                    _winner = _sock
+                    if settle is not None:
+                        _settle_until = time.monotonic() + settle
+                elif _state != OPEN:
+                    _next_start = time.monotonic()  # try the next one now
+
+            _now = time.monotonic()
+            while _deadlines and (_deadlines[0][0] <= _now or
+                                  _deadlines[0][2] not in _in_flight):
+                _, _, _sock = heapq.heappop(_deadlines)
+                if _sock in _in_flight:
+                    _finish(_sock, FILTERED)
+                    _next_start = _now
+    finally:
+        for _sock, (_index, _) in list(_in_flight.items()):
+            _selector.unregister(_sock)
+            _sock.close()
+            _attempts[_index] = Attempt(
+                family=FAMILIES[_sock.family], address=_sockaddrs[_index][0],
+                state=PENDING if settle is not None else CANCELLED)
+        _selector.close()
+    if _winner is not None:
+        _winner.setblocking(True)
+    return _winner, _attempts
+
+
+def _connect_one(target, timeout, timeouts):
+    # Nothing to race: a blocking connect saves the selector.
+    _family, _sockaddr = target
+    if timeouts is not None:
+        timeout = timeouts.timeout(_sockaddr[0], timeout)
+    _sock = socket.socket(_family, socket.SOCK_STREAM)
+    _sock.settimeout(timeout)
+    _start = time.monotonic()
+    _error = _sock.connect_ex(_sockaddr)
+    _elapsed = time.monotonic() - _start
+    if _error in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINPROGRESS):
+        _error = errno.ETIMEDOUT  # connect_ex reports a timeout this way
+    _state = port_state(_error)
+    if isinstance(_state, Exception):
+        _attempt = Attempt(family=FAMILIES[_family], address=_sockaddr[0],
+                           error=_state)
+    else:
+        _attempt = Attempt(family=FAMILIES[_family], address=_sockaddr[0],
+                           state=_state, connect=_elapsed * 1000
+                           if _state in (OPEN, CLOSED) else None)
+    if timeouts is not None:
+        if _state == FILTERED:
+            timeouts.backoff(_sockaddr[0])
+        elif _state in (OPEN, CLOSED):
+            timeouts.observe(_sockaddr[0], _elapsed)
+    if _state != OPEN:
+        _sock.close()
+        return None, [_attempt]
+    _sock.settimeout(None)
+    return _sock, [_attempt]
+
+
+def failure(attempts):
+    """
+    The exception a failed race amounts to: a refusal when any address
+    refused, a timeout when any timed out, else the last error.
+    """
+    _states = [_attempt.state for _attempt in attempts]
+    if CLOSED in _states:
+        return ConnectionRefusedError(errno.ECONNREFUSED, 'Connection refused')
+    if FILTERED in _states:
+        return socket.timeout('timed out')
+    for _attempt in reversed(attempts):
+        if _attempt.error is not None:
+            return _attempt.error
+    return OSError('no address to connect to')
+
+
+def connect(host, port, timeout=3, delay=CONNECTION_ATTEMPT_DELAY,
+            family=socket.AF_UNSPEC, addresses=None, timeouts=None):
+    """
+    Connect to host the Happy Eyeballs way.
+
+    :param host: string, hostname or IP address.
+    :param port: integer, TCP port.
+    :param timeout: number, seconds each connection attempt may take.
+    :param delay: number, seconds between connection attempts.
+    :param family: socket.AF_UNSPEC, AF_INET or AF_INET6.
+    :param addresses: iterable of IP address strings or None, connected to
+    instead of resolving host.
+    :param timeouts: rtt.HostTimeouts or None, see race().
+    :return: (connected blocking socket, list of results.Attempt); raises
+    socket.gaierror, ConnectionRefusedError, socket.timeout or OSError.
+    """
+    _sock, _attempts = race(resolve(host, port, family, addresses), timeout,
+                            delay, timeouts=timeouts)
+    if _sock is None:
+        raise failure(_attempts)
+    return _sock, _attempts
+
+
+def compare(host, port, timeout=3, settle=CONNECTION_ATTEMPT_DELAY,
+            addresses=None, timeouts=None):
+    """
+    Connect to the first IPv6 and the first IPv4 address of host at the
+    same time and close both connections.
+
+    A family still connecting settle seconds after the other one connected
+    is reported as pending: it lags more than the head start Happy Eyeballs
+    gives the preferred family, so clients would not use it anyway, and the
+    check costs no more than the faster family plus settle.
+
+    :return: list of results.Attempt, one per family of host, the winner
+    (if any) first; raises socket.gaierror.
+    """
+    _firsts = {}
+    for _target in resolve(host, port, addresses=addresses):
+        _firsts.setdefault(_target[0], _target)
+    _sock, _attempts = race(list(_firsts.values()), timeout, delay=0,
+                            settle=settle, timeouts=timeouts)
+    if _sock is not None:
+        _sock.close()
+    return sorted(_attempts, key=lambda attempt: (
+        attempt.state != OPEN, attempt.connect is None, attempt.connect or 0))
+
+
+def main():
+    for attempt in compare('localhost', 22):
+        print(attempt)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module sweeps a collection of NetElement objects with a bounded number
+of elements in flight at once, a cap on how many elements may probe the same
+host at the same time, periodic progress reporting, and an elements per
+second throughput figure.
+
+>>> from element import NetElement
+>>> from fleet import Fleet
+>>> fleet = Fleet(workers=128, per_host=2)
+>>> reports = fleet.sweep(elements)
+>>> print(fleet.throughput)
+41.7
+"""
+
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import nullcontext
+from metrics import registry
+
+
+def print_progress(done, failed, elapsed, rate):
+    """ Default progress reporter; writes one status line to stderr."""
+    print('Swept {} elements ({} failed) in {:.1f}s, {:.1f} elements/s'.format(
+        done, failed, elapsed, rate), file=sys.stderr)
+
+
+class Fleet:
+
+    def __init__(self, workers=64, per_host=1, progress=print_progress,
+                 progress_interval=5, metrics=registry):
+        """
+        Sweep engine for many NetElement objects.
+
+        :param workers: integer, maximum number of elements probed at once.
+        :param per_host: integer, maximum number of elements probing the same
+        host (element name) at once.
+        :param progress: callable(done, failed, elapsed, rate) or None,
+        called every progress_interval seconds and once at the end.
+        :param progress_interval: number, seconds between progress reports.
+        :param metrics: metrics.Metrics or None, registry each sweep is
+        recorded in as a 'sweep' stage.
+        """
+        try:
+            assert type(workers) is int and workers > 0,\
+                'Validation error; expected a positive int for workers, received {}.'\
+                .format(workers)
+
+            assert type(per_host) is int and per_host > 0,\
+                'Validation error; expected a positive int for per_host, received {}.'\
+                .format(per_host)
+
+            assert progress is None or callable(progress),\
+                'Validation error; expected a callable for progress, received {}.'\
+                .format(type(progress))
+        except AssertionError as e:
+            print(e)
+            exit()
+        self.workers = workers
+        self.per_host = per_host
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.metrics = metrics
+        self.completed = 0
+        self.failed = 0
+        self.elapsed = 0.0
+
+    @property
+    def throughput(self):
+        """ Elements swept per second over the last (or current) sweep."""
+        if self.elapsed <= 0:
+            return 0.0
+        return self.completed / self.elapsed
+
+    @staticmethod
+    def _host(element):
+        return element.name.lower()
+
+    @staticmethod
+    def _probe(element):
+        return str(element)
+
+    def sweep(self, elements, on_result=None, profiler=None, keep=True):
+        """
+        Probe every element in elements and return the reports, in input
+        order, as a list of (element name, report) tuples. A report is the
+        element's str() output, or the exception raised while probing it.
+
+        Elements are pulled from the iterable only when there is room to run
+        them, so a generator of elements is never materialized up front.
+
+        :param elements: iterable of NetElement objects.
+        :param on_result: callable(index, element, report) or None, called as
+        soon as each element completes.
+        :param profiler: context manager or None, active for the duration of
+        this sweep only, e.g. a metrics.SamplingProfiler.
+        :param keep: bool, False hands reports to on_result only and returns
+        an empty list, so memory stays flat however many elements are swept.
+        :return: list of (name, report) tuples.
+        """
+        with profiler or nullcontext():
+            if self.metrics is None:
+                return self._sweep(elements, on_result, keep, self._probe)
+            with self.metrics.span('stage', 'sweep'):
+                return self._sweep(elements, on_result, keep, self._probe)
+
+    def stream(self, elements, emit, profiler=None):
+        """
+        Probe every element in elements and hand each check's results to
+        emit as soon as the check completes (NetElement.stream), instead of
+        collecting reports; nothing is kept, so memory stays flat however
+        many elements are swept. Results of different elements interleave.
+
+        An element that raises is handed to emit as an 'error' check with
+        the exception as its only result.
+
+        :param elements: iterable of NetElement objects.
+        :param emit: callable(element, check kind, list of results), e.g. an
+        emit.NdjsonEmitter; called from pool threads.
+        :param profiler: context manager or None, see sweep().
+        """
+        def _failed(index, element, report):
+            if isinstance(report, Exception):
+                emit(element, 'error', [report])
+
+        def _probe(element):
+            element.stream(emit)
+
+        with profiler or nullcontext():
+            if self.metrics is None:
+                self._sweep(elements, _failed, False, _probe)
+                return
+            with self.metrics.span('stage', 'stream'):
+                self._sweep(elements, _failed, False, _probe)
+
+    def _sweep(self, elements, on_result, keep, probe):
+        self.completed = 0
+        self.failed = 0
+        self.elapsed = 0.0
+        _start = time.monotonic()
+        _last_report = _start
+        _results = {}
+        _host_load = Counter()
+        _waiting = deque()  # elements held back by the per-host cap
+        _source = enumerate(elements)
+        _exhausted = False
+
+        def _next_runnable():
+            # Elements held back earlier get the first chance at a free slot.
+            for _ in range(len(_waiting)):
+                _item = _waiting.popleft()
+                if _host_load[self._host(_item[1])] < self.per_host:
+                    return _item
+                _waiting.append(_item)
+            return None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            _in_flight = {}
+            while True:
+                while len(_in_flight) < self.workers:
+                    _item = _next_runnable()
+                    if _item is None:
+                        if _exhausted or len(_waiting) >= self.workers:
+                            break
+                        try:
+                            _item = next(_source)
+                        except StopIteration:
+                            _exhausted = True
+                            break
+                        if _host_load[self._host(_item[1])] >= self.per_host:
+                            _waiting.append(_item)
+                            continue
+                    _host_load[self._host(_item[1])] += 1
+                    _in_flight[pool.submit(probe, _item[1])] = _item
+
+                if not _in_flight:
+                    break
+
+                _done, _ = wait(_in_flight, timeout=self.progress_interval,
+                                return_when=FIRST_COMPLETED)
+                for _future in _done:
+                    _index, _element = _in_flight.pop(_future)
+                    _host_load[self._host(_element)] -= 1
+                    try:
+                        _report = _future.result()
+                    except Exception as e:
+                        _report = e
+                        self.failed += 1
+                    self.completed += 1
+                    if keep:
+                        _results[_index] = (_element.name, _report)
+                    if on_result is not None:
+                        on_result(_index, _element, _report)
+
+                _now = time.monotonic()
+                self.elapsed = _now - _start
+                if self.progress and _now - _last_report >= self.progress_interval:
+                    _last_report = _now
+                    self.progress(self.completed, self.failed, self.elapsed,
+                                  self.throughput)
+
+        self.elapsed = time.monotonic() - _start
+        if self.progress:
+            self.progress(self.completed, self.failed, self.elapsed,
+                          self.throughput)
+        return [_results[index] for index in sorted(_results)]
+
+
+def main():
+    from element import NetElement
+
+    hosts = ('google.com', 'yahoo.com', 'cnn.com')
+    elements = (NetElement(host,
+                           'Web server',
+                           dns_types=('a',),
+                           dns_servers=('8.8.8.8',),
+                           ports=('t80', 't443'),
+                           urls=('https://' + host,),
+                           note=None,
+                           concurrent=True) for host in hosts)
+
+    fleet = Fleet(workers=32, per_host=1)
+    for name, report in fleet.sweep(elements):
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
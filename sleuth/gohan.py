@@ -3,11 +3,12 @@
 __author__ = 'rafael'
 __version__ = '0.0.0'
 
-from toolkit import Toolkit
-import validators
+import client
 import readline
 
 # TODO sudo pip3 install validators
+# Checks run in the sleuth agent (module agent), which keeps resolvers, pools
+# and caches warm between runs; it is started on first use.
 # TODO set internal and external DNS servers
 # TODO place package in /usr/local/bin
 
@@ -37,7 +38,6 @@ def dns_handler(f):
         if query_type == '':
             query_type = 'a'
         f(hostname, resolver, query_type)
-        tool.dns_data = None
         main()
     return wrapper
 
@@ -66,8 +66,6 @@ def ping_handler(f):
             print(e)
             main()
         f(hostname, int(echos), int(mtu))
-        tool.loss_data = None
-        tool.rtt_data = None
         main()
     return wrapper
 
@@ -90,25 +88,25 @@ def socket_handler(f):
             print('Port must be a number in the range of 0-65535')
             main()
         f(hostname, port)
-        tool.socket_data = None
         main()
     return wrapper
 
 
 def url_handler(f):
     def wrapper():
+        import validators
         url = input('URL > ').lower()
         if validators.url(url):
             f(url)
         else:
             print('Enter a valid URL.')
-        tool.http_data = None
         main()
     return wrapper
 
 
 def curl_handler(f):
     def wrapper():
+        import validators
         uri = input('URL > ').lower()
         if validators.url(uri):
             user_input = input('FQDN for additional header [no] > ').lower()
@@ -119,7 +117,6 @@ def curl_handler(f):
             f(uri, extra_fqdn)
         else:
             print('Enter a valid URL.')
-        tool.header_data = None
         main()
     return wrapper
 
@@ -132,8 +129,9 @@ def get_dns(node, nservers, qtype):
 
 @ping_handler
 def get_ping(node, count=9, mtu=1000):
-    tool.check_ping(node, count, mtu)
-    print('Host: {}  Loss: {}  RTT(ms): {}'.format(node, tool.loss_data, tool.rtt_data))
+    result = tool.check_ping(node, count, mtu)
+    print('Host: {}  Loss: {}  RTT(ms): {}'.format(node, result.loss_text,
+                                                   result.rtt_text))
 
 
 @socket_handler
@@ -192,5 +190,5 @@ def main():
         exit()
 
 if __name__ == "__main__":
-    tool = Toolkit()
+    tool = client.connect()
     main()
\ No newline at end of file
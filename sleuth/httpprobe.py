@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module provides an in-process HTTP/HTTPS probe. It follows redirects
+itself, keeps idle keep-alive connections pooled per origin so repeated checks
+skip the TCP and TLS setup, and records a timing breakdown (DNS, connect, TLS
+handshake, time to first byte) for every hop of the redirect chain. New
+connections race the host's IPv6 and IPv4 addresses (Happy Eyeballs, module
+eyeballs), and every hop records the address it went to. New HTTPS
+connections resume the origin's last TLS session (module tlsprobe) instead
+of a full handshake.
+
+fetch(url, address=...) connects to that address instead of resolving the
+URL's host, like curl --resolve, while the Host header and TLS SNI keep the
+name; NetElement uses it to probe each backend of a load-balanced name.
+
+>>> from httpprobe import HttpProbe
+>>> probe = HttpProbe()
+>>> hops = probe.fetch('http://google.com', method='HEAD')
+>>> print(' -> '.join(str(hop) for hop in hops))
+HTTP/1.1 301 Moved Permanently -> Location: http://www.google.com/ -> HTTP/1.1 200 OK
+>>> print(hops[0].dns, hops[0].connect, hops[0].tls, hops[0].ttfb)
+1.204 12.941 None 25.377
+"""
+
+import http.client
+import socket
+import ssl
+import threading
+import time
+import urllib.parse
+from collections import deque
+import eyeballs
+from results import Hop
+from rtt import host_timeouts
+from tlsprobe import MAX_AGE, SessionCache
+
+
+class _TimedConnectionMixin:
+    """ Splits connect() into timed DNS, TCP connect and TLS phases."""
+
+    dns_time = connect_time = tls_time = peer = None
+    connect_timeout = None  # seconds for the TCP connect; None uses timeout
+    timeouts = None  # rtt.HostTimeouts fed with the connect time, or None
+    address = None  # IP address(es) connected to instead of resolving host
+
+    def _open(self):
+        # The host's IPv6 and IPv4 addresses race (module eyeballs).
+        _addresses = (self.address,) if isinstance(self.address, str) \
+            else self.address
+        _start = time.monotonic()
+        _targets = eyeballs.resolve(self.host, self.port, addresses=_addresses)
+        if _addresses is None:
+            self.dns_time = (time.monotonic() - _start) * 1000
+        _sock, _attempts = eyeballs.race(
+            _targets, self.connect_timeout or self.timeout,
+            timeouts=self.timeouts)
+        if _sock is None:
+            raise eyeballs.failure(_attempts)
+        _winner = next(_attempt for _attempt in _attempts
+                       if _attempt.state == eyeballs.OPEN)
+        self.connect_time = _winner.connect
+        self.peer = _winner.address
+        _sock.settimeout(self.timeout)
+        _sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return _sock
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, http.client.HTTPConnection):
+
+    def connect(self):
+        self.sock = self._open()
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, http.client.HTTPSConnection):
+
+    sessions = session_key = None  # tlsprobe.SessionCache and origin
+    resumed = None
+    _unsaved = False  # the session has not been cached yet
+
+    def connect(self):
+        _sock = self._open()
+        _session = None if self.sessions is None else \
+            self.sessions.get(self.session_key)[0]
+        _start = time.monotonic()
+        try:
+            self.sock = self._context.wrap_socket(_sock,
+                                                  server_hostname=self.host,
+                                                  session=_session)
+        except Exception:
+            _sock.close()
+            raise
+        self.tls_time = (time.monotonic() - _start) * 1000
+        self.resumed = self.sock.session_reused
+        self._unsaved = self.sessions is not None
+
+    def getresponse(self):
+        # TLS 1.3 session tickets arrive after the handshake and are read
+        # along with the first response; the socket outlives close() until
+        # the response is read.
+        _sock = self.sock
+        _response = super().getresponse()
+        if self._unsaved:
+            self._unsaved = False
+            self.sessions.put(self.session_key, _sock.session)
+        return _response
+
+
+class HttpProbe:
+
+    redirect_codes = (301, 302, 303, 307, 308)
+    user_agent = 'sleuth/{}'.format(__version__)
+
+    def __init__(self, timeout=10, max_redirects=10, max_idle=4,
+                 max_body=1048576, timeouts=None, session_age=MAX_AGE):
+        """
+        :param timeout: number, socket timeout in seconds.
+        :param max_redirects: integer, redirects followed before giving up;
+        the same limit urllib uses.
+        :param max_idle: integer, idle connections kept per origin.
+        :param max_body: integer, response bytes read to keep a connection
+        reusable; larger bodies close the connection instead.
+        :param timeouts: rtt.HostTimeouts or None; when set, TCP connects
+        wait as long as the address's observed RTT calls for (timeout at
+        most) and every connect updates the address's estimate. Reads keep
+        timeout.
+        :param session_age: number, seconds new connections to an HTTPS
+        origin resume its last TLS session; 0 makes every new connection a
+        full handshake.
+        """
+        self.timeout = timeout
+        self.timeouts = timeouts
+        self.max_redirects = max_redirects
+        self.max_idle = max_idle
+        self.max_body = max_body
+        self._idle = {}  # origin -> deque of idle connections
+        self.sessions = SessionCache(session_age)  # origin -> TLS session
+        self._lock = threading.Lock()
+        self._contexts = {True: ssl.create_default_context(),
+                          False: ssl.create_default_context()}
+        self._contexts[False].check_hostname = False
+        self._contexts[False].verify_mode = ssl.CERT_NONE
+
+    def _checkout(self, origin, connect_timeout=None):
+        with self._lock:
+            _idle = self._idle.get(origin)
+            if _idle:
+                return _idle.pop()
+        _scheme, _host, _port, _verify, _address = origin
+        if _scheme == 'https':
+            _connection = _TimedHTTPSConnection(
+                _host, _port, timeout=self.timeout,
+                context=self._contexts[_verify])
+            _connection.sessions = self.sessions
+            _connection.session_key = origin
+        else:
+            _connection = _TimedHTTPConnection(_host, _port,
+                                               timeout=self.timeout)
+        _connection.timeouts = self.timeouts
+        _connection.address = _address
+        _connection.connect_timeout = connect_timeout
+        return _connection
+
+    def _checkin(self, origin, connection):
+        with self._lock:
+            _idle = self._idle.setdefault(origin, deque())
+            if len(_idle) < self.max_idle:
+                _idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """ Close every pooled connection."""
+        with self._lock:
+            _pools, self._idle = self._idle, {}
+        for _idle in _pools.values():
+            for _connection in _idle:
+                _connection.close()
+
+    def _exchange(self, url, method, verify, host_header, connect_timeout,
+                  address):
+        _parts = urllib.parse.urlsplit(url)
+        if _parts.scheme not in ('http', 'https') or not _parts.hostname:
+            raise ValueError('unknown url type: {!r}'.format(url))
+        _port = _parts.port or (443 if _parts.scheme == 'https' else 80)
+        # Pinned connections are pooled apart from those to the resolved host.
+        _origin = (_parts.scheme, _parts.hostname, _port, verify, address)
+        _target = urllib.parse.urlunsplit(
+            ('', '', _parts.path or '/', _parts.query, ''))
+        _headers = {'User-Agent': self.user_agent, 'Accept': '*/*'}
+        if host_header:
+            _headers['Host'] = host_header
+
+        _connection = self._checkout(_origin, connect_timeout)
+        _reused = _connection.sock is not None
+        try:
+            _start = time.monotonic()
+            try:
+                _connection.request(method, _target, headers=_headers)
+                _response = _connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    BrokenPipeError):
+                if not _reused:
+                    raise
+                # The server closed the idle connection; retry on a fresh one.
+                _connection.close()
+                _reused = False
+                _start = time.monotonic()
+                _connection.request(method, _target, headers=_headers)
+                _response = _connection.getresponse()
+            _ttfb = (time.monotonic() - _start) * 1000
+            _body = _response.read(self.max_body + 1)
+            _keep = not _response.will_close and len(_body) <= self.max_body \
+                and _response.isclosed()
+        except Exception:
+            _connection.close()
+            raise
+        if _keep:
+            self._checkin(_origin, _connection)
+        else:
+            _connection.close()
+
+        _version = '1.0' if _response.version == 10 else '1.1'
+        _location = _response.getheader('Location')
+        if _reused:
+            return Hop(url, _version, _response.status, _response.reason,
+                       _location, True, ttfb=_ttfb, peer=_connection.peer)
+        return Hop(url, _version, _response.status, _response.reason,
+                   _location, False, _connection.dns_time,
+                   _connection.connect_time, _connection.tls_time, _ttfb,
+                   _connection.peer, getattr(_connection, 'resumed', None))
+
+    def fetch(self, url, method='GET', verify=True, host_header=None,
+              connect_timeout=None, address=None):
+        """
+        Request url and follow redirects like curl -L or urllib.
+
+        :param url: string, http or https URL.
+        :param method: string, 'GET' or 'HEAD'.
+        :param verify: bool, False skips certificate checks like curl -k.
+        :param host_header: string or None, Host header sent to hops on the
+        original origin.
+        :param connect_timeout: number or None, seconds a new connection may
+        take to connect; defaults to the adaptive or fixed timeout.
+        :param address: string, tuple of strings or None, IP address(es)
+        hops to the host of url connect to instead of resolving it, raced
+        like resolved ones; hops redirected to other hosts resolve them as
+        usual.
+        :return: list of Hop objects, first request first.
+        """
+        _hops = []
+        if address is not None and not isinstance(address, str):
+            address = tuple(address)  # part of the pool key
+        _parts = urllib.parse.urlsplit(url)
+        _origin, _hostname = _parts.netloc, _parts.hostname
+        for _ in range(self.max_redirects + 1):
+            _parts = urllib.parse.urlsplit(url)
+            _host = host_header if _parts.netloc == _origin else None
+            _pin = address if _parts.hostname == _hostname else None
+            _hop = self._exchange(url, method, verify, _host, connect_timeout,
+                                  _pin)
+            _hops.append(_hop)
+            if _hop.status not in self.redirect_codes or not _hop.location:
+                break
+            url = urllib.parse.urljoin(url, _hop.location)
+        return _hops
+
+
+http_probe = HttpProbe(timeouts=host_timeouts)
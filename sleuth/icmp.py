@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module provides an in-process ICMP echo (ping) engine. It uses a Linux
+unprivileged ICMP datagram socket when net.ipv4.ping_group_range allows it,
+and falls back to a raw ICMP socket (root or CAP_NET_RAW) otherwise.
+
+A single socket multiplexes echo requests to any number of hosts; each round
+sends one echo request to every host, and replies are matched back to their
+request by source address and sequence number.
+
+>>> from icmp import IcmpEngine
+>>> engine = IcmpEngine()
+>>> stats = engine.ping(['google.com', 'yahoo.com'], count=3)
+>>> print(stats['google.com'].loss, stats['google.com'].mean)
+0.0 27.311
+>>> print(stats['yahoo.com'].percentile(90))
+66.187
+"""
+
+import asyncio
+import math
+import os
+import random
+import select
+import socket
+import statistics
+import struct
+import time
+
+_ECHO_REQUEST = 8
+_ECHO_REPLY = 0
+
+
+def checksum(data):
+    """ RFC 1071 internet checksum of a bytes object."""
+    if len(data) % 2:
+        data += b'\x00'
+    _total = sum(struct.unpack('!{}H'.format(len(data) // 2), data))
+    _total = (_total >> 16) + (_total & 0xffff)
+    _total += _total >> 16
+    return ~_total & 0xffff
+
+
+class PingStats:
+
+    def __init__(self, host, address=None, error=None):
+        """
+        Round-trip time samples of one host.
+
+        :param host: string, hostname or IP address as given by the caller.
+        :param address: string, IPv4 address the echo requests were sent to.
+        :param error: exception or None, set when the host could not be pinged.
+        """
+        self.host = host
+        self.address = address
+        self.error = error
+        self.sent = 0
+        self.samples = []  # RTTs in ms, in reply order
+
+    @property
+    def received(self):
+        return len(self.samples)
+
+    @property
+    def loss(self):
+        """ Packet loss ratio from 0.0 to 1.0."""
+        if not self.sent:
+            return 1.0
+        return 1 - self.received / self.sent
+
+    @property
+    def min(self):
+        return min(self.samples) if self.samples else None
+
+    @property
+    def max(self):
+        return max(self.samples) if self.samples else None
+
+    @property
+    def mean(self):
+        return statistics.fmean(self.samples) if self.samples else None
+
+    @property
+    def stddev(self):
+        return statistics.pstdev(self.samples) if self.samples else None
+
+    def percentile(self, p):
+        """
+        Linear-interpolated percentile of the RTT samples.
+
+        :param p: number, percentile from 0 to 100.
+        :return: float, RTT in ms, or None without samples.
+        """
+        if not self.samples:
+            return None
+        _ordered = sorted(self.samples)
+        _rank = (len(_ordered) - 1) * p / 100
+        _low = math.floor(_rank)
+        _high = math.ceil(_rank)
+        return _ordered[_low] + (_ordered[_high] - _ordered[_low]) * (_rank - _low)
+
+    def __repr__(self):
+        return 'PingStats({!r}, sent={}, received={}, mean={})'.format(
+            self.host, self.sent, self.received, self.mean)
+
+
+class _Session:
+    """ Send/receive state of one multiplexed ping run."""
+
+    def __init__(self, engine, targets, count, interval, payload_size, timeout,
+                 give_up=None):
+        self.engine = engine
+        self.targets = targets  # address -> list of PingStats
+        self.count = count
+        self.interval = interval
+        self.payload = os.urandom(payload_size)
+        self.timeout = timeout
+        self.seq = 0
+        self.pending = {}  # (address, seq) -> send time
+        self.next_send = time.monotonic()
+        self.deadline = None
+        self.give_up = give_up
+        self.first_sent = {}  # address -> time of its first echo request
+        self.answered = set()  # addresses that replied at least once
+        self.silent = set()  # addresses given up on
+
+    @property
+    def done(self):
+        if len(self.silent) == len(self.targets):
+            return True
+        if self.seq < self.count:
+            return False
+        return not self.pending or time.monotonic() >= self.deadline
+
+    def wait_time(self):
+        _now = time.monotonic()
+        if self.seq < self.count:
+            return max(0.0, self.next_send - _now)
+        return max(0.0, self.deadline - _now)
+
+    def step(self):
+        """ Send a round if one is due, then drain every queued reply."""
+        _now = time.monotonic()
+        if self.seq < self.count and _now >= self.next_send:
+            for _address, _stats in self.targets.items():
+                if _address in self.silent:
+                    continue
+                self.first_sent.setdefault(_address, _now)
+                try:
+                    self.engine._send(_address, self.seq, self.payload)
+                except OSError:
+                    # Send errors (no route, ...) count as lost probes.
+                    pass
+                else:
+                    self.pending[(_address, self.seq)] = time.monotonic()
+                for _stat in _stats:
+                    _stat.sent += 1
+            self.seq += 1
+            self.next_send += self.interval
+            if self.seq == self.count:
+                self.deadline = time.monotonic() + self.timeout
+        for _address, _seq, _received in self.engine._drain():
+            _sent = self.pending.pop((_address, _seq), None)
+            if _sent is not None:
+                self.answered.add(_address)
+                for _stat in self.targets[_address]:
+                    _stat.samples.append((_received - _sent) * 1000)
+        if self.give_up is not None:
+            self._give_up(time.monotonic())
+
+    def _give_up(self, now):
+        # Stop probing a host that left give_up requests unanswered for a
+        # whole timeout; it is down or drops ICMP either way.
+        for _address, _stats in self.targets.items():
+            if _address in self.answered or _address in self.silent:
+                continue
+            if _stats[0].sent >= self.give_up and \
+                    now - self.first_sent[_address] >= self.timeout:
+                self.silent.add(_address)
+                for _key in [key for key in self.pending
+                             if key[0] == _address]:
+                    del self.pending[_key]
+
+
+class IcmpEngine:
+
+    def __init__(self):
+        """
+        Open the ICMP socket; an unprivileged datagram socket is preferred,
+        a raw socket is the fallback.
+
+        Raises PermissionError when neither socket type may be opened.
+        """
+        try:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                                       socket.IPPROTO_ICMP)
+            self.raw = False
+        except PermissionError:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_RAW,
+                                       socket.IPPROTO_ICMP)
+            self.raw = True
+        self._sock.setblocking(False)
+        # The kernel rewrites the identifier of datagram sockets to the local
+        # port and only delivers our own replies; raw sockets see every ICMP
+        # packet on the host, so they filter on this identifier.
+        self._ident = random.randrange(1, 0x10000)
+
+    def close(self):
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _send(self, address, seq, payload):
+        _header = struct.pack('!BBHHH', _ECHO_REQUEST, 0, 0, self._ident,
+                              seq & 0xffff)
+        _checksum = checksum(_header + payload)
+        _header = struct.pack('!BBHHH', _ECHO_REQUEST, 0, _checksum,
+                              self._ident, seq & 0xffff)
+        self._sock.sendto(_header + payload, (address, 0))
+
+    def _drain(self):
+        """ Read every queued packet; yields (address, seq, receive time)."""
+        while True:
+            try:
+                _packet, (_address, _) = self._sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            _received = time.monotonic()
+            if self.raw:
+                _packet = _packet[(_packet[0] & 0x0f) * 4:]
+            if len(_packet) < 8:
+                continue
+            _type, _, _, _ident, _seq = struct.unpack('!BBHHH', _packet[:8])
+            if _type != _ECHO_REPLY:
+                continue
+            if self.raw and _ident != self._ident:
+                continue
+            yield _address, _seq, _received
+
+    def _session(self, hosts, count, interval, payload_size, timeout,
+                 give_up=None):
+        try:
+            assert type(count) is int and 1 <= count <= 10000,\
+                'count must be from 1-10000'
+            assert 0 <= payload_size <= 65507,\
+                'payload size must be from 0-65507'
+        except AssertionError as e:
+            raise ValueError(e)
+        _results = {}
+        _targets = {}
+        for _host in hosts:
+            try:
+                _address = socket.gethostbyname(_host)
+            except (socket.error, UnicodeError) as e:
+                _results[_host] = PingStats(_host, error=e)
+                continue
+            _results[_host] = PingStats(_host, _address)
+            _targets.setdefault(_address, []).append(_results[_host])
+        return _results, _Session(self, _targets, count, interval,
+                                  payload_size, timeout, give_up)
+
+    def ping(self, hosts, count=9, interval=0.2, payload_size=56, timeout=1.0,
+             give_up=None):
+        """
+        Ping every host in hosts at once over this engine's socket.
+
+        :param hosts: iterable of strings, hostnames or IPv4 addresses.
+        :param count: integer, echo requests per host (1-10000).
+        :param interval: number, seconds between rounds of echo requests.
+        :param payload_size: integer, ICMP data bytes per echo request.
+        :param timeout: number, seconds to wait for replies after the last round.
+        :param give_up: integer or None, stop sending to a host once this
+        many echo requests went unanswered for timeout seconds; None sends
+        all count requests.
+        :return: dict, host -> PingStats.
+        """
+        _results, _session = self._session(hosts, count, interval,
+                                           payload_size, timeout, give_up)
+        while not _session.done:
+            select.select([self._sock], [], [], _session.wait_time())
+            _session.step()
+        return _results
+
+    async def ping_async(self, hosts, count=9, interval=0.2, payload_size=56,
+                         timeout=1.0, give_up=None):
+        """
+        Awaitable version of ping; waits for replies on the running event
+        loop instead of blocking in select.
+        """
+        _loop = asyncio.get_running_loop()
+        _readable = asyncio.Event()
+        _results, _session = self._session(hosts, count, interval,
+                                           payload_size, timeout, give_up)
+        _loop.add_reader(self._sock.fileno(), _readable.set)
+        try:
+            while not _session.done:
+                try:
+                    await asyncio.wait_for(_readable.wait(), _session.wait_time())
+                except asyncio.TimeoutError:
+                    pass
+                _readable.clear()
+                _session.step()
+        finally:
+            _loop.remove_reader(self._sock.fileno())
+        return _results
+
+
+def main():
+    with IcmpEngine() as engine:
+        for host, stats in engine.ping(['127.0.0.1', 'localhost'], count=5).items():
+            print(host, stats.loss, stats.min, stats.mean, stats.max,
+                  stats.stddev, stats.percentile(90))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module loads NetElement definitions from JSON Lines, CSV or YAML
+inventory files. Files are parsed one record at a time and every element is
+built only when the consumer asks for the next one, so a sweep of a 500k
+element inventory starts right away and memory stays flat: Fleet.sweep pulls
+elements from the generator only when it has room to run them.
+
+Every record has the fields NetElement validates: name, kind, dns_types,
+dns_servers, ports, urls, tls and note; only name and kind are required.
+
+    inventory.jsonl:
+    {"name": "google.com", "kind": "Web server", "dns_types": ["a"],
+     "dns_servers": ["8.8.8.8"], "ports": ["t80", "t443"],
+     "urls": ["https://google.com"], "tls": [443]}
+
+    inventory.csv (list fields separated by spaces):
+    name,kind,dns_types,dns_servers,ports,urls,tls,note
+    google.com,Web server,a,8.8.8.8,t80 t443,https://google.com,443,
+
+    inventory.yaml (a list of mappings, or one mapping per document):
+    - name: google.com
+      kind: Web server
+      ports: [t80, t443]
+
+>>> from fleet import Fleet
+>>> from inventory import load
+>>> for name, report in Fleet().sweep(load('inventory.jsonl', concurrent=True)):
+...     print(report)
+"""
+
+import csv
+import json
+import os
+import sys
+from element import NetElement
+
+try:
+    import yaml
+except ImportError:
+    yaml = None  # only YAML inventories need PyYAML
+
+# TODO sudo pip3 install pyyaml
+
+# Inventory fields; a None or empty list field skips that check.
+FIELDS = ('name', 'kind', 'dns_types', 'dns_servers', 'ports', 'urls', 'tls',
+          'note')
+LIST_FIELDS = ('dns_types', 'dns_servers', 'ports', 'urls', 'tls')
+
+# File extension -> format.
+FORMATS = {'.jsonl': 'jsonl', '.ndjson': 'jsonl', '.json': 'jsonl',
+           '.csv': 'csv', '.yaml': 'yaml', '.yml': 'yaml'}
+
+
+class InventoryError(ValueError):
+
+    def __init__(self, path, line, message):
+        super().__init__('{}:{}: {}'.format(path, line, message))
+        self.path = path
+        self.line = line
+
+
+def _jsonl_records(f):
+    for _number, _line in enumerate(f, 1):
+        if not _line.strip() or _line.lstrip().startswith('#'):
+            continue
+        try:
+            yield _number, json.loads(_line)
+        except ValueError as e:
+            yield _number, e
+
+
+def _csv_records(f):
+    _reader = csv.DictReader(f)
+    for _row in _reader:
+        _record = {}
+        for _field, _value in _row.items():
+            if _field is None:
+                yield _reader.line_num, ValueError('more cells than columns')
+                break
+            _value = (_value or '').strip()
+            if _field in LIST_FIELDS:
+                _record[_field] = _value.split() or None
+            else:
+                _record[_field] = _value or None
+        else:
+            yield _reader.line_num, _record
+
+
+def _yaml_records(f):
+    if yaml is None:
+        raise ImportError('YAML inventories need PyYAML; pip3 install pyyaml')
+    # Walk the event stream so that only one record is ever composed: the
+    # items of a top-level list, or one mapping per document.
+    _loader = yaml.SafeLoader(f)
+    try:
+        _loader.get_event()  # stream start
+        while not _loader.check_event(yaml.StreamEndEvent):
+            _loader.get_event()  # document start
+            if _loader.check_event(yaml.SequenceStartEvent):
+                _loader.get_event()
+                while not _loader.check_event(yaml.SequenceEndEvent):
+                    _line = _loader.peek_event().start_mark.line + 1
+                    _node = _loader.compose_node(None, None)
+                    yield _line, _loader.construct_document(_node)
+                _loader.get_event()
+            elif not _loader.check_event(yaml.DocumentEndEvent):
+                _line = _loader.peek_event().start_mark.line + 1
+                _node = _loader.compose_node(None, None)
+                yield _line, _loader.construct_document(_node)
+            _loader.get_event()  # document end
+            _loader.anchors = {}
+    except yaml.YAMLError as e:
+        _mark = getattr(e, 'problem_mark', None)
+        yield (_mark.line + 1 if _mark else 0), ValueError(e)
+    finally:
+        _loader.dispose()
+
+
+def _check(record):
+    """ The NetElement keyword arguments for record; raises ValueError."""
+    if not isinstance(record, dict):
+        raise ValueError('expected a mapping, received {}'.format(
+            type(record).__name__))
+    _unknown = set(record) - set(FIELDS)
+    if _unknown:
+        raise ValueError('unknown fields {}'.format(', '.join(sorted(_unknown))))
+    for _field in ('name', 'kind'):
+        if type(record.get(_field)) is not str or not record[_field]:
+            raise ValueError('expected a string for {}'.format(_field))
+    if record.get('note') is not None and type(record['note']) is not str:
+        raise ValueError('expected a string for note')
+    _kwargs = {'note': record.get('note')}
+    for _field in LIST_FIELDS:
+        _value = record.get(_field)
+        if isinstance(_value, str):
+            _value = _value.split()
+        if _field == 'tls' and type(_value) in (list, tuple):
+            # TLS ports are numbers; CSV and YAML may give them as strings.
+            _value = [int(item) if type(item) is str and item.isdigit()
+                      else item for item in _value]
+            if not all(type(item) is int and 0 < item < 65536
+                       for item in _value):
+                raise ValueError('expected a list of TCP ports for tls')
+        elif _value is not None and (type(_value) not in (list, tuple) or not all(
+                type(item) is str for item in _value)):
+            raise ValueError('expected a list of strings for {}'.format(_field))
+        _kwargs[_field] = tuple(_value) if _value else None
+    if (_kwargs['dns_types'] is None) != (_kwargs['dns_servers'] is None):
+        raise ValueError('both dns_types & dns_servers should be set or empty')
+    return _kwargs
+
+
+def build(record, **defaults):
+    """
+    Build the NetElement an inventory record describes.
+
+    :param record: dict with the fields in FIELDS.
+    :param defaults: other NetElement keyword arguments.
+    :return: NetElement; raises ValueError for a malformed record.
+    """
+    _kwargs = _check(record)
+    return NetElement(record['name'], record['kind'],
+                      dns_types=_kwargs['dns_types'],
+                      dns_servers=_kwargs['dns_servers'],
+                      ports=_kwargs['ports'], urls=_kwargs['urls'],
+                      tls=_kwargs['tls'], note=_kwargs['note'], **defaults)
+
+
+def records(path, format=None):
+    """
+    Stream the records of an inventory file without validating them.
+
+    :param path: string, path of the inventory file.
+    :param format: string or None, 'jsonl', 'csv' or 'yaml'; guessed from
+    the file extension by default.
+    :return: generator of (line number, record dict or parse exception).
+    """
+    _format = format or FORMATS.get(os.path.splitext(path)[1].lower())
+    try:
+        assert _format in ('jsonl', 'csv', 'yaml'),\
+            'Validation error; expected a jsonl, csv or yaml inventory, '\
+            'received {}.'.format(path)
+    except AssertionError as e:
+        print(e)
+        exit()
+    _parse = {'jsonl': _jsonl_records, 'csv': _csv_records,
+              'yaml': _yaml_records}[_format]
+    with open(path, newline='' if _format == 'csv' else None) as f:
+        yield from _parse(f)
+
+
+def load(path, format=None, on_error=None, **defaults):
+    """
+    Lazily build a NetElement per inventory record. Nothing is read before
+    the first element is requested, and each element is built only when
+    the consumer asks for it.
+
+    :param path: string, path of the inventory file.
+    :param format: string or None, 'jsonl', 'csv' or 'yaml'; guessed from
+    the file extension by default.
+    :param on_error: callable(error) or None, called with an InventoryError
+    for every malformed record, which is then skipped; by default the error
+    is raised.
+    :param defaults: other NetElement keyword arguments applied to every
+    element, e.g. concurrent=True or toolkit=Toolkit(...).
+    :return: generator of NetElement objects.
+    """
+    for _line, _record in records(path, format):
+        try:
+            if isinstance(_record, Exception):
+                raise _record
+            _element = build(_record, **defaults)
+        except ValueError as e:
+            _error = InventoryError(path, _line, e)
+            if on_error is None:
+                raise _error
+            on_error(_error)
+            continue
+        yield _element
+
+
+def main(path=None):
+    from fleet import Fleet
+
+    if path is None:
+        path = sys.argv[1] if len(sys.argv) > 1 else input('Inventory file > ')
+    if not os.path.isfile(path):
+        print('No such inventory file: {}'.format(path))
+        return
+
+    def _report(index, element, report):
+        print(report)
+
+    Fleet(workers=64, per_host=1).sweep(
+        load(path, on_error=lambda error: print(error, file=sys.stderr),
+             concurrent=True),
+        on_result=_report, keep=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module instruments the hot paths of sleuth. Every Toolkit check and
+every NetElement stage (each kind of check, the whole load_data, a Fleet
+sweep) records a timing span into a Metrics registry, along with counters
+for calls, errors by exception type and timeouts. A registry is exported as
+Prometheus/OpenMetrics text, served on a local HTTP endpoint or written to a
+file for the node_exporter textfile collector.
+
+SamplingProfiler samples the stacks of every thread while it is active and
+can be attached to one sweep (Fleet.sweep(elements, profiler=...)) to see
+where the time inside the probes goes.
+
+>>> import metrics
+>>> from toolkit import Toolkit
+>>> print(Toolkit().check_socket('google.com', 't81'))
+filtered
+>>> print(metrics.registry.exposition())
+# TYPE sleuth_check_duration_seconds histogram
+# UNIT sleuth_check_duration_seconds seconds
+# HELP sleuth_check_duration_seconds Time spent in Toolkit checks.
+sleuth_check_duration_seconds_bucket{check="check_socket",le="0.001"} 0
+...
+sleuth_check_timeouts_total{check="check_socket"} 1
+# EOF
+>>> metrics.registry.serve(9464)  # http://127.0.0.1:9464/metrics
+"""
+
+import bisect
+import functools
+import http.server
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Upper bounds, in seconds, of the duration histogram buckets; probes range
+# from cached DNS answers (microseconds) to ping runs (seconds).
+BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5,
+           10, 30)
+
+# Span kinds -> HELP text of their metric families.
+KINDS = {'check': 'Toolkit checks', 'stage': 'NetElement and Fleet stages'}
+
+# Result states that mean a probe got no answer before its timeout (a ping
+# that lost every echo request counts too, see _timeouts).
+TIMEOUT_STATES = ('filtered', 'open|filtered')
+
+
+def _errors(result):
+    """ The exceptions held by a result record, or a list or dict of them."""
+    if isinstance(result, dict):
+        result = list(result.values())
+    if isinstance(result, (list, tuple)):
+        _errors_found = []
+        for _item in result:
+            _errors_found.extend(_errors(_item))
+        return _errors_found
+    _error = getattr(result, 'error', None)
+    return [] if _error is None else [_error]
+
+
+def _timeouts(result):
+    """
+    Number of records in result that timed out without an error: a port
+    state of TIMEOUT_STATES, or echo requests that all went unanswered.
+    """
+    if isinstance(result, dict):
+        result = list(result.values())
+    if isinstance(result, (list, tuple)):
+        return sum(_timeouts(item) for item in result)
+    if getattr(result, 'state', None) in TIMEOUT_STATES:
+        return 1
+    return 1 if getattr(result, 'sent', None) and \
+        getattr(result, 'received', None) == 0 else 0
+
+
+def error_name(error):
+    """
+    Label for an exception; wrappers such as urllib's URLError are named
+    after the exception they wrap.
+    """
+    _reason = getattr(error, 'reason', None)
+    if isinstance(_reason, Exception):
+        error = _reason
+    return type(error).__name__
+
+
+def is_timeout(error):
+    """ True for socket, asyncio and dnspython timeouts, wrapped or not."""
+    _reason = getattr(error, 'reason', None)
+    if isinstance(_reason, Exception):
+        error = _reason
+    return isinstance(error, TimeoutError) or any(
+        cls.__name__ in ('Timeout', 'timeout') for cls in type(error).__mro__)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n')\
+        .replace('"', r'\"')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value))
+                          for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+
+    def __init__(self, prefix='sleuth', buckets=BUCKETS):
+        """
+        Thread-safe registry of timing spans and counters.
+
+        :param prefix: string, prefix of every metric name.
+        :param buckets: tuple of numbers, ascending upper bounds in seconds
+        of the duration histogram buckets.
+        """
+        try:
+            assert type(prefix) is str and prefix.isidentifier(),\
+                'Validation error; expected an identifier for prefix, received {}.'\
+                .format(prefix)
+
+            assert len(buckets) > 0 and list(buckets) == sorted(buckets),\
+                'Validation error; expected ascending buckets, received {}.'\
+                .format(buckets)
+        except AssertionError as e:
+            print(e)
+            exit()
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # (kind, name) -> [calls, seconds, bucket counts...]
+        self._durations = {}
+        self._errors = Counter()  # (kind, name, error name) -> count
+        self._timeouts = Counter()  # (kind, name) -> count
+
+    def observe(self, kind, name, seconds, errors=(), timeouts=0):
+        """
+        Record one span.
+
+        :param kind: string, 'check' or 'stage' (see KINDS).
+        :param name: string, check or stage name, e.g. 'check_dns'.
+        :param seconds: number, duration of the span.
+        :param errors: iterable of exceptions the span ended with.
+        :param timeouts: integer, timeouts that did not raise, e.g. filtered
+        ports.
+        """
+        _bucket = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            _series = self._durations.get((kind, name))
+            if _series is None:
+                _series = self._durations[(kind, name)] = \
+                    [0, 0.0] + [0] * (len(self.buckets) + 1)
+            _series[0] += 1
+            _series[1] += seconds
+            _series[2 + _bucket] += 1
+            for _error in errors:
+                self._errors[(kind, name, error_name(_error))] += 1
+                if is_timeout(_error):
+                    timeouts += 1
+            if timeouts:
+                self._timeouts[(kind, name)] += timeouts
+
+    def span(self, kind, name):
+        """
+        Context manager timing its block as one span; an exception raised in
+        the block is counted as an error and re-raised.
+
+            with registry.span('stage', 'dns'):
+                ...
+        """
+        return _Span(self, kind, name)
+
+    def record(self, kind, name, call, *args, **kwargs):
+        """
+        Time call(*args, **kwargs) as one span and return its result. Errors
+        held by the returned result record(s) count as errors of the span.
+        """
+        _start = time.perf_counter()
+        try:
+            _result = call(*args, **kwargs)
+        except Exception as e:
+            self.observe(kind, name, time.perf_counter() - _start, [e])
+            raise
+        self.observe(kind, name, time.perf_counter() - _start,
+                     _errors(_result), _timeouts(_result))
+        return _result
+
+    def reset(self):
+        """ Forget every span and counter."""
+        with self._lock:
+            self._durations.clear()
+            self._errors.clear()
+            self._timeouts.clear()
+
+    def snapshot(self):
+        """
+        Totals per span as a dict: (kind, name) -> dict of calls, seconds,
+        errors (error name -> count) and timeouts.
+        """
+        with self._lock:
+            _snapshot = {_key: {'calls': _series[0], 'seconds': _series[1],
+                                'errors': {}, 'timeouts':
+                                    self._timeouts.get(_key, 0)}
+                         for _key, _series in self._durations.items()}
+            for (_kind, _name, _error), _count in self._errors.items():
+                _snapshot[(_kind, _name)]['errors'][_error] = _count
+        return _snapshot
+
+    def exposition(self, openmetrics=True):
+        """
+        Every metric as text in the OpenMetrics format, or in the Prometheus
+        0.0.4 text format with openmetrics=False.
+
+        :return: string.
+        """
+        with self._lock:
+            _durations = {key: list(series)
+                          for key, series in self._durations.items()}
+            _errors = dict(self._errors)
+            _timeouts = dict(self._timeouts)
+
+        _lines = []
+
+        def _family(name, kind, help_text, unit=None):
+            # Prometheus names a counter family after its _total samples.
+            _name = name + '_total' if kind == 'counter' and not openmetrics \
+                else name
+            _lines.append('# TYPE {} {}'.format(_name, kind))
+            if unit and openmetrics:
+                _lines.append('# UNIT {} {}'.format(_name, unit))
+            _lines.append('# HELP {} {}'.format(_name, help_text))
+
+        for _kind, _help in KINDS.items():
+            _keys = sorted(key for key in _durations if key[0] == _kind)
+            if not _keys:
+                continue
+            _base = '{}_{}'.format(self.prefix, _kind)
+
+            _family(_base + '_duration_seconds', 'histogram',
+                    'Time spent in {}.'.format(_help), 'seconds')
+            for _key in _keys:
+                _series = _durations[_key]
+                _cumulative = 0
+                for _bound, _count in zip(self.buckets + (float('inf'),),
+                                          _series[2:]):
+                    _cumulative += _count
+                    _lines.append('{}_duration_seconds_bucket{} {}'.format(
+                        _base, _labels([(_kind, _key[1]),
+                                        ('le', _number(_bound))]),
+                        _cumulative))
+                _lines.append('{}_duration_seconds_count{} {}'.format(
+                    _base, _labels([(_kind, _key[1])]), _series[0]))
+                _lines.append('{}_duration_seconds_sum{} {}'.format(
+                    _base, _labels([(_kind, _key[1])]), _number(_series[1])))
+
+            _family(_base + '_calls', 'counter',
+                    'Calls of {}.'.format(_help))
+            for _key in _keys:
+                _lines.append('{}_calls_total{} {}'.format(
+                    _base, _labels([(_kind, _key[1])]), _durations[_key][0]))
+
+            _family(_base + '_errors', 'counter',
+                    'Errors of {} by exception type.'.format(_help))
+            for (_error_kind, _name, _error), _count in sorted(_errors.items()):
+                if _error_kind == _kind:
+                    _lines.append('{}_errors_total{} {}'.format(
+                        _base, _labels([(_kind, _name), ('error', _error)]),
+                        _count))
+
+            _family(_base + '_timeouts', 'counter',
+                    'Timeouts of {}.'.format(_help))
+            for _key in _keys:
+                _lines.append('{}_timeouts_total{} {}'.format(
+                    _base, _labels([(_kind, _key[1])]),
+                    _timeouts.get(_key, 0)))
+
+        if openmetrics:
+            _lines.append('# EOF')
+        return '\n'.join(_lines) + '\n'
+
+    def write(self, path, openmetrics=False):
+        """
+        Write the exposition to path atomically, e.g. into the directory of
+        node_exporter's textfile collector (which reads the Prometheus
+        format, hence the default).
+        """
+        _temporary = '{}.{}.tmp'.format(path, os.getpid())
+        with open(_temporary, 'w') as f:
+            f.write(self.exposition(openmetrics))
+        os.replace(_temporary, path)
+
+    def serve(self, port=9464, host='127.0.0.1'):
+        """
+        Serve the exposition at http://host:port/metrics from a daemon
+        thread. Scrapers asking for application/openmetrics-text get the
+        OpenMetrics format, others the Prometheus text format.
+
+        :return: http.server.ThreadingHTTPServer; call its shutdown() to stop.
+        """
+        _registry = self
+
+        class _Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                _openmetrics = 'application/openmetrics-text' in \
+                    self.headers.get('Accept', '')
+                _body = _registry.exposition(_openmetrics).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', (
+                    'application/openmetrics-text; version=1.0.0; charset=utf-8'
+                    if _openmetrics else 'text/plain; version=0.0.4; charset=utf-8'))
+                self.send_header('Content-Length', str(len(_body)))
+                self.end_headers()
+                self.wfile.write(_body)
+
+            def log_message(self, format, *args):
+                pass
+
+        _server = http.server.ThreadingHTTPServer((host, port), _Handler)
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
+
+
+class _Span:
+
+    __slots__ = ('_registry', '_kind', '_name', '_start')
+
+    def __init__(self, registry, kind, name):
+        self._registry = registry
+        self._kind = kind
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._registry.observe(
+            self._kind, self._name, time.perf_counter() - self._start,
+            [exc] if isinstance(exc, Exception) else ())
+        return False
+
+
+def instrumented(method):
+    """
+    Decorator for Toolkit checks: each call is recorded as a 'check' span
+    named after the method in self.metrics, unless that is None.
+    """
+    @functools.wraps(method)
+    def _wrapper(self, *args, **kwargs):
+        if self.metrics is None:
+            return method(self, *args, **kwargs)
+        return self.metrics.record('check', method.__name__, method, self,
+                                   *args, **kwargs)
+    return _wrapper
+
+
+class SamplingProfiler:
+
+    def __init__(self, interval=0.005, depth=64):
+        """
+        Statistical profiler: while active, a background thread records the
+        stack of every other thread every interval seconds. Unlike cProfile,
+        it sees the worker threads of a sweep and costs the probes almost
+        nothing.
+
+            profiler = SamplingProfiler()
+            fleet.sweep(elements, profiler=profiler)
+            profiler.write('sweep.folded')  # flamegraph.pl, speedscope
+
+        :param interval: number, seconds between samples.
+        :param depth: integer, innermost frames kept per stack.
+        """
+        self.interval = interval
+        self.depth = depth
+        self.samples = 0
+        self.stacks = Counter()  # folded stack -> samples
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _frame_name(frame):
+        _code = frame.f_code
+        return '{}:{}'.format(os.path.basename(_code.co_filename),
+                              _code.co_name)
+
+    def _sample(self):
+        _own = threading.get_ident()
+        while not self._stopping.wait(self.interval):
+            for _ident, _frame in sys._current_frames().items():
+                if _ident == _own:
+                    continue
+                _names = []
+                while _frame is not None and len(_names) < self.depth:
+                    _names.append(self._frame_name(_frame))
+                    _frame = _frame.f_back
+                self.stacks[';'.join(reversed(_names))] += 1
+            self.samples += 1
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def top(self, count=20):
+        """
+        Functions most often found running, idle waits included.
+
+        :return: list of (function, share of thread samples) tuples.
+        """
+        _total = sum(self.stacks.values())
+        _leaves = Counter()
+        for _stack, _count in self.stacks.items():
+            _leaves[_stack.rsplit(';', 1)[-1]] += _count
+        return [(name, count / _total)
+                for name, count in _leaves.most_common(count)]
+
+    def write(self, path):
+        """ Write the samples as folded stacks, one 'a;b;c count' per line."""
+        with open(path, 'w') as f:
+            for _stack, _count in self.stacks.most_common():
+                f.write('{} {}\n'.format(_stack, _count))
+
+
+# Process-wide registry every Toolkit records into by default.
+registry = Metrics()
+
+
+def main():
+    from element import NetElement
+
+    registry.serve(9464)
+    google = NetElement('google.com',
+                        'Web server',
+                        dns_types=('a',),
+                        dns_servers=('8.8.8.8',),
+                        ports=('t80', 't443'),
+                        urls=('https://google.com',),
+                        note=None,
+                        concurrent=True)
+    with SamplingProfiler() as profiler:
+        print(google)
+    print(registry.exposition())
+    for name, share in profiler.top(10):
+        print('{:6.1%} {}'.format(share, name))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module runs NetElement checks continuously, each check kind of each
+element on its own interval (ping every 10s, DNS every 5 min, ...). Every due
+check sits in one heap ordered by due time, so scheduling costs O(log n) per
+run no matter how many elements are monitored, and the scheduler sleeps until
+the next check is due or a probe completes. First runs are spread at random
+over one interval, and every later run is jittered a little, so probes never
+fire in lockstep.
+
+Probes that fall behind never build a backlog: a check still running when it
+comes due again is skipped, and when every worker is busy a due check is
+either skipped (overrun='skip') or held until a worker frees up
+(overrun='wait'). Checks stay on their own interval grid, so missed runs are
+dropped rather than replayed.
+
+>>> from element import NetElement
+>>> from monitor import Monitor
+>>> monitor = Monitor(intervals={'ping': 10, 'dns': 300, 'url': 30})
+>>> monitor.add(NetElement('google.com', 'Web server', dns_types=('a',),
+...                        dns_servers=('8.8.8.8',), ports=None,
+...                        urls=('https://google.com',), note=None))
+>>> monitor.run()
+12:00:03 google.com ping (1806ms)
+	Packet loss: 0%
+	Latency (RTTms): 22.735
+"""
+
+import heapq
+import itertools
+import random
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from element import CHECKS
+
+# Seconds between runs of each check kind.
+DEFAULT_INTERVALS = {'dns': 300, 'ping': 10, 'socket': 60, 'url': 30,
+                     'tls': 3600}
+
+
+def print_result(element, check, results, started, elapsed):
+    """ Default result reporter; prints a timestamped block per check run."""
+    if isinstance(results, Exception):
+        _lines = ['error: {}'.format(results)]
+    else:
+        _lines = element.report(check, results)
+    print('{} {} {} ({:.0f}ms)\n\t{}'.format(
+        time.strftime('%H:%M:%S', time.localtime(started)), element.name,
+        check, elapsed * 1000, '\n\t'.join(_lines)))
+
+
+class Monitor:
+
+    def __init__(self, intervals=None, workers=64, jitter=0.1, overrun='skip',
+                 on_result=print_result, store=None):
+        """
+        Continuous scheduler for NetElement checks.
+
+        :param intervals: dict or None, check kind -> seconds between runs;
+        merged over DEFAULT_INTERVALS. An element's own intervals argument
+        takes precedence.
+        :param workers: integer, maximum number of checks running at once.
+        :param jitter: number, fraction of the interval added at random to
+        every run after the first.
+        :param overrun: string, what to do with a due check while every
+        worker is busy: 'skip' drops the run, 'wait' holds it (and every
+        check due after it) until a worker frees up.
+        :param on_result: callable(element, check, results, started, elapsed)
+        or None; results is the list of result records NetElement.probe
+        returned or the exception raised, started is a time.time() timestamp
+        and elapsed is in seconds. It runs on the scheduler thread, so it
+        should return quickly; an exception it raises is printed to stderr
+        and counted in failed.
+        :param store: tsdb.SeriesStore or None, time-series store every
+        result is recorded in; failing writes are treated like on_result
+        exceptions.
+        """
+        try:
+            assert intervals is None or (type(intervals) is dict and
+                all(check in CHECKS and interval > 0
+                    for check, interval in intervals.items())),\
+                'Validation error; expected a dict of check: seconds for intervals, '\
+                'received {}.'.format(intervals)
+
+            assert type(workers) is int and workers > 0,\
+                'Validation error; expected a positive int for workers, received {}.'\
+                .format(workers)
+
+            assert 0 <= jitter <= 1,\
+                'Validation error; expected a jitter from 0 to 1, received {}.'\
+                .format(jitter)
+
+            assert overrun in ('skip', 'wait'),\
+                "Validation error; expected 'skip' or 'wait' for overrun, received {}."\
+                .format(overrun)
+
+            assert on_result is None or callable(on_result),\
+                'Validation error; expected a callable for on_result, received {}.'\
+                .format(type(on_result))
+        except AssertionError as e:
+            print(e)
+            exit()
+        self.intervals = dict(DEFAULT_INTERVALS, **(intervals or {}))
+        self.workers = workers
+        self.jitter = jitter
+        self.overrun = overrun
+        self.on_result = on_result
+        self.store = store
+        self.runs = 0
+        self.failed = 0
+        self.skipped = 0
+        self.lag = 0.0  # worst delay between due time and start, in seconds
+        self._heap = []  # (due, sequence, grid time, element, check)
+        self._sequence = itertools.count()
+        self._running = set()  # (id(element), check) pairs being probed
+        self._done = deque()  # completed futures, appended by worker threads
+        self._wake = threading.Event()
+        self._stopping = False
+
+    def __len__(self):
+        """ Number of scheduled (element, check) pairs."""
+        return len(self._heap)
+
+    def _interval(self, element, check):
+        return (element.intervals or {}).get(check, self.intervals[check])
+
+    def _push(self, due, grid, element, check):
+        heapq.heappush(self._heap, (due, next(self._sequence), grid, element,
+                                    check))
+
+    def add(self, element):
+        """
+        Schedule every check element is configured for; each first run lands
+        at a random point within one interval from now.
+
+        :param element: NetElement object.
+        """
+        _now = time.monotonic()
+        for _check in element.checks:
+            _grid = _now + random.uniform(0, self._interval(element, _check))
+            self._push(_grid, _grid, element, _check)
+
+    def _reschedule(self, grid, element, check, now):
+        _interval = self._interval(element, check)
+        _grid = grid + _interval
+        if _grid <= now:
+            # More than a whole interval behind; drop the missed runs.
+            _missed = int((now - _grid) // _interval) + 1
+            self.skipped += _missed
+            _grid += _missed * _interval
+        self._push(_grid + random.uniform(0, self.jitter * _interval), _grid,
+                   element, check)
+
+    def _completed(self, future):
+        self._done.append(future)
+        self._wake.set()
+
+    def _finish(self, future, element, check, started, start):
+        self._running.discard((id(element), check))
+        self.runs += 1
+        _failed = False
+        try:
+            _results = future.result()
+        except Exception as e:
+            _results = e
+            _failed = True
+        else:
+            if self.store is not None:
+                try:
+                    self.store.add_results(element.name, _results, started)
+                except Exception as e:
+                    _failed = self._failure('store', element, check, e)
+        if self.on_result is not None:
+            try:
+                self.on_result(element, check, _results, started,
+                               time.monotonic() - start)
+            except Exception as e:
+                _failed = self._failure('on_result', element, check, e)
+        if _failed:
+            self.failed += 1
+
+    @staticmethod
+    def _failure(stage, element, check, error):
+        # A full disk or a broken callback must not stop the scheduler; the
+        # run counts as failed.
+        print('{} {} {}: {} failed: {}: {}'.format(
+            time.strftime('%H:%M:%S'), element.name, check, stage,
+            type(error).__name__, error), file=sys.stderr)
+        return True
+
+    def stop(self):
+        """ Make run() return once the checks in progress complete."""
+        self._stopping = True
+        self._wake.set()
+
+    def run(self, duration=None):
+        """
+        Run checks as they come due until stop() is called, duration runs
+        out, or Ctrl-C.
+
+        :param duration: number or None, seconds to run; None runs forever.
+        """
+        self._stopping = False
+        _deadline = None if duration is None else time.monotonic() + duration
+        _in_flight = {}  # future -> (element, check, started, start)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            try:
+                while not self._stopping:
+                    self._wake.clear()
+                    while self._done:
+                        _future = self._done.popleft()
+                        self._finish(_future, *_in_flight.pop(_future))
+
+                    _now = time.monotonic()
+                    if _deadline is not None and _now >= _deadline:
+                        break
+                    _blocked = False
+                    while self._heap and self._heap[0][0] <= _now:
+                        _due, _, _grid, _element, _check = self._heap[0]
+                        if (id(_element), _check) in self._running:
+                            # The previous run has not finished; skip this one.
+                            heapq.heappop(self._heap)
+                            self.skipped += 1
+                            self._reschedule(_grid, _element, _check, _now)
+                            continue
+                        if len(_in_flight) >= self.workers:
+                            if self.overrun == 'wait':
+                                _blocked = True
+                                break
+                            heapq.heappop(self._heap)
+                            self.skipped += 1
+                            self._reschedule(_grid, _element, _check, _now)
+                            continue
+                        heapq.heappop(self._heap)
+                        self.lag = max(self.lag, _now - _due)
+                        self._running.add((id(_element), _check))
+                        _future = pool.submit(_element.probe, _check)
+                        _in_flight[_future] = (_element, _check, time.time(),
+                                               _now)
+                        _future.add_done_callback(self._completed)
+                        self._reschedule(_grid, _element, _check, _now)
+
+                    # Sleep until the next check is due; a completed probe
+                    # or stop() wakes us up early.
+                    _timeout = None
+                    if self._heap and not _blocked:
+                        _timeout = self._heap[0][0] - time.monotonic()
+                    if _deadline is not None:
+                        _left = _deadline - time.monotonic()
+                        _timeout = _left if _timeout is None else \
+                            min(_timeout, _left)
+                    if _timeout is None and not _in_flight:
+                        break  # nothing scheduled and nothing running
+                    self._wake.wait(None if _timeout is None else
+                                    max(0.0, _timeout))
+            except KeyboardInterrupt:
+                pass
+            finally:
+                for _future in _in_flight:
+                    _future.cancel()
+        # Report the checks that were still running.
+        while self._done:
+            _future = self._done.popleft()
+            if _future in _in_flight and not _future.cancelled():
+                self._finish(_future, *_in_flight.pop(_future))
+        self._running.clear()
+
+
+def main():
+    from element import NetElement
+
+    from tsdb import SeriesStore
+
+    hosts = ('google.com', 'yahoo.com', 'cnn.com')
+    monitor = Monitor(intervals={'ping': 10, 'dns': 300, 'url': 30},
+                      store=SeriesStore('sleuth-data'))
+    for host in hosts:
+        monitor.add(NetElement(host,
+                               'Web server',
+                               dns_types=('a',),
+                               dns_servers=('8.8.8.8',),
+                               ports=('t80', 't443'),
+                               urls=('https://' + host,),
+                               note=None))
+    monitor.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module scans many (host, port) pairs at once. Non-blocking connects are
+started for up to a window of targets, completion is awaited with selectors
+(epoll on Linux), and every target is reported as open (connected), closed
+(refused) or filtered (no answer before the timeout, or an ICMP unreachable).
+Hosts are scanned on their first address, IPv6 or IPv4; see module eyeballs
+to race both families.
+
+UDP ports get a datagram (a protocol-specific request for DNS, NTP and SNMP,
+an empty one otherwise) on a connected socket: a reply means open, an ICMP
+port unreachable (ECONNREFUSED on the socket) means closed, and silence after
+every retransmit means open|filtered.
+
+Port specs use the same syntax as Toolkit.check_socket: 't80' for TCP and
+'u53' for UDP.
+
+>>> from portscan import PortScanner
+>>> scanner = PortScanner(timeout=2)
+>>> scanner.scan([('google.com', 't80'), ('google.com', 't81'), ('localhost', 't1')])
+['open', 'filtered', 'closed']
+>>> scanner.scan([('8.8.8.8', 'u53'), ('localhost', 'u9'), ('google.com', 'u500')])
+['open', 'closed', 'open|filtered']
+"""
+
+import errno
+import heapq
+import itertools
+import os
+import resource
+import selectors
+import socket
+import time
+from collections import deque
+
+OPEN = 'open'
+CLOSED = 'closed'
+FILTERED = 'filtered'
+OPEN_FILTERED = 'open|filtered'
+
+# Requests that make well-known UDP services answer.
+UDP_PAYLOADS = {
+    # DNS: standard query, recursion desired, for the root NS records.
+    53: b'\x53\x4c\x01\x00\x00\x01\x00\x00\x00\x00\x00\x00'
+        b'\x00\x00\x02\x00\x01',
+    # NTP: version 3 client mode request.
+    123: b'\x1b' + b'\x00' * 47,
+    # SNMP: v1 get-request for sysDescr.0 with community 'public'.
+    161: b'\x30\x29\x02\x01\x00\x04\x06public'
+         b'\xa0\x1c\x02\x04\x53\x4c\x45\x55\x02\x01\x00\x02\x01\x00'
+         b'\x30\x0e\x30\x0c\x06\x08\x2b\x06\x01\x02\x01\x01\x01\x00'
+         b'\x05\x00',
+}
+
+# Errors meaning something on the path answered for the port: a refusal from
+# the host, or an ICMP unreachable/prohibited from a router or firewall.
+_CLOSED_ERRORS = (errno.ECONNREFUSED,)
+_FILTERED_ERRORS = (errno.EHOSTUNREACH, errno.ENETUNREACH, errno.EACCES,
+                    errno.EPERM, errno.ETIMEDOUT)
+
+
+def parse_port(port):
+    """
+    Split a port spec such as 't80' or 'u53' into its protocol letter and
+    port number, with the same checks Toolkit.check_socket applies.
+
+    :param port: string, port number prepended with 't' or 'u'.
+    :return: tuple, ('t' or 'u', integer port).
+    """
+    if type(port) is not str:
+        raise TypeError('a string is required')
+    assert port[:1].lower() == 'u' or port[:1].lower() == 't',\
+        'port must be prepended with u or t, received {}'.format(port)
+    assert 0 < int(port[1:]) < 65536, \
+        'port must be an integer 0-65536, received {}'.format(port[1:])
+    return port[0].lower(), int(port[1:])
+
+
+def port_state(error):
+    """
+    The state of a TCP port from the errno of a finished connect: OPEN,
+    CLOSED, FILTERED, or an OSError for other errors.
+    """
+    if error == 0:
+        return OPEN
+    if error in _CLOSED_ERRORS:
+        return CLOSED
+    if error in _FILTERED_ERRORS:
+        return FILTERED
+    return OSError(error, os.strerror(error))
+
+
+def _default_window():
+    # Leave room below the descriptor limit for everything else.
+    _soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    return max(16, min(4096, _soft - 64))
+
+
+class PortScanner:
+
+    def __init__(self, timeout=3, window=None, udp_retries=2, payloads=None,
+                 timeouts=None):
+        """
+        :param timeout: number, seconds a connect may take before the port
+        is reported as filtered; for UDP, seconds to wait after each datagram.
+        :param window: integer or None, probes in flight at once; defaults
+        to what the open file limit allows (up to 4096).
+        :param udp_retries: integer, UDP retransmits before a silent port is
+        reported as open|filtered.
+        :param payloads: dict or None, port -> bytes sent to UDP ports;
+        defaults to UDP_PAYLOADS, other ports get an empty datagram.
+        :param timeouts: rtt.HostTimeouts or None; when set, each TCP connect
+        waits as long as its host's observed RTT calls for (timeout at most)
+        and every completed handshake updates the host's estimate.
+        """
+        self.timeout = timeout
+        self.window = window or _default_window()
+        self.udp_retries = udp_retries
+        self.payloads = UDP_PAYLOADS if payloads is None else payloads
+        self.timeouts = timeouts
+
+    @staticmethod
+    def _resolve(host, addresses):
+        # The first address in the system's order of preference (RFC 6724),
+        # IPv4 or IPv6, as (family, sockaddr without the port).
+        if host not in addresses:
+            try:
+                _family, _, _, _, _sockaddr = socket.getaddrinfo(
+                    host, None, 0, socket.SOCK_STREAM)[0]
+                addresses[host] = (_family, _sockaddr)
+            except (socket.error, UnicodeError) as e:
+                addresses[host] = e
+        return addresses[host]
+
+    def scan(self, targets):
+        """
+        Scan every (host, port spec) pair in targets.
+
+        :param targets: iterable of (string, string) tuples, e.g.
+        ('yahoo.com', 't443').
+        :return: list aligned with targets; each item is 'open', 'closed',
+        'filtered', or the exception raised for that target.
+        """
+        _targets = list(targets)
+        _results = [None] * len(_targets)
+        _addresses = {}  # each host is resolved once per scan
+        _todo = deque()
+        _udp = deque()
+        for _index, (_host, _port) in enumerate(_targets):
+            try:
+                if type(_host) is not str:
+                    raise TypeError('a string is required')
+                _proto, _number = parse_port(_port)
+            except (AssertionError, TypeError, ValueError) as e:
+                _results[_index] = e
+                continue
+            _address = self._resolve(_host, _addresses)
+            if isinstance(_address, Exception):
+                _results[_index] = _address
+                continue
+            _family, _sockaddr = _address
+            _sockaddr = (_sockaddr[0], _number) + _sockaddr[2:]
+            if _proto == 't':
+                _todo.append((_index, _family, _sockaddr, _host))
+            else:
+                _udp.append((_index, _family, _sockaddr))
+        self._connect_all(_todo, _results)
+        self._probe_udp_all(_udp, _results)
+        return _results
+
+    def _connect_all(self, todo, results):
+        _selector = selectors.DefaultSelector()
+        _deadlines = []  # heap of (deadline, sequence, socket)
+        _sequence = itertools.count()
+        _in_flight = {}  # socket -> (result index, host, start time)
+
+        def _finish(sock, state):
+            _index, _host, _start = _in_flight.pop(sock)
+            results[_index] = state
+            _selector.unregister(sock)
+            sock.close()
+            if self.timeouts is not None:
+                if state == FILTERED:
+                    self.timeouts.backoff(_host)
+                elif state in (OPEN, CLOSED):
+                    # A SYN-ACK or a RST; either took one round trip.
+                    self.timeouts.observe(_host, time.monotonic() - _start)
+
+        try:
+            while todo or _in_flight:
+                while todo and len(_in_flight) < self.window:
+                    _index, _family, _address, _host = todo.popleft()
+                    _sock = socket.socket(_family, socket.SOCK_STREAM)
+                    _sock.setblocking(False)
+                    _start = time.monotonic()
+                    _error = _sock.connect_ex(_address)
+                    if _error in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                        _in_flight[_sock] = (_index, _host, _start)
+                        _selector.register(_sock, selectors.EVENT_WRITE)
+                        _timeout = self.timeout if self.timeouts is None else \
+                            self.timeouts.timeout(_host, self.timeout)
+                        heapq.heappush(_deadlines, (_start + _timeout,
+                                                    next(_sequence), _sock))
+                        continue
+                    results[_index] = self._state(_error)
+                    _sock.close()
+
+                _wait = max(0.0, _deadlines[0][0] - time.monotonic()) \
+                    if _deadlines else 0
+                for _key, _ in _selector.select(_wait):
+                    _sock = _key.fileobj
+                    _finish(_sock, self._state(
+                        _sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)))
+
+                _now = time.monotonic()
+                while _deadlines and (_deadlines[0][0] <= _now or
+                                      _deadlines[0][2] not in _in_flight):
+                    _, _, _sock = heapq.heappop(_deadlines)
+                    if _sock in _in_flight:
+                        _finish(_sock, FILTERED)
+        finally:
+            for _sock in list(_in_flight):
+                _selector.unregister(_sock)
+                _sock.close()
+            _selector.close()
+
+    def _probe_udp_all(self, todo, results):
+        _selector = selectors.DefaultSelector()
+        _deadlines = deque()  # (deadline, socket, attempt)
+        _in_flight = {}  # socket -> [result index, address, attempts]
+
+        def _finish(sock, state):
+            results[_in_flight.pop(sock)[0]] = state
+            _selector.unregister(sock)
+            sock.close()
+
+        def _send(sock):
+            _probe = _in_flight[sock]
+            _probe[2] += 1
+            _deadlines.append((time.monotonic() + self.timeout, sock, _probe[2]))
+            try:
+                sock.send(self.payloads.get(_probe[1][1], b''))
+            except OSError:
+                # An ICMP error for an earlier datagram; read it below.
+                pass
+
+        try:
+            while todo or _in_flight:
+                while todo and len(_in_flight) < self.window:
+                    _index, _family, _address = todo.popleft()
+                    _sock = socket.socket(_family, socket.SOCK_DGRAM)
+                    _sock.setblocking(False)
+                    try:
+                        # connect() makes the kernel report ICMP errors for
+                        # this destination on the socket.
+                        _sock.connect(_address)
+                    except OSError as e:
+                        results[_index] = self._state(e.errno)
+                        _sock.close()
+                        continue
+                    _in_flight[_sock] = [_index, _address, 0]
+                    _selector.register(_sock, selectors.EVENT_READ)
+                    _send(_sock)
+
+                _wait = max(0.0, _deadlines[0][0] - time.monotonic()) \
+                    if _deadlines else 0
+                for _key, _ in _selector.select(_wait):
+                    _sock = _key.fileobj
+                    try:
+                        _sock.recv(65535)
+                    except (BlockingIOError, InterruptedError):
+                        continue
+                    except OSError as e:
+                        _finish(_sock, self._state(e.errno))
+                        continue
+                    _finish(_sock, OPEN)
+
+                _now = time.monotonic()
+                while _deadlines and (_deadlines[0][0] <= _now or
+                                      _deadlines[0][1] not in _in_flight):
+                    _, _sock, _attempt = _deadlines.popleft()
+                    _probe = _in_flight.get(_sock)
+                    if _probe is None or _probe[2] != _attempt:
+                        continue
+                    if _attempt <= self.udp_retries:
+                        _send(_sock)
+                    else:
+                        _finish(_sock, OPEN_FILTERED)
+        finally:
+            for _sock in list(_in_flight):
+                _selector.unregister(_sock)
+                _sock.close()
+            _selector.close()
+
+    _state = staticmethod(port_state)
@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module defines the immutable result records returned by Toolkit checks.
+Records use __slots__, hold numeric fields (loss ratio, RTT in ms, status
+code, ...) rather than strings, and carry the exception of a failed check in
+their error field. str() of a record gives the text the checks used to
+return, e.g. '0%,22.735' for a PingResult.
+
+>>> from toolkit import Toolkit
+>>> result = Toolkit().check_ping('google.com', 3, 56)
+>>> result.loss, result.rtt
+(0.0, 22.735)
+>>> print(result)
+0%,22.735
+"""
+
+import math
+
+
+class Result:
+
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for _name in fields:
+            if _name not in self.__slots__:
+                raise TypeError('{} has no field {!r}'.format(
+                    type(self).__name__, _name))
+        for _name in self.__slots__:
+            object.__setattr__(self, _name, fields.get(_name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('{} is immutable'.format(type(self).__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError('{} is immutable'.format(type(self).__name__))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, _name) == getattr(other, _name)
+            for _name in self.__slots__)
+
+    def __hash__(self):
+        return hash(tuple(repr(getattr(self, _name)) for _name in self.__slots__))
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(_name, getattr(self, _name))
+            for _name in self.__slots__))
+
+    @property
+    def ok(self):
+        """ True when the check ran without an exception."""
+        return self.error is None
+
+    def replace(self, **changes):
+        """ A copy of this record with some fields changed."""
+        _fields = {_name: getattr(self, _name) for _name in self.__slots__}
+        _fields.update(changes)
+        return type(self)(**_fields)
+
+    def as_dict(self):
+        """ Fields as a plain dict; the error becomes its text."""
+        _fields = {_name: getattr(self, _name) for _name in self.__slots__}
+        if _fields.get('error') is not None:
+            _fields['error'] = str(_fields['error'])
+        return _fields
+
+
+class DnsResult(Result):
+
+    __slots__ = ('node', 'qtype', 'records', 'ttl', 'error')
+
+    @classmethod
+    def from_value(cls, node, qtype, value, ttl=None):
+        """
+        Build a record from a cached or freshly resolved value: a tuple of
+        record strings, or the NXDOMAIN/NoAnswer/... exception.
+        """
+        if isinstance(value, Exception):
+            return cls(node=node, qtype=qtype, ttl=ttl, error=value)
+        return cls(node=node, qtype=qtype, records=tuple(value), ttl=ttl)
+
+    def __str__(self):
+        if self.error is not None:
+            return str(self.error)
+        return ', '.join(self.records)
+
+
+class Attempt(Result):
+
+    # One connection attempt of a Happy Eyeballs race (module eyeballs):
+    # family 'IPv4' or 'IPv6'; state 'open', 'closed', 'filtered', 'pending'
+    # or 'cancelled', or None with error set; connect in ms, for open and
+    # closed only.
+    __slots__ = ('family', 'address', 'state', 'connect', 'error')
+
+    def __str__(self):
+        _text = str(self.error) if self.error is not None else self.state
+        if self.connect is not None:
+            _text += ' ({:.3f}ms)'.format(self.connect)
+        return '{} {}: {}'.format(self.family, self.address, _text)
+
+
+class SocketResult(Result):
+
+    # inferred: None for a probed port, else why the state was inferred
+    # from other checks of the host (see NetElement dependencies).
+    # family: 'IPv4' or 'IPv6', the family of the connection that answered
+    # a TCP check; attempts: tuple of Attempt of a dual-stack check.
+    __slots__ = ('node', 'port', 'state', 'error', 'inferred', 'family',
+                 'attempts')
+
+    def __str__(self):
+        if self.error is not None:
+            return str(self.error)
+        return self.state
+
+    @property
+    def families(self):
+        """ Family -> the Attempt of that family in attempts."""
+        return {_attempt.family: _attempt for _attempt in self.attempts or ()}
+
+    @property
+    def only(self):
+        """
+        The family the port answers on when the other family's attempt
+        was refused, dropped or failed; None when both families agree or
+        are not both known.
+        """
+        _families = self.families
+        _open = [_family for _family, _attempt in _families.items()
+                 if _attempt.state == 'open']
+        _failed = [_family for _family, _attempt in _families.items()
+                   if _attempt.state in ('closed', 'filtered') or
+                   _attempt.error is not None]
+        if len(_open) == 1 and len(_failed) == 1:
+            return _open[0]
+        return None
+
+
+class PingResult(Result):
+
+    __slots__ = ('node', 'address', 'sent', 'received', 'loss', 'rtt', 'min',
+                 'max', 'stddev', 'samples', 'error')
+
+    @classmethod
+    def from_stats(cls, node, stats):
+        """ Freeze an icmp.PingStats sample set into a record."""
+        if stats.error is not None:
+            return cls(node=node, address=stats.address, error=stats.error)
+        return cls(node=node, address=stats.address, sent=stats.sent,
+                   received=stats.received, loss=stats.loss, rtt=stats.mean,
+                   min=stats.min, max=stats.max, stddev=stats.stddev,
+                   samples=tuple(stats.samples))
+
+    @property
+    def loss_text(self):
+        """ Packet loss the way ping reports it, e.g. '0%' or '33.3333%'."""
+        if self.error is not None:
+            return str(self.error)
+        return '{:g}%'.format(round(self.loss * 100, 4))
+
+    @property
+    def rtt_text(self):
+        """ Average RTT in ms with three decimals, or 'Unreachable'."""
+        if self.rtt is None:
+            return 'Unreachable' if self.error is None else 'None'
+        return '{:.3f}'.format(self.rtt)
+
+    def percentile(self, p):
+        """
+        Linear-interpolated percentile of the RTT samples.
+
+        :param p: number, percentile from 0 to 100.
+        :return: float, RTT in ms, or None without samples.
+        """
+        if not self.samples:
+            return None
+        _ordered = sorted(self.samples)
+        _rank = (len(_ordered) - 1) * p / 100
+        _low = math.floor(_rank)
+        _high = math.ceil(_rank)
+        return _ordered[_low] + (_ordered[_high] - _ordered[_low]) * (_rank - _low)
+
+    def __str__(self):
+        return '{},{}'.format(self.loss_text, self.rtt_text)
+
+
+class Hop:
+
+    __slots__ = ('url', 'version', 'status', 'reason', 'location', 'reused',
+                 'dns', 'connect', 'tls', 'ttfb', 'peer', 'resumed')
+
+    def __init__(self, url, version, status, reason, location, reused,
+                 dns=None, connect=None, tls=None, ttfb=None, peer=None,
+                 resumed=None):
+        """
+        One request/response exchange of a redirect chain. Timings are in ms;
+        dns, connect and tls are None when the hop reused a pooled connection
+        (dns is also None for a connection pinned to an address, and tls for
+        plain HTTP). peer is the IPv4 or IPv6 address the connection went to.
+        resumed is True when a new HTTPS connection resumed a TLS session
+        instead of a full handshake.
+        """
+        self.url = url
+        self.version = version
+        self.status = status
+        self.reason = reason
+        self.location = location
+        self.reused = reused
+        self.dns = dns
+        self.connect = connect
+        self.tls = tls
+        self.ttfb = ttfb
+        self.peer = peer
+        self.resumed = resumed
+
+    @property
+    def family(self):
+        """ 'IPv6' or 'IPv4', the family of peer, or None."""
+        if self.peer is None:
+            return None
+        return 'IPv6' if ':' in self.peer else 'IPv4'
+
+    @property
+    def status_line(self):
+        return 'HTTP/{} {} {}'.format(self.version, self.status, self.reason)
+
+    def __str__(self):
+        if self.location:
+            return '{} -> Location: {}'.format(self.status_line, self.location)
+        return self.status_line
+
+    def __repr__(self):
+        return 'Hop({!r}, {}, reused={})'.format(self.url, self.status,
+                                                 self.reused)
+
+
+class HttpResult(Result):
+
+    # inferred: as for SocketResult. address: the IP address the URL's host
+    # was pinned to (see HttpProbe.fetch), or None when it was resolved.
+    __slots__ = ('url', 'status', 'reason', 'hops', 'error', 'inferred',
+                 'address')
+
+    def __str__(self):
+        if self.error is not None:
+            return str(self.error)
+        if self.status >= 400:
+            # The text urllib's HTTPError used to give for these.
+            return 'HTTP Error {}: {}'.format(self.status, self.reason)
+        return str(self.status)
+
+
+class HeaderResult(Result):
+
+    __slots__ = ('url', 'hops', 'error', 'address')
+
+    def __str__(self):
+        if self.error is not None:
+            return str(self.error)
+        return ' -> '.join(str(hop) for hop in self.hops)
+
+
+class TlsResult(Result):
+
+    # One TLS handshake (module tlsprobe): node is the server name sent in
+    # SNI and matched against the certificate, address the IP connected to.
+    # subject and issuer are the leaf certificate's common names, chain the
+    # subjects from the leaf up as the server sent them (unverified) or as
+    # they validated, None where the Python version (before 3.10) does not
+    # expose the peer's chain; sans the (type, value) subjectAltName
+    # entries. expires is the notAfter time
+    # in seconds since the epoch and days the days left until then (negative
+    # once expired). verified is False with verify_error set when the chain
+    # did not validate. connect and handshake are in ms; resumed is True
+    # when the handshake resumed a cached session.
+    __slots__ = ('node', 'port', 'address', 'version', 'cipher', 'subject',
+                 'issuer', 'chain', 'sans', 'expires', 'days',
+                 'hostname_match', 'verified', 'verify_error', 'resumed',
+                 'connect', 'handshake', 'error')
+
+    @property
+    def expiry_text(self):
+        """ 'expires in 87 days' or 'expired 3 days ago'."""
+        if self.days >= 0:
+            return 'expires in {} days'.format(math.floor(self.days))
+        return 'expired {} days ago'.format(math.ceil(-self.days))
+
+    def __str__(self):
+        if self.error is not None:
+            return str(self.error)
+        _text = '{} {}, certificate {}'.format(self.version, self.cipher,
+                                               self.expiry_text)
+        if not self.verified:
+            _text += ', not trusted: {}'.format(self.verify_error)
+        if not self.hostname_match:
+            _text += ', not valid for {}'.format(self.node)
+        return _text
+
+
+class TraceHop(Result):
+
+    # One TTL of a traceroute (module traceroute): address of what answered
+    # its probes (None when nothing did), probes sent and RTT samples in ms
+    # of those answered; error names the ICMP Destination Unreachable a hop
+    # sent back instead, e.g. 'host unreachable'.
+    __slots__ = ('ttl', 'address', 'sent', 'samples', 'error')
+
+    @property
+    def loss(self):
+        """ Ratio of probes of this TTL left unanswered."""
+        return 1 - len(self.samples) / self.sent if self.sent else 1.0
+
+    @property
+    def rtt(self):
+        """ Average RTT in ms, or None when no probe was answered."""
+        if not self.samples:
+            return None
+        return sum(self.samples) / len(self.samples)
+
+    def __str__(self):
+        if self.address is None:
+            return '{:>2}  *'.format(self.ttl)
+        _text = '{:>2}  {}  {}'.format(self.ttl, self.address, ' '.join(
+            ['{:.3f}ms'.format(_rtt) for _rtt in self.samples] +
+            ['*'] * (self.sent - len(self.samples))))
+        if self.error is not None:
+            _text += ' ({})'.format(self.error)
+        return _text
+
+
+class TraceResult(Result):
+
+    # address is the IPv4 address traced to, hops a tuple of TraceHop from
+    # TTL 1, up to the destination when reached (else up to the last hop
+    # that answered).
+    __slots__ = ('node', 'address', 'hops', 'reached', 'error')
+
+    def __str__(self):
+        if self.error is not None:
+            return str(self.error)
+        _path = ' -> '.join(_hop.address or '*' for _hop in self.hops)
+        if self.reached:
+            return '{} ({} hops)'.format(_path, len(self.hops))
+        return '{} -> ... (not reached in {} hops)'.format(
+            _path or '*', len(self.hops))
+
+
+class PmtuResult(Result):
+
+    # mtu is the largest packet in bytes (IP header included) that reached
+    # address with Don't Fragment set; local the MTU of the route out of
+    # this host, hop the router whose Fragmentation Needed lowered it (None
+    # when the path dropped larger probes silently) and probes the number of
+    # probe rounds the search took.
+    __slots__ = ('node', 'address', 'mtu', 'local', 'hop', 'probes', 'error')
+
+    def __str__(self):
+        if self.error is not None:
+            return str(self.error)
+        if self.mtu >= self.local:
+            return '{} bytes'.format(self.mtu)
+        if self.hop is not None:
+            return '{} bytes (Fragmentation Needed from {}; local {})'.format(
+                self.mtu, self.hop, self.local)
+        return '{} bytes (larger probes dropped silently; local {})'.format(
+            self.mtu, self.local)
+
+
+class SshResult(Result):
+
+    __slots__ = ('node', 'command', 'output', 'error')
+
+    def __str__(self):
+        if self.error is not None:
+            return str(self.error)
+        return self.output
+
+
+class RemoteError(Exception):
+
+    def __init__(self, name, message):
+        """
+        An exception raised in another process (see module agent), rebuilt
+        from its type name and text.
+        """
+        super().__init__(message)
+        self.name = name
+
+
+def _field_to_wire(value):
+    if isinstance(value, Exception):
+        return {'error': getattr(value, 'name', type(value).__name__),
+                'message': str(value)}
+    if isinstance(value, Hop):
+        return {'hop': {_name: getattr(value, _name)
+                        for _name in Hop.__slots__}}
+    if isinstance(value, Result):
+        return to_wire(value)
+    if isinstance(value, (list, tuple)):
+        return [_field_to_wire(item) for item in value]
+    return value
+
+
+def _field_from_wire(value):
+    if isinstance(value, dict) and 'error' in value:
+        return RemoteError(value['error'], value['message'])
+    if isinstance(value, dict) and 'hop' in value:
+        return Hop(**value['hop'])
+    if isinstance(value, dict) and 'record' in value:
+        return from_wire(value)
+    if isinstance(value, list):
+        return tuple(_field_from_wire(item) for item in value)
+    return value
+
+
+def to_wire(value):
+    """
+    JSON-ready form of a record, or of a list or dict of records, as the
+    checks return them. Errors travel as their type name and text.
+    """
+    if isinstance(value, Result):
+        return {'record': type(value).__name__,
+                'fields': {_name: _field_to_wire(getattr(value, _name))
+                           for _name in value.__slots__}}
+    if isinstance(value, dict):
+        return {'records': {_key: to_wire(item)
+                            for _key, item in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return [to_wire(item) for item in value]
+    return value
+
+
+def from_wire(data):
+    """ Rebuild what to_wire() encoded; errors come back as RemoteError."""
+    if isinstance(data, dict) and 'record' in data:
+        _class = {cls.__name__: cls for cls in Result.__subclasses__()}[
+            data['record']]
+        return _class(**{_name: _field_from_wire(value)
+                         for _name, value in data['fields'].items()})
+    if isinstance(data, dict) and 'records' in data:
+        return {_key: from_wire(item) for _key, item in data['records'].items()}
+    if isinstance(data, list):
+        return [from_wire(item) for item in data]
+    return data
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module derives per-host probe timeouts from observed round-trip times,
+with the smoothed RTT / RTT variance estimator TCP uses for its
+retransmission timeout (RFC 6298). Probes of a host that answers in 20ms
+give up after 1s instead of a fixed 3s, while hosts without history, or
+whose probes time out, keep the fixed timeout. Like TCP's, the timeout is
+never under 1s (RFC 6298 section 2.4): a lost SYN is only sent again after
+1s, so a shorter connect timeout would report a healthy port as filtered.
+
+>>> from rtt import HostTimeouts
+>>> timeouts = HostTimeouts()
+>>> timeouts.timeout('google.com', 3)
+3
+>>> for rtt in (0.021, 0.023, 0.022):
+...     timeouts.observe('google.com', rtt)
+>>> timeouts.timeout('google.com', 3)
+1.0
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class RttEstimator:
+
+    __slots__ = ('srtt', 'rttvar', 'rto', 'samples', 'alpha', 'beta', 'k',
+                 'granularity')
+
+    def __init__(self, alpha=1 / 8, beta=1 / 4, k=4, granularity=0.01):
+        """
+        Smoothed RTT of one host (RFC 6298); all times are in seconds.
+
+        :param alpha: number, gain of the smoothed RTT.
+        :param beta: number, gain of the RTT variance.
+        :param k: number, variances added to the smoothed RTT.
+        :param granularity: number, clock granularity; the least variance
+        margin of the timeout.
+        """
+        self.srtt = None
+        self.rttvar = None
+        self.rto = None  # None until the first sample
+        self.samples = 0
+        self.alpha = alpha
+        self.beta = beta
+        self.k = k
+        self.granularity = granularity
+
+    def update(self, rtt):
+        """ Fold in one measured round trip."""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.beta) * self.rttvar + \
+                self.beta * abs(self.srtt - rtt)
+            self.srtt = (1 - self.alpha) * self.srtt + self.alpha * rtt
+        self.rto = self.srtt + max(self.granularity, self.k * self.rttvar)
+        self.samples += 1
+
+    def backoff(self):
+        """ A probe timed out; double the timeout until the next sample."""
+        if self.rto is not None:
+            self.rto *= 2
+
+
+class HostTimeouts:
+
+    def __init__(self, minimum=1.0, maxsize=65536):
+        """
+        Thread-safe RttEstimator per host name (case-insensitive), least
+        recently used hosts forgotten first.
+
+        :param minimum: number, shortest timeout handed out in seconds, so
+        a host that answered in microseconds still gets time for a busy
+        moment and a retransmitted SYN.
+        :param maxsize: integer, hosts remembered.
+        """
+        self.minimum = minimum
+        self.maxsize = maxsize
+        self._estimators = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._estimators)
+
+    def _estimator(self, host):
+        _key = host.lower()
+        _estimator = self._estimators.get(_key)
+        if _estimator is None:
+            _estimator = self._estimators[_key] = RttEstimator()
+            if len(self._estimators) > self.maxsize:
+                self._estimators.popitem(last=False)
+        else:
+            self._estimators.move_to_end(_key)
+        return _estimator
+
+    def timeout(self, host, default):
+        """
+        Seconds to wait for an answer from host.
+
+        :param default: number, timeout of a host without history, and the
+        longest timeout handed out.
+        :return: number.
+        """
+        with self._lock:
+            _estimator = self._estimators.get(host.lower())
+            _rto = None if _estimator is None else _estimator.rto
+        if _rto is None:
+            return default
+        return min(default, max(self.minimum, _rto))
+
+    def observe(self, host, rtt):
+        """ Record a round trip to host of rtt seconds."""
+        with self._lock:
+            self._estimator(host).update(rtt)
+
+    def backoff(self, host):
+        """ Record that a probe of host got no answer within its timeout."""
+        with self._lock:
+            _estimator = self._estimators.get(host.lower())
+            if _estimator is not None:
+                _estimator.backoff()
+
+    def srtt(self, host):
+        """ Smoothed RTT of host in seconds, or None without history."""
+        with self._lock:
+            _estimator = self._estimators.get(host.lower())
+            return None if _estimator is None else _estimator.srtt
+
+    def clear(self):
+        with self._lock:
+            self._estimators.clear()
+
+
+# Process-wide estimators shared by Toolkit, PortScanner and HttpProbe.
+host_timeouts = HostTimeouts()
@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module spreads a sweep over several processes, on this machine or on
+others. A Coordinator reads the inventory and hands its records out in small
+chunks to ShardWorker processes connected over TCP; each worker builds the
+elements (module inventory) and sweeps them with its own Fleet, so result
+formatting, DNS parsing and TLS handshakes use every core instead of one.
+
+Records are sharded by host name, so a host's elements (and its DNS answers
+and pooled connections) stay on one worker. A worker that runs out of its own
+shard steals chunks from the tail of the longest other shard, so a slow shard
+does not stall the run, and the unfinished chunks of a worker that goes away
+are handed to the others. Results are merged back in inventory order.
+
+Requests and answers are one JSON object per line, as with module agent:
+
+    worker: {"op": "hello", "token": "...", "name": "host:1234"}
+    coordinator: {"defaults": {"concurrent": true}}
+    worker: {"op": "next"}
+    coordinator: {"chunk": [[0, {"name": "google.com", ...}], ...]}
+                 or {"wait": 0.2} or {"done": true}
+    worker: {"op": "result", "index": 0, "name": "google.com", "report": "..."}
+
+A worker must present the coordinator's token, since it is told what to probe
+and reports back what it found.
+
+    python3 shard.py coordinator inventory.jsonl --local 4
+    python3 shard.py coordinator inventory.jsonl --listen 0.0.0.0:7070
+    SLEUTH_SHARD_TOKEN=... python3 shard.py worker --connect sweeper:7070
+
+>>> from inventory import records
+>>> from shard import Coordinator
+>>> coordinator = Coordinator()
+>>> for name, report in coordinator.sweep(
+...         (record for _, record in records('inventory.jsonl')), local=4):
+...     print(report)
+"""
+
+import argparse
+import hmac
+import itertools
+import json
+import os
+import queue
+import secrets
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from collections import Counter, deque
+from results import RemoteError
+
+# Records handed to a worker per request.
+CHUNK = 16
+
+# Seconds a worker waits before asking again when every remaining record is
+# being swept by other workers.
+RETRY = 0.2
+
+
+def _send(stream, message):
+    stream.write((json.dumps(message) + '\n').encode())
+    stream.flush()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        _coordinator = self.server.coordinator
+        _worker = None
+        try:
+            for _line in self.rfile:
+                _message = json.loads(_line)
+                _op = _message.get('op')
+                if _worker is None:
+                    if _op != 'hello' or not hmac.compare_digest(
+                            str(_message.get('token', '')), _coordinator.token):
+                        _send(self.wfile, {'error': 'bad token'})
+                        return
+                    _worker = _coordinator._join(_message.get('name') or str(
+                        self.client_address))
+                    _send(self.wfile, {'defaults': _coordinator.defaults})
+                elif _op == 'next':
+                    _send(self.wfile, _coordinator._next(_worker))
+                elif _op == 'result':
+                    _coordinator._result(_worker, _message)
+        except (OSError, ValueError):
+            pass
+        finally:
+            if _worker is not None:
+                _coordinator._leave(_worker)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Coordinator:
+
+    def __init__(self, host='127.0.0.1', port=0, token=None, chunk=CHUNK,
+                 readahead=4096, defaults=None):
+        """
+        Hands inventory records out to ShardWorker processes and merges
+        their reports.
+
+        :param host: string, address to listen on; '0.0.0.0' lets workers on
+        other machines connect.
+        :param port: integer, TCP port; 0 picks a free one (see address).
+        :param token: string or None, secret workers must present; defaults
+        to $SLEUTH_SHARD_TOKEN, else a random one given to local workers.
+        :param chunk: integer, records handed out per request.
+        :param readahead: integer, records read from the inventory ahead of
+        the workers, which bounds memory however large the inventory is.
+        :param defaults: dict or None, NetElement keyword arguments every
+        worker applies, e.g. {'concurrent': True}; must be JSON-ready.
+        """
+        try:
+            assert type(chunk) is int and chunk > 0,\
+                'Validation error; expected a positive int for chunk, received {}.'\
+                .format(chunk)
+
+            assert type(readahead) is int and readahead >= chunk,\
+                'Validation error; expected an int of at least chunk for '\
+                'readahead, received {}.'.format(readahead)
+        except AssertionError as e:
+            print(e)
+            exit()
+        self.host = host
+        self.port = port
+        self.token = token or os.environ.get('SLEUTH_SHARD_TOKEN') or \
+            secrets.token_hex(16)
+        self.chunk = chunk
+        self.readahead = readahead
+        self.defaults = dict(defaults or {'concurrent': True})
+        self.completed = Counter()  # worker name -> elements swept
+        self.steals = 0
+        self.requeued = 0
+        self._joined = itertools.count()
+        self._lock = threading.Lock()
+        self._server = None
+        self._sweeping = False
+        self._shards = {}  # worker -> deque of (index, record)
+        self._assigned = {}  # worker -> {index: record} handed out
+        self._reset(iter(()))
+
+    def _reset(self, source):
+        # Workers that connected before the sweep keep their place.
+        self._source = source
+        self._exhausted = False
+        self._read = 0  # records taken from the source
+        self._reported = set()  # indexes with a result
+        self._shards = {worker: deque() for worker in self._shards}
+        self._assigned = {worker: {} for worker in self._assigned}
+        self._orphans = deque()  # records of workers that went away
+        self._results = queue.Queue()
+
+    @property
+    def address(self):
+        """ (host, port) the coordinator listens on; see listen()."""
+        if self._server is None:
+            return self.host, self.port
+        return self._server.server_address[:2]
+
+    def listen(self):
+        """
+        Start accepting workers before sweep() is called, e.g. to learn the
+        port picked for port 0.
+
+        :return: (host, port) tuple.
+        """
+        if self._server is None:
+            self._server = _Server((self.host, self.port), _Handler)
+            self._server.coordinator = self
+            threading.Thread(target=self._server.serve_forever,
+                             daemon=True).start()
+        return self.address
+
+    def _join(self, name):
+        with self._lock:
+            _worker = '{}#{}'.format(name, next(self._joined))
+            self._shards[_worker] = deque()
+            self._assigned[_worker] = {}
+            self.completed[_worker] += 0
+        return _worker
+
+    def _leave(self, worker):
+        # Whatever the worker held and had not reported goes to the others.
+        with self._lock:
+            _held = list(self._shards.pop(worker, ())) + [
+                item for item in self._assigned.pop(worker, {}).items()
+                if item[0] not in self._reported]
+            self.requeued += len(_held)
+            self._orphans.extend(_held)
+        self._results.put(None)  # wake sweep() to notice
+
+    def _shard(self, record):
+        # Stable across processes and runs, unlike hash().
+        _name = record.get('name') if isinstance(record, dict) else None
+        _workers = sorted(self._shards)
+        return _workers[zlib.crc32(str(_name).lower().encode()) %
+                        len(_workers)]
+
+    def _queued(self):
+        return len(self._orphans) + sum(len(shard) for shard in
+                                        self._shards.values())
+
+    def _take(self, worker):
+        _own = self._shards[worker]
+        _chunk = []
+        while self._orphans and len(_chunk) < self.chunk:
+            _chunk.append(self._orphans.popleft())
+        while not _own and not self._exhausted and \
+                self._queued() < self.readahead:
+            try:
+                _item = (self._read, next(self._source))
+            except StopIteration:
+                self._exhausted = True
+                break
+            self._read += 1
+            self._shards[self._shard(_item[1])].append(_item)
+        while _own and len(_chunk) < self.chunk:
+            _chunk.append(_own.popleft())
+        if not _chunk:
+            # Steal from the far end of the longest shard; its owner keeps
+            # working through the near end.
+            _victim = max(self._shards.values(), key=len)
+            _count = min(self.chunk, (len(_victim) + 1) // 2)
+            _chunk = [_victim.pop() for _ in range(_count)][::-1]
+            if _chunk:
+                self.steals += 1
+        return _chunk
+
+    def _next(self, worker):
+        with self._lock:
+            if not self._sweeping:
+                # Before the sweep, or after it finished.
+                return {'done': True} if self._exhausted else {'wait': RETRY}
+            if worker not in self._shards:
+                return {'done': True}
+            _chunk = self._take(worker)
+            self._assigned[worker].update(_chunk)
+            if _chunk:
+                return {'chunk': _chunk}
+            if self._exhausted and len(self._reported) == self._read:
+                return {'done': True}
+            return {'wait': RETRY}
+
+    def _result(self, worker, message):
+        _index = message['index']
+        if 'error' in message:
+            _report = RemoteError(message['error'], message.get('message', ''))
+        else:
+            _report = message['report']
+        with self._lock:
+            if _index in self._reported or self._assigned.get(
+                    worker, {}).pop(_index, None) is None:
+                return  # not handed to this worker, or already reported
+            self._reported.add(_index)
+            self.completed[worker] += 1
+            self._results.put((_index, message.get('name'), _report))
+
+    def _spawn(self, local):
+        _env = dict(os.environ, SLEUTH_SHARD_TOKEN=self.token)
+        _host, _port = self.address
+        if _host in ('0.0.0.0', '::', ''):
+            _host = '127.0.0.1'
+        return [subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), 'worker', '--connect',
+             '{}:{}'.format(_host, _port)], env=_env,
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+            for _ in range(local)]
+
+    def sweep(self, records, local=0, on_result=None, keep=True):
+        """
+        Sweep the elements records describe on the connected workers.
+
+        :param records: iterable of inventory record dicts (module inventory),
+        read lazily as workers ask for work.
+        :param local: integer, worker processes to start on this machine;
+        with 0 the sweep waits for remote workers to connect.
+        :param on_result: callable(index, name, report) or None, called in
+        this thread as soon as each element is reported.
+        :param keep: bool, False hands reports to on_result only.
+        :return: list of (name, report) tuples in inventory order; a report
+        is the element's str() output, or a results.RemoteError for an
+        element the worker could not build or probe.
+        """
+        with self._lock:
+            self._reset(iter(records))
+            self.completed = Counter({worker: 0 for worker in self._shards})
+            self.steals = self.requeued = 0
+            self._sweeping = True
+        self.listen()
+        _processes = self._spawn(local)
+        _results = {}
+        try:
+            while True:
+                with self._lock:
+                    if self._exhausted and len(self._reported) == self._read \
+                            and self._results.empty():
+                        break
+                    _stranded = not self._shards and _processes and all(
+                        process.poll() is not None for process in _processes)
+                if _stranded:
+                    raise RuntimeError('every local shard worker exited')
+                try:
+                    _item = self._results.get(timeout=1)
+                except queue.Empty:
+                    continue
+                if _item is None:
+                    continue
+                _index, _name, _report = _item
+                if keep:
+                    _results[_index] = (_name, _report)
+                if on_result is not None:
+                    on_result(_index, _name, _report)
+        finally:
+            with self._lock:
+                self._sweeping = False
+            self._server.shutdown()
+            self._server.server_close()
+            for _process in _processes:
+                try:
+                    _process.wait(5)
+                except subprocess.TimeoutExpired:
+                    _process.kill()
+            self._server = None
+        return [_results[index] for index in sorted(_results)]
+
+
+class ShardWorker:
+
+    def __init__(self, host, port, token=None, workers=64, per_host=1,
+                 name=None):
+        """
+        Sweeps the chunks a Coordinator hands out.
+
+        :param host: string, the coordinator's address.
+        :param port: integer, the coordinator's TCP port.
+        :param token: string or None, the coordinator's secret; defaults to
+        $SLEUTH_SHARD_TOKEN.
+        :param workers: integer, elements this worker probes at once.
+        :param per_host: integer, elements of one host probed at once.
+        :param name: string or None, how the coordinator calls this worker;
+        defaults to hostname:pid.
+        """
+        self.host = host
+        self.port = port
+        self.token = token or os.environ.get('SLEUTH_SHARD_TOKEN', '')
+        self.workers = workers
+        self.per_host = per_host
+        self.name = name or '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.swept = 0
+        self._indexes = {}  # NetElement -> its index in the inventory
+
+    def _request(self, message):
+        _send(self._writer, message)
+        _answer = self._reader.readline()
+        if not _answer:
+            raise ConnectionError('the coordinator closed the connection')
+        return json.loads(_answer)
+
+    def _report(self, index, name, report):
+        _message = {'op': 'result', 'index': index, 'name': name}
+        if isinstance(report, Exception):
+            _message.update(error=getattr(report, 'name', type(
+                report).__name__), message=str(report))
+        else:
+            _message['report'] = report
+        _send(self._writer, _message)
+        self.swept += 1
+
+    def _elements(self, defaults, state):
+        # Elements of chunk after chunk, until the coordinator has nothing
+        # for this worker right now; the Fleet then drains what it has.
+        from inventory import build
+        while True:
+            _answer = self._request({'op': 'next'})
+            if 'chunk' not in _answer:
+                state.update(_answer)
+                return
+            for _index, _record in _answer['chunk']:
+                try:
+                    _element = build(_record, **defaults)
+                except ValueError as e:
+                    self._report(_index, _record.get('name') if isinstance(
+                        _record, dict) else None, e)
+                    continue
+                self._indexes[_element] = _index
+                yield _element
+
+    def run(self):
+        """ Sweep until the coordinator says the run is done."""
+        from fleet import Fleet
+
+        _sock = socket.create_connection((self.host, self.port))
+        self._reader = _sock.makefile('rb')
+        self._writer = _sock.makefile('wb')
+        try:
+            _answer = self._request({'op': 'hello', 'token': self.token,
+                                     'name': self.name})
+            if 'error' in _answer:
+                raise PermissionError(_answer['error'])
+            _defaults = _answer['defaults']
+            _fleet = Fleet(workers=self.workers, per_host=self.per_host,
+                           progress=None, metrics=None)
+            while True:
+                _state = {}
+                _fleet.sweep(self._elements(_defaults, _state), keep=False,
+                             on_result=lambda index, element, report:
+                             self._report(self._indexes.pop(element),
+                                          element.name, report))
+                if _state.get('done'):
+                    return
+                time.sleep(_state.get('wait', RETRY))
+        finally:
+            self._reader.close()
+            self._writer.close()
+            _sock.close()
+
+
+def _address(text):
+    _host, _, _port = text.rpartition(':')
+    return _host.strip('[]') or '127.0.0.1', int(_port)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Sweep an inventory on several processes or machines.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    coordinator = commands.add_parser('coordinator',
+                                      help='hand an inventory out to workers')
+    coordinator.add_argument('inventory', help='JSONL, CSV or YAML inventory')
+    coordinator.add_argument('--listen', default='127.0.0.1:0',
+                             help='host:port workers connect to')
+    coordinator.add_argument('--local', type=int, default=os.cpu_count(),
+                             help='worker processes started on this machine')
+    coordinator.add_argument('--chunk', type=int, default=CHUNK,
+                             help='records handed out per request')
+    worker = commands.add_parser('worker', help='sweep what a coordinator '
+                                                'hands out')
+    worker.add_argument('--connect', required=True,
+                        help='host:port of the coordinator')
+    worker.add_argument('--workers', type=int, default=64,
+                        help='elements probed at once')
+    worker.add_argument('--per-host', type=int, default=1,
+                        help='elements of one host probed at once')
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        try:
+            ShardWorker(*_address(args.connect), workers=args.workers,
+                        per_host=args.per_host).run()
+        except (OSError, ValueError) as e:
+            print(e, file=sys.stderr)
+        return
+
+    from inventory import records
+
+    def _records():
+        for _line, _record in records(args.inventory):
+            if isinstance(_record, Exception):
+                print('{}:{}: {}'.format(args.inventory, _line, _record),
+                      file=sys.stderr)
+                continue
+            yield _record
+
+    def _print(index, name, report):
+        print(report)
+
+    _coordinator = Coordinator(*_address(args.listen), chunk=args.chunk)
+    _host, _port = _coordinator.listen()
+    if args.local == 0 or _host not in ('127.0.0.1', 'localhost', '::1'):
+        # Remote workers need the port, which may be picked at random, and
+        # the token.
+        print('Listening on {}:{}; SLEUTH_SHARD_TOKEN={}'.format(
+            _host, _port, _coordinator.token), file=sys.stderr)
+    _coordinator.sweep(_records(), local=args.local, on_result=_print,
+                       keep=False)
+    print('Swept {} elements on {} workers ({} steals, {} requeued)'.format(
+        sum(_coordinator.completed.values()), len(_coordinator.completed),
+        _coordinator.steals, _coordinator.requeued), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module keeps authenticated SSH connections open per (user, node,
+password) with OpenSSH connection multiplexing (ControlMaster). The first command to a node
+pays the TCP handshake, key exchange and password authentication; every later
+command opens a new channel over the same connection. fan_out runs a list of
+commands on many nodes in parallel and collects the output per node.
+
+A master is only reused for the credentials that authenticated it, so a
+wrong password still fails; control sockets live in a directory only this
+user can enter, named by a keyed hash of the credentials.
+
+>>> from sshpool import SshPool
+>>> pool = SshPool()
+>>> pool.run('rafael', 'secret', '10.0.1.24', 'uname')
+'Linux'
+>>> pool.fan_out('rafael', 'secret', ['10.0.1.24', '10.0.1.25'], ['uname', 'uptime'])
+{'10.0.1.24': ['Linux', '...'], '10.0.1.25': ['Linux', '...']}
+
+Linux package dependencies
+Package dependencies: sudo apt-get install sshpass openssh-client
+"""
+
+import atexit
+import hashlib
+import hmac
+import os
+import secrets
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SshPool:
+
+    def __init__(self, persist=300, connect_timeout=9, workers=64):
+        """
+        :param persist: integer, seconds an idle master connection stays open.
+        :param connect_timeout: integer, seconds allowed for the TCP connect.
+        :param workers: integer, nodes handled at once by fan_out.
+        """
+        self.persist = persist
+        self.connect_timeout = connect_timeout
+        self.workers = workers
+        self._control_dir = None
+        self._registered = False
+        self._masters = {}  # (username, node, digest) -> control path
+        self._locks = {}  # (username, node, digest) -> lock of master setup
+        self._lock = threading.Lock()
+        self._secret = secrets.token_bytes(32)
+
+    def _options(self, control_path):
+        return ['-o', 'StrictHostKeyChecking=no',
+                '-o', 'ConnectTimeout={}'.format(self.connect_timeout),
+                '-o', 'ControlPath={}'.format(control_path)]
+
+    def _key(self, username, password, node):
+        # The password is part of the key, so that a master never stands in
+        # for credentials it was not authenticated with; keyed, so that the
+        # socket name tells nothing about the password.
+        _digest = hmac.new(self._secret, '\0'.join(
+            (username, node, password)).encode(), hashlib.sha256)
+        return username, node, _digest.hexdigest()[:32]
+
+    def _control_path(self, key):
+        with self._lock:
+            if self._control_dir is None:
+                # mkdtemp makes the directory mode 0700.
+                self._control_dir = tempfile.mkdtemp(prefix='sleuth-ssh-')
+                if not self._registered:
+                    atexit.register(self.close)
+                    self._registered = True
+        return os.path.join(self._control_dir, key[2])
+
+    def _alive(self, username, node, control_path):
+        # Whether a master answers on control_path.
+        return subprocess.run(
+            ['ssh'] + self._options(control_path) +
+            ['-O', 'check', '{}@{}'.format(username, node)],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL).returncode == 0
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _master(self, username, password, node, stale=False):
+        """
+        Return the control path of the master connection to node for these
+        credentials, starting one if there is none, or if stale and the
+        known one no longer answers ssh -O check.
+        """
+        _key = self._key(username, password, node)
+        with self._key_lock(_key):
+            _control_path = self._masters.get(_key)
+            if _control_path is not None and (
+                    not stale or self._alive(username, node, _control_path)):
+                return _control_path  # another thread may have restarted it
+            _control_path = self._control_path(_key)
+            # A socket left behind by a dead master would make the new ssh
+            # give up multiplexing and linger without ControlPersist.
+            try:
+                os.unlink(_control_path)
+            except FileNotFoundError:
+                pass
+            # -f backgrounds ssh once authentication succeeded; -N runs no
+            # command. The password reaches sshpass through the environment
+            # rather than the process list.
+            subprocess.run(
+                ['sshpass', '-e', 'ssh'] + self._options(_control_path) +
+                ['-o', 'ControlMaster=yes',
+                 '-o', 'ControlPersist={}'.format(self.persist),
+                 '-f', '-N', '{}@{}'.format(username, node)],
+                env=dict(os.environ, SSHPASS=password),
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE, check=True)
+            self._masters[_key] = _control_path
+            return _control_path
+
+    def _command(self, username, node, control_path, command):
+        # BatchMode keeps ssh from prompting for a password when the master
+        # is gone; it fails with status 255 instead.
+        return subprocess.run(
+            ['ssh'] + self._options(control_path) +
+            ['-o', 'ControlMaster=no', '-o', 'BatchMode=yes',
+             '{}@{}'.format(username, node), command],
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, check=True).stdout
+
+    def run(self, username, password, node, command):
+        """
+        Execute a command on node over the pooled connection.
+
+        :param username: string, username
+        :param password: string, password
+        :param node: string, hostname or IP address
+        :param command: string, command to execute
+        :return: string, command output with surrounding whitespace removed.
+        Raises subprocess.CalledProcessError when ssh or the command fails.
+        """
+        _control_path = self._master(username, password, node)
+        try:
+            _output = self._command(username, node, _control_path, command)
+        except subprocess.CalledProcessError as e:
+            # 255 is ssh failing, or the command's own status; only a master
+            # that expired (ControlPersist) or dropped is set up again and
+            # the command tried once more.
+            if e.returncode != 255 or self._alive(username, node,
+                                                  _control_path):
+                raise
+            _control_path = self._master(username, password, node, stale=True)
+            _output = self._command(username, node, _control_path, command)
+        return _output.decode('utf-8').strip()
+
+    def run_many(self, username, password, node, commands):
+        """
+        Execute every command in commands on node, in order, over one
+        connection.
+
+        :return: list aligned with commands; each item is the command output
+        or the exception raised for that command.
+        """
+        _results = []
+        for _command in commands:
+            try:
+                _results.append(self.run(username, password, node, _command))
+            except (OSError, subprocess.CalledProcessError) as e:
+                _results.append(e)
+        return _results
+
+    def fan_out(self, username, password, nodes, commands, workers=None):
+        """
+        Run the same command list on every node in parallel.
+
+        :param nodes: iterable of strings, hostnames or IP addresses.
+        :param commands: list or tuple of strings, commands run on each node.
+        :param workers: integer or None, nodes handled at once; defaults to
+        self.workers.
+        :return: dict, node -> list of outputs or exceptions (see run_many).
+        """
+        _nodes = list(nodes)
+        with ThreadPoolExecutor(max_workers=workers or self.workers) as pool:
+            _jobs = [pool.submit(self.run_many, username, password, node,
+                                 commands) for node in _nodes]
+            return {node: job.result() for node, job in zip(_nodes, _jobs)}
+
+    def close(self):
+        """ Stop every master connection and remove the control sockets."""
+        with self._lock:
+            _masters, self._masters = self._masters, {}
+            _control_dir, self._control_dir = self._control_dir, None
+        for (_username, _node, _), _control_path in _masters.items():
+            subprocess.run(
+                ['ssh'] + self._options(_control_path) +
+                ['-O', 'exit', '{}@{}'.format(_username, _node)],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if _control_dir is not None:
+            shutil.rmtree(_control_dir, ignore_errors=True)
+
+
+ssh_pool = SshPool()
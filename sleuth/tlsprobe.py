@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module inspects TLS endpoints in-process: protocol version, cipher, the
+leaf certificate's subject, issuer, subjectAltName entries and expiry,
+whether the chain validates and the name matches, and the connect and
+handshake latency. A certificate that does not validate is still read and
+reported, with the reason.
+
+Sessions are cached per endpoint, so repeat checks resume them (TLS 1.3
+tickets, TLS 1.2 tickets or session IDs) and skip the full handshake and
+the certificate exchange. A resumed session reports the certificate of the
+full handshake that created it, so sessions are resumed for max_age
+seconds at most (and never past the server's ticket lifetime): an hourly
+expiry sweep then pays one full handshake per endpoint per max_age.
+
+>>> from tlsprobe import TlsProbe
+>>> probe = TlsProbe()
+>>> result = probe.inspect('google.com')
+>>> print(result)
+TLSv1.3 TLS_AES_256_GCM_SHA384, certificate expires in 61 days
+>>> print(result.handshake, result.resumed)
+24.108 False
+>>> result = probe.inspect('google.com')
+>>> print(result.handshake, result.resumed)
+11.730 True
+"""
+
+import ipaddress
+import select
+import ssl
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+import eyeballs
+from results import TlsResult
+from rtt import host_timeouts
+
+# Seconds a session is resumed before a full handshake reads the
+# certificate again.
+MAX_AGE = 86400
+
+
+class SessionCache:
+
+    def __init__(self, max_age=MAX_AGE, maxsize=65536):
+        """
+        Thread-safe ssl.SSLSession per endpoint key, least recently used
+        endpoints forgotten first. A session only resumes on the
+        ssl.SSLContext that created it, so keys should tell contexts apart.
+
+        :param max_age: number, seconds a session is handed out; capped by
+        the server's ticket lifetime hint. 0 keeps nothing.
+        :param maxsize: integer, sessions kept.
+        """
+        self.max_age = max_age
+        self.maxsize = maxsize
+        self._sessions = OrderedDict()  # key -> (session, expires at, note)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, key):
+        """
+        :return: (ssl.SSLSession, note) stored for key, or (None, None)
+        when there is none or it expired.
+        """
+        with self._lock:
+            _entry = self._sessions.get(key)
+            if _entry is None:
+                return None, None
+            if _entry[1] <= time.monotonic():
+                del self._sessions[key]
+                return None, None
+            self._sessions.move_to_end(key)
+            return _entry[0], _entry[2]
+
+    def put(self, key, session, note=None):
+        """
+        Store session for key, with anything the caller wants back from
+        get(); sessions the server cannot resume are ignored.
+        """
+        if session is None or self.max_age <= 0 or \
+                not (session.has_ticket or session.id):
+            return
+        _age = self.max_age
+        if session.has_ticket and session.ticket_lifetime_hint:
+            _age = min(_age, session.ticket_lifetime_hint)
+        with self._lock:
+            self._sessions[key] = (session, time.monotonic() + _age, note)
+            self._sessions.move_to_end(key)
+            if len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+
+def _dns_match(pattern, name):
+    # A wildcard matches one whole leftmost label, and never a bare
+    # registrable domain (RFC 6125 section 6.4.3).
+    _pattern = pattern.lower().rstrip('.').split('.')
+    _name = name.lower().rstrip('.').split('.')
+    if len(_pattern) != len(_name):
+        return False
+    if _pattern[0] == '*':
+        return len(_pattern) > 2 and _pattern[1:] == _name[1:]
+    return _pattern == _name
+
+
+def hostname_match(name, sans):
+    """
+    Whether the subjectAltName entries of a certificate cover name.
+
+    :param name: string, hostname or IP address.
+    :param sans: iterable of (type, value) tuples as in getpeercert().
+    :return: bool.
+    """
+    try:
+        _ip = ipaddress.ip_address(name)
+    except ValueError:
+        _ip = None
+    for _kind, _value in sans:
+        if _ip is None and _kind == 'DNS' and _dns_match(_value, name):
+            return True
+        if _ip is not None and _kind == 'IP Address':
+            try:
+                if ipaddress.ip_address(_value.strip()) == _ip:
+                    return True
+            except ValueError:
+                continue
+    return False
+
+
+def _common_name(name):
+    # Common name of a getpeercert() subject or issuer, else its
+    # organization.
+    _fields = dict(_field for _rdn in name for _field in _rdn)
+    return _fields.get('commonName') or _fields.get('organizationName', '')
+
+
+def _peer_chain(tls, verified):
+    # The peer's certificates from the leaf up as _ssl.Certificate objects,
+    # from the private method behind SSLSocket.get_verified_chain and
+    # get_unverified_chain (public since Python 3.13, but as DER bytes);
+    # None on Pythons before 3.10, which do not have it.
+    _method = getattr(getattr(tls, '_sslobj', None), 'get_verified_chain'
+                      if verified else 'get_unverified_chain', None)
+    return None if _method is None else _method()
+
+
+def _decode(der):
+    # getpeercert() decodes only certificates that validated; without the
+    # peer's chain the others go through the decoder the ssl module itself
+    # is tested with, a private API too. None when it is missing.
+    _decoder = getattr(ssl._ssl, '_test_decode_cert', None)
+    if _decoder is None:
+        return None
+    with tempfile.NamedTemporaryFile('w', suffix='.pem') as f:
+        f.write(ssl.DER_cert_to_PEM_cert(der))
+        f.flush()
+        return _decoder(f.name)
+
+
+class TlsProbe:
+
+    def __init__(self, timeout=10, max_age=MAX_AGE, timeouts=None,
+                 cafile=None):
+        """
+        :param timeout: number, socket timeout in seconds.
+        :param max_age: number, seconds a session is resumed; 0 makes every
+        check a full handshake.
+        :param timeouts: rtt.HostTimeouts or None; when set, TCP connects
+        wait as long as the address's observed RTT calls for (timeout at
+        most) and every connect updates the address's estimate.
+        :param cafile: string or None, PEM file of trusted CAs instead of
+        the system store.
+        """
+        self.timeout = timeout
+        self.timeouts = timeouts
+        self.sessions = SessionCache(max_age)
+        # Names are matched by hostname_match, so that a mismatch is
+        # reported rather than failing the handshake.
+        self._contexts = {True: ssl.create_default_context(cafile=cafile),
+                          False: ssl.create_default_context()}
+        self._contexts[True].check_hostname = False
+        self._contexts[False].check_hostname = False
+        self._contexts[False].verify_mode = ssl.CERT_NONE
+
+    def inspect(self, host, port=443, server_name=None, address=None):
+        """
+        Handshake with host and report on the TLS session and certificate.
+
+        A certificate that fails validation is read on a second, unverified
+        handshake, whose session later checks resume until it expires.
+        Reading it and the chain takes private ssl APIs (see _peer_chain
+        and _decode); where they are missing, chain is None and a
+        certificate that fails validation fails the check.
+
+        :param host: string, hostname or IP address.
+        :param port: integer, TCP port.
+        :param server_name: string or None, name sent in SNI and matched
+        against the certificate; defaults to host.
+        :param address: string or None, IP address connected to instead of
+        resolving host.
+        :return: results.TlsResult; raises OSError (ssl.SSLError for a
+        failed handshake) or socket.gaierror.
+        """
+        _name = server_name or host
+        _key = (_name.lower(), host.lower(), port, address)
+        _session, _note = self.sessions.get((False,) + _key)
+        if _session is not None:
+            return self._handshake(host, port, _name, address, _key, _session,
+                                   _note)
+        try:
+            return self._handshake(host, port, _name, address, _key,
+                                   *self.sessions.get((True,) + _key))
+        except ssl.SSLCertVerificationError as e:
+            return self._handshake(host, port, _name, address, _key, None,
+                                   (e.verify_message, None))
+
+    def _handshake(self, host, port, name, address, key, session, note=None):
+        # note is (verify error, chain) of the handshake that created
+        # session, or of one about to be made without verifying; the error
+        # is None on the verifying context. A resumed session has no chain
+        # of its own to read.
+        _verify_error, _chain = note or (None, None)
+        _verified = _verify_error is None
+        _targets = eyeballs.resolve(host, port, addresses=(address,)
+                                    if address else None)
+        _sock, _attempts = eyeballs.race(_targets, self.timeout,
+                                         timeouts=self.timeouts)
+        if _sock is None:
+            raise eyeballs.failure(_attempts)
+        _winner = next(_attempt for _attempt in _attempts
+                       if _attempt.state == eyeballs.OPEN)
+        _sock.settimeout(self.timeout)
+        _start = time.monotonic()
+        try:
+            _tls = self._contexts[_verified].wrap_socket(
+                _sock, server_hostname=name, session=session)
+        except Exception:
+            _sock.close()
+            raise
+        _handshake = (time.monotonic() - _start) * 1000
+        try:
+            _resumed = _tls.session_reused
+            if not _resumed:
+                self._await_tickets(_tls, _winner.connect)
+            _certificates = _peer_chain(_tls, _verified)
+            if _certificates:
+                _chain = tuple(_common_name(_certificate.get_info()['subject'])
+                               for _certificate in _certificates)
+            self.sessions.put((_verified,) + key, _tls.session,
+                              (_verify_error, _chain))
+            if _verified:
+                _cert = _tls.getpeercert()
+            elif _certificates:
+                _cert = _certificates[0].get_info()
+            else:
+                _cert = _decode(_tls.getpeercert(True))
+            if _cert is None:
+                raise ssl.SSLError('certificate not decoded: {}'.format(
+                    _verify_error))
+            _version = _tls.version()
+            _cipher = _tls.cipher()[0]
+        finally:
+            _tls.close()
+
+        _sans = tuple(_cert.get('subjectAltName', ()))
+        _expires = ssl.cert_time_to_seconds(_cert['notAfter'])
+        _subject = _common_name(_cert.get('subject', ()))
+        return TlsResult(node=name, port=port, address=_winner.address,
+                         version=_version, cipher=_cipher, subject=_subject,
+                         issuer=_common_name(_cert.get('issuer', ())),
+                         chain=_chain, sans=_sans,
+                         expires=_expires,
+                         days=(_expires - time.time()) / 86400,
+                         hostname_match=hostname_match(name, _sans),
+                         verified=_verified, verify_error=_verify_error,
+                         resumed=_resumed, connect=_winner.connect,
+                         handshake=_handshake)
+
+    def _await_tickets(self, tls, connect):
+        # TLS 1.3 servers send session tickets after the handshake; give
+        # them about a round trip to arrive and let OpenSSL read them.
+        if tls.version() != 'TLSv1.3' or self.sessions.max_age <= 0:
+            return
+        _wait = min(self.timeout, max(0.05, 2 * (connect or 0) / 1000))
+        if not select.select([tls], [], [], _wait)[0]:
+            return
+        tls.setblocking(False)
+        try:
+            while tls.recv(4096):
+                pass  # application data a server sent unasked
+        except OSError:
+            pass  # nothing more to read (ssl.SSLWantReadError) or closed
+
+
+tls_probe = TlsProbe(timeouts=host_timeouts)
+
+
+def main():
+    for _ in range(2):
+        result = tls_probe.inspect('google.com')
+        print(result, '({:.3f}ms, resumed: {})'.format(result.handshake,
+                                                       result.resumed))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,14 +8,20 @@ This modules provides methods for checking: DNS, ICMP, sockets, HTTP status code
 HTTP redirect & status information from header, and the ability to execute a
 command on a remote system using an SSH session.
 
+Checks keep no per-call state on the instance and return the immutable
+records of module results, so one Toolkit can be shared by many threads.
+
 >>> from toolkit import Toolkit
 >>> tool = Toolkit()
 >>> print(tool.check_dns('google.com', ['8.8.8.8'], 'a'))
 74.125.138.139 ,74.125.138.102 ,74.125.138.100 ,74.125.138.113 ,74.125.138.101 ,74.125.138.138
 >>> print(tool.check_socket('google.com', 't80'))
-Open
->>> print(tool.check_ping('yahoo.com', 3, 1500))
+open
+>>> result = tool.check_ping('yahoo.com', 3, 1500)
+>>> print(result)
 0%,66.061
+>>> print(result.loss, result.rtt, result.stddev)
+0.0 66.061 1.203
 >>> print(tool.check_http_code('https://google.com'))
 200
 >>> print(tool.check_header('http://yahoo.com'))
@@ -26,122 +32,79 @@ Darwin
 """
 
 import dns.resolver
+import http.client
 import socket
+import ssl
 import subprocess
-import urllib.request
+import urllib.error
+import eyeballs
+from dnsbatch import BatchResolver
+from dnscache import (answer_cache, answer_records, format_answer,
+                      negative_ttl, resolver_pool)
+from httpprobe import http_probe
+from icmp import IcmpEngine
+from metrics import instrumented, registry
+from portscan import CLOSED, FILTERED, OPEN, OPEN_FILTERED, PortScanner
+from results import (DnsResult, HeaderResult, HttpResult, PingResult,
+                     PmtuResult, SocketResult, SshResult, TlsResult,
+                     TraceResult)
+from rtt import host_timeouts
+from sshpool import ssh_pool
+from tlsprobe import tls_probe
+from traceroute import PathTracer
 
 # TODO sudo pip3 install dnspython3
 # TODO place package in /usr/local/bin
 
+# Unanswered echo requests after which an adaptive ping gives up on a host.
+PING_GIVE_UP = 3
+
 
 class Toolkit:
 
-    def __init__(self):
-        self.dns_data = None
-        self.socket_data = None
-        self.loss_data = None
-        self.rtt_data = None
-        self.http_code = None
-        self.header_data = None
-        self.ssh_data = None
-
-    @property
-    def dns_data(self):
-        return self.__dns_data
-
-    @dns_data.setter
-    def dns_data(self, value):
-        self.__dns_data = value
-
-    @dns_data.deleter
-    def dns_data(self):
-        del self.__dns_data
-
-    @property
-    def socket_data(self):
-        return self.__socket_data
-
-    @socket_data.setter
-    def socket_data(self, value):
-        self.__socket_data = value
-
-    @socket_data.deleter
-    def socket_data(self):
-        del self.__socket_data
-
-    @property
-    def loss_data(self):
-        return self.__loss_data
-
-    @loss_data.setter
-    def loss_data(self, value):
-        self.__loss_data = value
-
-    @loss_data.deleter
-    def loss_data(self):
-        del self.__loss_data
-
-    @property
-    def rtt_data(self):
-        #print('property', self.__rtt_data)
-        return self.__rtt_data
-
-    @rtt_data.setter
-    def rtt_data(self, value):
-        self.__rtt_data = value
-        #print('setter', self.__rtt_data)
-
-    @rtt_data.deleter
-    def rtt_data(self):
-        #print('deleter', self.__rtt_data)
-        del self.__rtt_data
-
-    @property
-    def http_code(self):
-        return self.__http_code
-
-    @http_code.setter
-    def http_code(self, value):
-        self.__http_code = value
-
-    @http_code.deleter
-    def http_code(self):
-        del self.__http_code
-
-    @property
-    def header_data(self):
-        return self.__header_data
-
-    @header_data.setter
-    def header_data(self, value):
-        self.__header_data = value
-
-    @header_data.deleter
-    def header_data(self):
-        del self.__header_data
-
-    @property
-    def ssh_data(self):
-        return self.__ssh_data
-
-    @ssh_data.setter
-    def ssh_data(self, value):
-        self.__ssh_data = value
-
-    @ssh_data.deleter
-    def ssh_data(self):
-        del self.__ssh_data
+    def __init__(self, dns_cache=answer_cache, resolvers=resolver_pool,
+                 http=http_probe, ssh=ssh_pool, metrics=registry,
+                 timeouts=host_timeouts, tls=tls_probe):
+        """
+        :param dns_cache: dnscache.AnswerCache or None, cache consulted by
+        check_dns; defaults to the process-wide cache, None disables caching.
+        :param resolvers: dnscache.ResolverPool, source of dnspython
+        resolvers; defaults to the process-wide pool.
+        :param http: httpprobe.HttpProbe, connection pool used by
+        check_http_code and check_header; defaults to the process-wide probe.
+        :param ssh: sshpool.SshPool, connection pool used by check_ssh;
+        defaults to the process-wide pool.
+        :param metrics: metrics.Metrics or None, registry every check records
+        its duration, errors and timeouts in; defaults to the process-wide
+        registry, None disables instrumentation.
+        :param timeouts: rtt.HostTimeouts or None, per-host RTT history that
+        sets the connect timeouts of check_socket and scan_sockets and the
+        reply timeout of check_ping, which also stops pinging a silent host
+        early; the fixed timeouts are the upper bound. None keeps the fixed
+        timeouts.
+        :param tls: tlsprobe.TlsProbe, session cache used by check_tls;
+        defaults to the process-wide probe.
+        """
+        self.dns_cache = dns_cache
+        self.resolvers = resolvers
+        self.http_probe = http
+        self.ssh_pool = ssh
+        self.metrics = metrics
+        self.timeouts = timeouts
+        self.tls_probe = tls
 
+    format_dns = staticmethod(format_answer)
+
+    @instrumented
     def check_dns(self, node, nservers, qtype):
         """
         Process name resolution (DNS) queries on a given node (hostname or IP)
         using a name server from a given container of name servers (nservers),
         and a query type (qtype).
 
-        Sets instance attribute self.dns_data with DNS resolution data or with
-        exception details if an exception occurs.
-
-        Returns instance attribute self.dns_data.
+        Resolvers are reused per name server tuple, and answers are served
+        from self.dns_cache until their record TTL runs out; NXDOMAIN and
+        NoAnswer results are cached for the zone's negative TTL.
 
         Python module dependencies:
         pip3 install dnspython3 or pip install dnspython
@@ -149,15 +112,17 @@ class Toolkit:
         Example:
             from toolkit import Toolkit
             tool = Toolkit()
-            tool.check_dns('google.com', ('8.8.8.8',), 'a')
+            result = tool.check_dns('google.com', ('8.8.8.8',), 'a')
 
-            print(tool.dns_data)
+            print(result.records, result.ttl)
 
         :param node: string, IP address or hostname in DNS.
         :param nservers: list of strings, DNS servers.
         :param qtype: string, one of the these query types: A/CNAME, MX, PTR.
-        :return: string, DNS resolution data.
+        :return: results.DnsResult, records and remaining TTL in seconds, or
+        the exception in its error field.
         """
+        _records = _ttl = _error = None
         try:
             if type(node) is not str:
                 raise TypeError('a string is required')
@@ -168,69 +133,99 @@ class Toolkit:
                 raise TypeError('a string is required')
             assert qtype.lower() == 'a' or qtype.lower() == 'mx' or\
             qtype.lower() == 'ptr', 'unrecognized record type'
-            _resolver = dns.resolver.Resolver()
-            _resolver.nameservers = nservers
-            if qtype.lower() == 'mx':
-                try:
-                    _answer = _resolver.query(node, qtype)
-                    _data = ('Host {} preferance {}'.format(
-                        rdata.exchange, rdata.preference) for rdata in _answer)
-                except Exception:
-                    return self.dns_data
-            elif qtype.lower() == 'ptr':
-                try:
-                    _answer = _resolver.query(dns.reversename.from_address(node), qtype)
-                    _data = (str(record) for record in _answer)
-                except Exception:
-                    return self.dns_data
+            _key = (node.lower(), qtype.lower(), tuple(nservers))
+            if self.dns_cache is not None:
+                _found, _value, _remaining = self.dns_cache.get(_key)
+                if _found:
+                    return DnsResult.from_value(node, qtype, _value,
+                                                int(_remaining))
+            _resolver = self.resolvers.get(nservers)
+            if qtype.lower() == 'ptr':
+                _answer = _resolver.resolve(dns.reversename.from_address(node), qtype)
             else:
-                # Handles both A and CNAME records
-                try:
-                    _answer = _resolver.query(node, qtype)
-                    _data = (str(address) for address in _answer)
-                except Exception:
-                    return self.dns_data
+                _answer = _resolver.resolve(node, qtype)
+            _records = answer_records(_answer, qtype)
+            _ttl = _answer.rrset.ttl
+            if self.dns_cache is not None:
+                self.dns_cache.put(_key, _records, _ttl)
 
         except dns.exception.SyntaxError as e:
-            self.dns_data = e  # 'Error; check IP address.'
+            _error = e  # 'Error; check IP address.'
         except dns.rdatatype.UnknownRdatatype as e:
-            self.dns_data = e  # 'Error; check query type.'
+            _error = e  # 'Error; check query type.'
         except dns.resolver.NoAnswer as e:
-            self.dns_data = e  # 'Error; check query type.'
+            _error = e  # 'Error; check query type.'
+            _ttl = negative_ttl(e)
+            if self.dns_cache is not None:
+                self.dns_cache.put_negative(_key, e)
         except dns.resolver.NXDOMAIN as e:
-            self.dns_data = e  # 'Error; check hostname.'
+            _error = e  # 'Error; check hostname.'
+            _ttl = negative_ttl(e)
+            if self.dns_cache is not None:
+                self.dns_cache.put_negative(_key, e)
+        except dns.resolver.NoNameservers as e:
+            _error = e  # 'Error; check DNS server.'
         except dns.exception.Timeout as e:
-            self.dns_data = e  # 'Error; check connection & DNS server.'
+            _error = e  # 'Error; check connection & DNS server.'
         except AssertionError as e:
-            self.dns_data = e
+            _error = e
         except TypeError as e:
-            self.dns_data = e
-        else:
-            self.dns_data = ', '.join(_data)
+            _error = e
+        except ValueError as e:
+            _error = e
 
-        return self.dns_data
+        return DnsResult(node=node, qtype=qtype, records=_records, ttl=_ttl,
+                         error=_error)
+
+    @instrumented
+    def check_dns_many(self, queries, nservers, **kwargs):
+        """
+        Resolve many (node, qtype) pairs in one call. All queries are
+        pipelined over one UDP socket and matched to their answers as they
+        arrive, so thousands of lookups cost about as long as the slowest
+        few round trips. Answers share self.dns_cache with check_dns.
+
+        Example:
+            from toolkit import Toolkit
+            tool = Toolkit()
+            tool.check_dns_many([('google.com', 'a'), ('google.com', 'mx'),
+                                 ('8.8.8.8', 'ptr')], ('8.8.8.8',))
+
+        :param queries: iterable of (node, qtype) string tuples; qtype is one
+        of A/CNAME, MX, PTR.
+        :param nservers: list or tuple of strings, DNS servers.
+        :param kwargs: timeout, retries, window and port, passed on to
+        dnsbatch.BatchResolver; port defaults to that of self.resolvers.
+        :return: list of results.DnsResult aligned with queries.
+        """
+        kwargs.setdefault('port', getattr(self.resolvers, 'port', 53))
+        return BatchResolver(nservers, cache=self.dns_cache, **kwargs).resolve(
+            queries)
 
+    @instrumented
     def check_socket(self, node, port):
         """
         Check the status of a given socket using node (hostname or IP) and a
         port number prepended with 't' for TCP or with 'u' for UDP.
 
-        Sets instance attribute self.socket_data as 'Open' if the socket is open,
-        'Unreachable' if socket is close, or with exception details if an
-        exception occurs.
+        The state is 'open' if the socket is open, 'unreachable' if socket is
+        close, 'filtered' if no TCP connect attempt got an answer before its
+        timeout, or 'open|filtered' if a UDP port neither answered nor was
+        reported unreachable.
 
-        Return instance attribute self.socket_data.
+        A TCP node's IPv6 and IPv4 addresses are raced the Happy Eyeballs
+        way (module eyeballs) and the family of the winning connection is
+        kept in the result. Each attempt waits up to 3s, or less once
+        self.timeouts has seen the address's round-trip times.
 
         Example:
             from toolkit import Toolkit
             tool = Toolkit()
-            print(tool.check_socket('yahoo.com', 't80', 'tcp'))
-
-            print(tool.socket_data)
+            print(tool.check_socket('yahoo.com', 't80').state)
 
         :param node: string, IP address or hostname in DNS.
         :param port: string, TCP/UDP port number prepended with 't' or 'u'
-        :return: string, 'Open', 'Unreachable.'
+        :return: results.SocketResult.
         """
         try:
             if type(node) is not str:
@@ -241,190 +236,443 @@ class Toolkit:
                 'port must be prepended with u or t, received {}'.format(port)
             assert 0 < int(port[1:]) < 65536, \
                 'port must be an integer 0-65536, received {}'.format(port[1:])
+            _family = None
             if port[0].lower() == 't':
-                _sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                _targets = eyeballs.resolve(node, int(port[1:]))
+                _sock, _attempts = eyeballs.race(_targets, 3,
+                                                 timeouts=self.timeouts)
+                if _sock is None:
+                    # Dropped everywhere is a timeout; refused or failed
+                    # anywhere is unreachable.
+                    s = FILTERED if all(_attempt.state == FILTERED
+                                        for _attempt in _attempts) else None
+                else:
+                    _sock.close()
+                    s = 0
+                    _family = next(_attempt.family for _attempt in _attempts
+                                   if _attempt.state == OPEN)
             else:
-                _sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            _sock.settimeout(3)  # Set timeout for 3 seconds
-            s = _sock.connect_ex((node, int(port[1:])))
-            _sock.close()
+                # A UDP connect always succeeds; send a datagram instead and
+                # watch for a reply or an ICMP port unreachable (3 x 1s).
+                s = PortScanner(timeout=1, udp_retries=2).scan([(node, port)])[0]
+                if isinstance(s, Exception):
+                    raise s
         except socket.error as e:
-            self.socket_data = e
+            return SocketResult(node=node, port=port, error=e)
         except OverflowError as e:
-            self.socket_data = e
+            return SocketResult(node=node, port=port, error=e)
         except AssertionError as e:
-            self.socket_data = e
+            return SocketResult(node=node, port=port, error=e)
         except TypeError as e:
-            self.socket_data = e
+            return SocketResult(node=node, port=port, error=e)
         except ValueError as e:
-            self.socket_data = e
-        else:
-            if s == 0:
-                self.socket_data = 'open'
-            else:
-                self.socket_data = 'unreachable'
+            return SocketResult(node=node, port=port, error=e)
+
+        if s == 0 or s == OPEN:
+            return SocketResult(node=node, port=port, state='open',
+                                family=_family)
+        if s == OPEN_FILTERED or s == FILTERED:
+            return SocketResult(node=node, port=port, state=s)
+        return SocketResult(node=node, port=port, state='unreachable')
+
+    @instrumented
+    def check_dual_stack(self, node, port, timeout=3,
+                         settle=eyeballs.CONNECTION_ATTEMPT_DELAY,
+                         addresses=None):
+        """
+        Connect to a TCP port over IPv6 and IPv4 at the same time, and
+        report which family won, the connect latency of each family, and a
+        port that answers on one family only.
 
-        return self.socket_data
+        A family still connecting settle seconds after the other connected
+        is reported as 'pending', so a dual-stack check costs about as much
+        as the faster family.
 
-    def check_ping(self, node, count=9, frame_size=1000):
+        Example:
+            from toolkit import Toolkit
+            tool = Toolkit()
+            result = tool.check_dual_stack('google.com', 't443')
+
+            print(result.family, result.only)
+            for attempt in result.attempts:
+                print(attempt)
+
+        :param node: string, hostname or IP address.
+        :param port: string, TCP port number prepended with 't'.
+        :param timeout: number, seconds before a silent family is filtered.
+        :param settle: number, seconds the slower family may take after the
+        faster one connected.
+        :param addresses: iterable of IP address strings or None, connected
+        to instead of resolving node.
+        :return: results.SocketResult with state 'open' (on any family),
+        'closed' or 'filtered', family set to the winning family, and the
+        results.Attempt of every family in attempts, the winner first.
         """
-        Executes a ping shell command in a Linux system with an awk operation
-        to capture loss and average RTT counters.
+        try:
+            if type(node) is not str:
+                raise TypeError('a string is required')
+            if type(port) is not str:
+                raise TypeError('a string is required')
+            assert port[:1].lower() == 't',\
+                'dual-stack checks need a TCP port, received {}'.format(port)
+            assert 0 < int(port[1:]) < 65536, \
+                'port must be an integer 0-65536, received {}'.format(port[1:])
+            _attempts = tuple(eyeballs.compare(
+                node, int(port[1:]), timeout, settle, addresses, self.timeouts))
+        except (socket.error, UnicodeError, AssertionError, TypeError,
+                ValueError) as e:
+            return SocketResult(node=node, port=port, error=e)
+
+        _states = [_attempt.state for _attempt in _attempts]
+        for _state in (OPEN, CLOSED, FILTERED):
+            if _state in _states:
+                return SocketResult(
+                    node=node, port=port, state=_state, attempts=_attempts,
+                    family=_attempts[0].family if _state == OPEN else None)
+        return SocketResult(node=node, port=port, error=_attempts[0].error,
+                            attempts=_attempts)
+
+    @instrumented
+    def scan_sockets(self, targets, timeout=3):
+        """
+        Check many (node, port) pairs at once with non-blocking connects
+        multiplexed over selectors; the whole scan takes about one timeout
+        no matter how many ports are closed or filtered. Nodes with RTT
+        history in self.timeouts get a shorter connect timeout.
 
-        Sets instance attributes self.loss_data and self.rtt_data with the
-        command's output packet-loss and average RTT-delay counters
-        respectively, or with exception details if an exception occurs.
+        Unlike check_socket, closed (refused) and filtered (no answer) ports
+        are reported separately. UDP ('u') ports are probed with a datagram
+        and reported as 'open', 'closed' (ICMP port unreachable) or
+        'open|filtered' (no answer after retransmits).
 
-        Returns a tuple containing instance variables self.loss_data and
-        self.rtt_data.
+        Example:
+            from toolkit import Toolkit
+            tool = Toolkit()
+            print([r.state for r in tool.scan_sockets([('yahoo.com', 't80'),
+                                                       ('yahoo.com', 't81')])])
+
+        :param targets: iterable of (node, port) string tuples, e.g.
+        ('yahoo.com', 't443').
+        :param timeout: number, seconds before a silent port is filtered.
+        :return: list of results.SocketResult aligned with targets, with a
+        state of 'open', 'closed', 'filtered' or 'open|filtered'.
+        """
+        _targets = list(targets)
+        _results = []
+        for (_node, _port), _state in zip(
+                _targets, PortScanner(timeout=timeout,
+                                      timeouts=self.timeouts).scan(_targets)):
+            if isinstance(_state, Exception):
+                _results.append(SocketResult(node=_node, port=_port,
+                                             error=_state))
+            else:
+                _results.append(SocketResult(node=_node, port=_port,
+                                             state=_state))
+        return _results
+
+    @instrumented
+    def check_ping(self, node, count=9, frame_size=1000):
+        """
+        Ping a node with the in-process ICMP engine (module icmp); no shell
+        or ping binary is involved.
 
         Usage:
 
             from toolkit import Toolkit
             tool = Toolkit()
-            print(tool.check_ping('google.com', 3, 56, False)
+            result = tool.check_ping('google.com', 3, 56)
+
+            print(result)  # '0%,22.735'
+            print(result.loss, result.rtt, result.percentile(95))
 
-            print(tool.loss_data)
-            print(tool.rtt_data)
+        Linux dependencies
+        net.ipv4.ping_group_range must include the user's group, or the
+        process needs CAP_NET_RAW for the raw-socket fallback.
 
         :param node: string, IP address or hostname in DNS.
         :param count: integer, number of echo requests.
         :param frame_size: integer, frame size 56-1500.
-        :return: tuple, packet loss and average RTT in ms ('0%', 22.735)
+        :return: results.PingResult, loss ratio and RTT statistics in ms.
         """
-        _interval = '.2'  # 200ms
+        _interval = .2  # 200ms
         try:
             if type(count) is not int or type(frame_size) is not int:
                 raise TypeError('an integer is required')
             assert 1 <= count <= 10000, 'count must be from 1-10000'
             assert 56 <= frame_size <= 1500, 'frame-size must be from 56-1500'
             _size = frame_size - 28  # NEW, 20 IP header, 8 ICMP header, in bytes.
-            _awk = "awk '/loss/ {loss=$6} /rtt/ {split($4, array, \"/\");" \
-                   "print loss \",\" array[2]} /100%/ {print \"100%,Unreachable\"}'"
-            _command = "ping -c {} -i {} -s {} {} | {}".format(
-                count, _interval, _size, node, _awk)
-            _output = subprocess.check_output(_command, shell=True).decode(
-                'utf-8').strip()
-            _returned_values = _output.split(',')
-            assert len(_returned_values) == 2, 'execution error'
-        except subprocess.CalledProcessError as e:
-            self.loss_data = e
+            with IcmpEngine() as _engine:
+                _stats = _engine.ping([node], count, _interval, _size,
+                                      *self._ping_timeouts([node]))[node]
+            self._observe_ping([_stats])
+        except OSError as e:
+            return PingResult(node=node, error=e)
         except AssertionError as e:
-            self.loss_data = e
+            return PingResult(node=node, error=e)
         except TypeError as e:
-            self.loss_data = e
+            return PingResult(node=node, error=e)
         except ValueError as e:
-            self.loss_data = e
-        else:
-            self.loss_data = _returned_values[0]
-            self.rtt_data = _returned_values[1]
-        return '{},{}'.format(self.loss_data, self.rtt_data)
+            return PingResult(node=node, error=e)
+        return PingResult.from_stats(node, _stats)
 
-    def check_http_code(self, url):
+    @instrumented
+    def check_ping_many(self, nodes, count=9, frame_size=1000):
         """
-        Check the HTTP status of a given URL/URI.
+        Ping many nodes at once over a single ICMP socket; a round of echo
+        requests goes to every node every 200ms, so the run takes about as
+        long as pinging one node.
 
-        Sets the value of instance attribute self.http_code with the http code
-        from a given URL/URI or with exception details if an exception occurs.
+        :param nodes: list or tuple of strings, IP addresses or hostnames.
+        :param count: integer, number of echo requests per node.
+        :param frame_size: integer, frame size 56-1500.
+        :return: dict, node -> results.PingResult; bad arguments give every
+        node a PingResult with the error, as check_ping does (a nodes that is
+        not a list or tuple is reported as one node).
+        """
+        try:
+            if type(nodes) is not tuple and type(nodes) is not list:
+                _node = nodes if isinstance(nodes, str) else repr(nodes)
+                nodes = [_node]
+                raise TypeError('a list or tuple is required')
+            if not all(type(node) is str for node in nodes):
+                nodes = [node if isinstance(node, str) else repr(node)
+                         for node in nodes]
+                raise TypeError('a string is required')
+            if type(count) is not int or type(frame_size) is not int:
+                raise TypeError('an integer is required')
+            assert 1 <= count <= 10000, 'count must be from 1-10000'
+            assert 56 <= frame_size <= 1500, 'frame-size must be from 56-1500'
+            with IcmpEngine() as _engine:
+                _stats = _engine.ping(nodes, count, .2, frame_size - 28,
+                                      *self._ping_timeouts(nodes))
+        except (AssertionError, TypeError, ValueError, OSError) as e:
+            return {node: PingResult(node=node, error=e) for node in nodes}
+        self._observe_ping(_stats.values())
+        return {node: PingResult.from_stats(node, stats)
+                for node, stats in _stats.items()}
+
+    def _ping_timeouts(self, nodes):
+        # Reply timeout and give-up count for IcmpEngine.ping.
+        if self.timeouts is None:
+            return 1.0, None
+        return max((self.timeouts.timeout(node, 1.0) for node in nodes),
+                   default=1.0), PING_GIVE_UP
+
+    def _observe_ping(self, stats):
+        if self.timeouts is None:
+            return
+        for _stats in stats:
+            if _stats.error is not None:
+                continue
+            for _rtt in _stats.samples:
+                self.timeouts.observe(_stats.host, _rtt / 1000)
+            if not _stats.samples:
+                self.timeouts.backoff(_stats.host)
+
+    @instrumented
+    def check_http_code(self, url, connect_timeout=None, address=None):
+        """
+        Check the HTTP status of a given URL/URI. Redirects are followed and
+        connections are kept alive in the pool of self.http_probe.
 
-        Returns instance attribute self.http_code.
+        The result keeps the httpprobe.Hop timing breakdown (DNS, connect,
+        TLS handshake and time to first byte) of every hop.
 
         Example:
             from toolkit import Toolkit
             tool = Toolkit()
-            print(tool.check_http_code('https://google.com'))
+            result = tool.check_http_code('https://google.com')
 
-            print(tool.http_code)
+            print(result.status)
+            print(result.hops[-1].ttfb)
 
         :param url: string, URL/URI to check.
-        :return: string, HTTP status code.
+        :param connect_timeout: number or None, seconds a new connection may
+        take to connect; defaults to what self.http_probe uses for the host.
+        :param address: string or None, IP address to connect to instead of
+        resolving the URL's host, which still goes in the Host header and
+        TLS SNI.
+        :return: results.HttpResult, status code and reason of the last hop.
         """
         try:
             if type(url) is not str:
                 raise TypeError('a string is required')
-            _connection = urllib.request.urlopen(url)
-        except urllib.error.URLError as e:
-            self.http_code = e
+            _hops = self.http_probe.fetch(url, connect_timeout=connect_timeout,
+                                          address=address)
+        except (ssl.SSLError, socket.timeout, http.client.HTTPException) as e:
+            return HttpResult(url=url, address=address,
+                              error=urllib.error.URLError(e))
         except ConnectionResetError as e:
-            self.http_code = e
+            return HttpResult(url=url, address=address, error=e)
+        except OSError as e:
+            return HttpResult(url=url, address=address,
+                              error=urllib.error.URLError(e))
         except TypeError as e:
-            self.http_code = e
+            return HttpResult(url=url, address=address, error=e)
         except ValueError as e:
-            self.http_code = e
-        else:
-            self.http_code = str(_connection.getcode())
+            return HttpResult(url=url, address=address, error=e)
 
-        return self.http_code
+        return HttpResult(url=url, status=_hops[-1].status,
+                          reason=_hops[-1].reason, hops=tuple(_hops),
+                          address=address)
 
-    def check_header(self, uri, extra_fqdn=None):
+    @instrumented
+    def check_header(self, uri, extra_fqdn=None, address=None):
         """
-        Execute a CURL command on a UNIX/Linux system to obtain HTTP status
-        code and redirect information from the HTTP header.
+        Obtain HTTP status code and redirect information from the HTTP header
+        of every hop, the way curl -G -I -L -k reports them, using the
+        in-process probe of self.http_probe instead of a curl process.
 
         Optionally, you can use an extra header. This is useful when the web
         engine renders an URL with something other than its name or IP address
         in the host portion of the URL.
 
-        Sets the value of instance attribute self.header with the command
-        output (http code and redirect data if any) or with exception details
-        if an exception occurs.
-
-        Returns instance attribute self.header_data.
-
         Examples:
             from toolkit import Toolkit()
             tool = Toolkit()
 
             print(tool.check_header('http://yahoo.com'))
-            print(tool.check_header('https://www.cnn.com/', 'cnn.com:443:157.166.226.25'))
-
-            print(tool.header_data)
+            print(tool.check_header('http://173.194.219.102', 'www.google.com'))
 
         :param uri: string, URI, hostname, or IP address web services dependant.
-        :param record: string, DNS information in the form of hostname:port:ip_address.
-        :return: string, containing HTTP code and redirect information from header.
+        :param extra_fqdn: string, value for the Host header.
+        :param address: string or None, IP address to connect to instead of
+        resolving the host of uri, like curl --resolve.
+        :return: results.HeaderResult; str() gives the HTTP code and redirect
+        information of every hop.
         """
-        if extra_fqdn:
-            extra_header = '--header "host:{}"'.format(extra_fqdn)
-        else:
-            extra_header = ''
-        command = 'curl -G -I -L -k -s {} {} | egrep "HTTP|Location"'.format(
-            extra_header, uri)
-
         try:
             if type(uri) is not str:
                 raise TypeError('a string is required')
             if extra_fqdn is not None:
                 if type(extra_fqdn) is not str:
                     raise TypeError('a string is required 1')
-            _output1 = subprocess.check_output(command, shell=True).decode('utf-8').strip()
-            _output = ' -> '.join(_output1.split('\r\n'))
+            _hops = self.http_probe.fetch(uri, method='HEAD', verify=False,
+                                          host_header=extra_fqdn,
+                                          address=address)
         except TypeError as e:
-            self.header_data = e
-        except subprocess.CalledProcessError as e:
-            self.header_data = e
-        else:
-            self.header_data = _output
+            return HeaderResult(url=uri, address=address, error=e)
+        except ValueError as e:
+            return HeaderResult(url=uri, address=address, error=e)
+        except (OSError, http.client.HTTPException) as e:
+            return HeaderResult(url=uri, address=address, error=e)
+
+        return HeaderResult(url=uri, hops=tuple(_hops), address=address)
+
+    @instrumented
+    def check_tls(self, node, port=443, server_name=None, address=None):
+        """
+        Handshake with a TLS service and inspect the session and the
+        certificate: protocol version, cipher, subject, issuer, expiry,
+        chain validation, name match and handshake latency. Sessions are
+        resumed from the cache of self.tls_probe, so repeat checks of the
+        same endpoint skip the full handshake.
+
+        Example:
+            from toolkit import Toolkit
+            tool = Toolkit()
+            result = tool.check_tls('google.com')
+
+            print(result.days, result.verified, result.handshake)
+
+        :param node: string, hostname or IP address.
+        :param port: integer, TCP port.
+        :param server_name: string or None, name sent in SNI and matched
+        against the certificate; defaults to node.
+        :param address: string or None, IP address to connect to instead of
+        resolving node.
+        :return: results.TlsResult; str() gives the version, cipher and
+        expiry, and what is wrong with the certificate.
+        """
+        try:
+            if type(node) is not str:
+                raise TypeError('a string is required')
+            if type(port) is not int:
+                raise TypeError('an integer is required')
+            return self.tls_probe.inspect(node, port, server_name, address)
+        except (TypeError, ValueError, OSError) as e:
+            return TlsResult(node=server_name or node, port=port,
+                             address=address, error=e)
+
+    @instrumented
+    def check_trace(self, node, max_hops=30, queries=3):
+        """
+        Trace the route to a node with ICMP echo probes (module traceroute):
+        every TTL is probed at once, so the trace takes about one reply
+        timeout whatever the path length, and all probes share one flow so
+        per-flow load balancing keeps them on one path.
+
+        Example:
+            from toolkit import Toolkit
+            tool = Toolkit()
+            result = tool.check_trace('google.com')
+
+            print(result)  # '192.168.1.1 -> 96.120.6.1 -> 142.250.80.46 (3 hops)'
+            for hop in result.hops:
+                print(hop.ttl, hop.address, hop.rtt, hop.loss)
+
+        Linux dependencies
+        As for check_ping.
+
+        :param node: string, IP address or hostname in DNS.
+        :param max_hops: integer, largest TTL probed, 1-255.
+        :param queries: integer, probes per TTL, 1-10.
+        :return: results.TraceResult.
+        """
+        try:
+            if type(max_hops) is not int or type(queries) is not int:
+                raise TypeError('an integer is required')
+            assert 1 <= max_hops <= 255, 'max-hops must be from 1-255'
+            assert 1 <= queries <= 10, 'queries must be from 1-10'
+            with PathTracer() as _tracer:
+                return _tracer.trace(node, max_hops, queries)
+        except (AssertionError, TypeError, OSError) as e:
+            return TraceResult(node=node, error=e)
+
+    @instrumented
+    def check_pmtu(self, node):
+        """
+        Discover the path MTU to a node: echo requests with Don't Fragment
+        set, binary-searched between the route's MTU and the smallest IPv4
+        MTU, and moved to the MTU a router reports in Fragmentation Needed.
+        Probes wait as long as self.timeouts calls for.
 
-        return self.header_data
+        Example:
+            from toolkit import Toolkit
+            tool = Toolkit()
+            result = tool.check_pmtu('google.com')
+
+            print(result)  # '1500 bytes'
+            print(result.mtu, result.local, result.hop)
+
+        Linux dependencies
+        As for check_ping.
+
+        :param node: string, IP address or hostname in DNS.
+        :return: results.PmtuResult; mtu is the largest IPv4 packet, in
+        bytes, that reached node and got a reply.
+        """
+        try:
+            with PathTracer(self.timeouts) as _tracer:
+                return _tracer.pmtu(node)
+        except OSError as e:  # socket.gaierror, TimeoutError
+            return PmtuResult(node=node, error=e)
 
+    @instrumented
     def check_ssh(self, username, password, node, command):
         """
         Execute a command over a SSH session on a Linux system using a given
         username, password, node (hostname or IP), and a shell command.
 
-        Sets the value of instance attribute self.ssh_data with the command
-        output or with exception details if an exception occurs.
-
-        Returns instance attribute self.ssh_data.
+        Connections are kept open per (username, node) by self.ssh_pool, so
+        only the first command to a node pays for the handshake and
+        authentication.
 
         Example:
         from toolkit import Toolkit
         tool = Toolkit()
         print(tool.check_ssh('my_username', 'my_password', '1.1.1.1', 'pwd'))
 
-        print(tool.ssh_data)
-
         Linux package dependencies
         Package dependencies: sudo apt-get install sshpass
 
@@ -432,24 +680,56 @@ class Toolkit:
         :param password: string, password
         :param node: string, hostname or IP address
         :param command: string, command to execute
-        :return:string, command output
+        :return: results.SshResult, command output
         """
         try:
             if type(username) is not str or type(password) is not str:
                 raise TypeError('string is needed')
             if type(node) is not str or type(command) is not str:
                 raise TypeError('string is needed')
-            _linux_command = 'sshpass -p {} ssh -o StrictHostKeyChecking=no -o ' \
-                             'ConnectTimeout=9 {}@{} {}'. format(
-                password, username, node, command)
-            _output = subprocess.check_output(_linux_command, shell=True).decode('utf-8')
-            self.ssh_data = _output.strip()
+            _output = self.ssh_pool.run(username, password, node, command)
         except TypeError as e:
-            self.ssh_data = e
+            return SshResult(node=node, command=command, error=e)
         except subprocess.CalledProcessError as e:
-            self.ssh_data = e
+            return SshResult(node=node, command=command, error=e)
+        except OSError as e:
+            return SshResult(node=node, command=command, error=e)
+
+        return SshResult(node=node, command=command, output=_output)
+
+    @instrumented
+    def check_ssh_many(self, username, password, nodes, commands, workers=None):
+        """
+        Run a list of commands on many nodes in parallel over pooled SSH
+        connections.
+
+        Example:
+        from toolkit import Toolkit
+        tool = Toolkit()
+        tool.check_ssh_many('my_username', 'my_password',
+                            ['1.1.1.1', '1.1.1.2'], ['uname', 'uptime'])
 
-        return self.ssh_data
+        :param username: string, username
+        :param password: string, password
+        :param nodes: list or tuple of strings, hostnames or IP addresses
+        :param commands: list or tuple of strings, commands to execute
+        :param workers: integer or None, nodes handled at once
+        :return: dict, node -> list of results.SshResult aligned with commands
+        """
+        if type(username) is not str or type(password) is not str:
+            raise TypeError('string is needed')
+        if type(nodes) not in (list, tuple) or type(commands) not in (list, tuple):
+            raise TypeError('a list or tuple is required')
+        _outputs = self.ssh_pool.fan_out(username, password, nodes, commands,
+                                         workers)
+        _results = {}
+        for _node, _values in _outputs.items():
+            _results[_node] = [
+                SshResult(node=_node, command=_command, error=_value)
+                if isinstance(_value, Exception) else
+                SshResult(node=_node, command=_command, output=_value)
+                for _command, _value in zip(commands, _values)]
+        return _results
 
 
 def main():
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module traces the route to a host and discovers the path MTU with ICMP
+echo probes. The probes of every TTL (and every query of a TTL) go out at
+once over one socket and Time Exceeded messages are matched back to their
+probe by the sequence number routers quote, so tracing a 30-hop path takes
+one reply timeout instead of 30.
+
+All probes of a trace are one flow to per-flow load balancers, which hash
+the addresses and the first bytes of the ICMP header (type, code and
+checksum): the sequence number changes from probe to probe and two payload
+bytes make up for it, so the checksum does not (as Paris traceroute does).
+
+Path MTU discovery sends echo requests with Don't Fragment set and
+binary-searches the largest packet that gets a reply; a router's
+Fragmentation Needed message moves the search to the MTU it reports.
+
+Like module icmp, it uses an unprivileged ICMP datagram socket, reading
+ICMP errors from its error queue (IP_RECVERR), when
+net.ipv4.ping_group_range allows it, and a raw ICMP socket otherwise.
+
+>>> from traceroute import PathTracer
+>>> with PathTracer() as tracer:
+...     trace = tracer.trace('google.com')
+...     pmtu = tracer.pmtu('google.com')
+>>> for hop in trace.hops:
+...     print(hop)
+ 1  192.168.1.1  0.512ms 0.488ms 0.471ms
+ 2  *
+ 3  96.120.6.1  9.120ms 9.702ms 8.915ms
+ 4  142.250.80.46  12.311ms 12.204ms 12.180ms
+>>> print(pmtu)
+1500 bytes
+"""
+
+import argparse
+import errno
+import random
+import select
+import socket
+import struct
+import time
+from icmp import checksum
+from results import PmtuResult, TraceHop, TraceResult
+
+_ECHO_REPLY = 0
+_UNREACHABLE = 3
+_ECHO_REQUEST = 8
+_TIME_EXCEEDED = 11
+_FRAGMENTATION_NEEDED = 4  # code of _UNREACHABLE
+
+# Linux socket options the socket module does not name.
+_IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+_IP_PMTUDISC_PROBE = getattr(socket, 'IP_PMTUDISC_PROBE', 3)  # DF, any size
+_IP_MTU = getattr(socket, 'IP_MTU', 14)
+_IP_RECVERR = getattr(socket, 'IP_RECVERR', 11)
+_MSG_ERRQUEUE = getattr(socket, 'MSG_ERRQUEUE', 0x2000)
+_SO_EE_ORIGIN_ICMP = 2
+_EXTENDED_ERROR = struct.Struct('=IBBBBII')  # struct sock_extended_err
+
+_HEADERS = 28  # IPv4 and ICMP headers, in bytes
+MIN_MTU = 68  # every IPv4 link carries this (RFC 791)
+
+# ICMP Destination Unreachable codes.
+UNREACHABLE = {0: 'network unreachable', 1: 'host unreachable',
+               2: 'protocol unreachable', 3: 'port unreachable',
+               4: 'fragmentation needed', 9: 'network prohibited',
+               10: 'host prohibited', 13: 'communication prohibited'}
+
+
+class PathTracer:
+
+    def __init__(self, timeouts=None):
+        """
+        Open the ICMP socket; an unprivileged datagram socket is preferred,
+        a raw socket is the fallback.
+
+        Raises PermissionError when neither socket type may be opened.
+
+        :param timeouts: rtt.HostTimeouts or None; when set, path MTU
+        probes wait as long as the host's observed RTT calls for (the
+        timeout at most) and every reply updates its estimate.
+        """
+        try:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                                       socket.IPPROTO_ICMP)
+            self.raw = False
+            self._sock.setsockopt(socket.IPPROTO_IP, _IP_RECVERR, 1)
+        except PermissionError:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_RAW,
+                                       socket.IPPROTO_ICMP)
+            self.raw = True
+        self._sock.setblocking(False)
+        self._ident = random.randrange(1, 0x10000)  # see IcmpEngine
+        self._seq = random.randrange(0x10000)
+        self.timeouts = timeouts
+
+    def close(self):
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _next_seq(self):
+        self._seq = (self._seq + 1) & 0xffff
+        return self._seq
+
+    def _send(self, address, seq, ttl, size):
+        # The first payload word is the ones' complement of seq, so that
+        # the two always add up to 0xffff and every probe has the same
+        # checksum (see the module docstring).
+        _payload = struct.pack('!H', ~seq & 0xffff) + \
+            b'\x00' * (size - _HEADERS - 2)
+        _header = struct.pack('!BBHHH', _ECHO_REQUEST, 0, 0, self._ident, seq)
+        _header = struct.pack('!BBHHH', _ECHO_REQUEST, 0,
+                              checksum(_header + _payload), self._ident, seq)
+        self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+        # An ICMP error for an earlier probe leaves the datagram socket a
+        # pending error, which the next send reports (and clears) instead
+        # of sending; a local error recurs on the second try.
+        for _try in range(3):
+            try:
+                self._sock.sendto(_header + _payload, (address, 0))
+                return
+            except OSError:
+                if self.raw or _try == 2:
+                    raise
+
+    def _drain(self):
+        """
+        Read every queued echo reply and ICMP error; yields (seq, address
+        of the sender, receive time, ICMP type, code, reported MTU).
+        """
+        while True:
+            try:
+                _packet, (_address, _) = self._sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                continue  # an ICMP error; the error queue has the details
+            _received = time.monotonic()
+            if self.raw:
+                _answer = self._parse_raw(_packet)
+                if _answer is not None:
+                    yield (_answer[0], _address, _received) + _answer[1:]
+            elif len(_packet) >= 8 and _packet[0] == _ECHO_REPLY:
+                yield (struct.unpack('!H', _packet[6:8])[0], _address,
+                       _received, _ECHO_REPLY, 0, None)
+        if not self.raw:
+            yield from self._drain_errors()
+
+    def _parse_raw(self, packet):
+        # (seq, type, code, MTU) of one of our replies or of an ICMP error
+        # quoting one of our requests, else None.
+        _packet = packet[(packet[0] & 0x0f) * 4:]
+        if len(_packet) < 8:
+            return None
+        _type, _code = _packet[0], _packet[1]
+        if _type == _ECHO_REPLY:
+            _ident, _seq = struct.unpack('!HH', _packet[4:8])
+            return (_seq, _type, _code, None) if _ident == self._ident \
+                else None
+        if _type not in (_TIME_EXCEEDED, _UNREACHABLE) or len(_packet) < 36:
+            return None
+        _quoted = _packet[8:]
+        _quoted = _quoted[(_quoted[0] & 0x0f) * 4:]
+        if len(_quoted) < 8 or _quoted[0] != _ECHO_REQUEST:
+            return None
+        _ident, _seq = struct.unpack('!HH', _quoted[4:8])
+        if _ident != self._ident:
+            return None
+        _mtu = struct.unpack('!H', _packet[6:8])[0] \
+            if _type == _UNREACHABLE and _code == _FRAGMENTATION_NEEDED \
+            else None
+        return _seq, _type, _code, _mtu or None
+
+    def _drain_errors(self):
+        # The datagram socket gets the ICMP errors of its own requests on
+        # the error queue: the quoted echo request, and the ICMP type, code,
+        # MTU and sender in a sock_extended_err.
+        while True:
+            try:
+                _data, _ancdata, _, _ = self._sock.recvmsg(
+                    65535, 512, _MSG_ERRQUEUE)
+            except (BlockingIOError, InterruptedError):
+                return
+            _received = time.monotonic()
+            for _level, _kind, _cmsg in _ancdata:
+                if _level != socket.IPPROTO_IP or _kind != _IP_RECVERR or \
+                        len(_cmsg) < _EXTENDED_ERROR.size + 8 or len(_data) < 8:
+                    continue
+                _, _origin, _type, _code, _, _info, _ = \
+                    _EXTENDED_ERROR.unpack_from(_cmsg)
+                if _origin != _SO_EE_ORIGIN_ICMP:
+                    continue  # a local error, e.g. EMSGSIZE
+                _offset = _EXTENDED_ERROR.size  # sockaddr_in of the sender
+                _address = socket.inet_ntoa(_cmsg[_offset + 4:_offset + 8])
+                _mtu = None
+                if _type == _UNREACHABLE and _code == _FRAGMENTATION_NEEDED:
+                    _mtu = _info or None
+                yield (struct.unpack('!H', _data[6:8])[0], _address,
+                       _received, _type, _code, _mtu)
+
+    def _wait(self, until):
+        _left = until - time.monotonic()
+        if _left > 0:
+            select.select([self._sock], [], [], _left)
+
+    def trace(self, host, max_hops=30, queries=3, timeout=2.0, size=60):
+        """
+        Trace the route to host.
+
+        Probes stop being waited for once every TTL up to the destination
+        has answered, or the destination has answered and the other hops
+        had as long again to answer, or after timeout. Routers rate-limit
+        the ICMP errors they send, so loss at one hop that does not carry on
+        to the hops after it is seldom loss on the path.
+
+        :param host: string, hostname or IPv4 address.
+        :param max_hops: integer, highest TTL probed (1-255).
+        :param queries: integer, probes per TTL.
+        :param timeout: number, seconds to wait for answers.
+        :param size: integer, bytes per probe packet, headers included.
+        :return: results.TraceResult; raises socket.gaierror or OSError.
+        """
+        try:
+            assert type(max_hops) is int and 1 <= max_hops <= 255,\
+                'max_hops must be from 1-255'
+            assert type(queries) is int and 1 <= queries <= 10,\
+                'queries must be from 1-10'
+            assert type(size) is int and _HEADERS + 2 <= size <= 65535,\
+                'size must be from {}-65535'.format(_HEADERS + 2)
+        except AssertionError as e:
+            raise ValueError(e)
+        _address = socket.gethostbyname(host)
+        _pending = {}  # seq -> (ttl, send time)
+        _sent = dict.fromkeys(range(1, max_hops + 1), 0)
+        for _ in range(queries):
+            for _ttl in range(1, max_hops + 1):
+                _seq = self._next_seq()
+                try:
+                    self._send(_address, _seq, _ttl, size)
+                except OSError:
+                    continue  # no route, ...: a lost probe
+                _pending[_seq] = (_ttl, time.monotonic())
+                _sent[_ttl] += 1
+        _deadline = time.monotonic() + timeout
+        _answers = {}  # ttl -> list of (address, rtt in ms, error)
+        _end = None  # TTL of the destination or of an unreachable
+        _start = time.monotonic()
+        while _pending and time.monotonic() < _deadline:
+            self._wait(_deadline)
+            for _seq, _from, _received, _type, _code, _ in self._drain():
+                _probe = _pending.pop(_seq, None)
+                if _probe is None:
+                    continue
+                _ttl, _sent_at = _probe
+                _error = UNREACHABLE.get(_code, 'unreachable code {}'.format(
+                    _code)) if _type == _UNREACHABLE else None
+                _answers.setdefault(_ttl, []).append(
+                    (_from, (_received - _sent_at) * 1000, _error))
+                if _type != _TIME_EXCEEDED and (_end is None or _ttl < _end):
+                    if _end is None:
+                        # Give the hops before it as long again as the
+                        # destination took.
+                        _deadline = min(_deadline, _received +
+                                        max(0.1, _received - _start))
+                    _end = _ttl
+            if _end is not None and all(
+                    _ttl > _end for _ttl, _ in _pending.values()):
+                break
+
+        _last = _end or max(_answers, default=0)
+        _hops = []
+        for _ttl in range(1, _last + 1):
+            _got = _answers.get(_ttl, [])
+            _hops.append(TraceHop(
+                ttl=_ttl, address=_got[0][0] if _got else None,
+                sent=_sent[_ttl], samples=tuple(_rtt for _, _rtt, _ in _got),
+                error=next((_error for _, _, _error in _got if _error), None)))
+        _reached = _end is not None and _answers[_end][0][0] == _address
+        return TraceResult(node=host, address=_address, hops=tuple(_hops),
+                           reached=_reached)
+
+    def _route_mtu(self, address):
+        # MTU of the route to address, from a connected UDP socket.
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as _sock:
+            _sock.connect((address, 9))
+            try:
+                return _sock.getsockopt(socket.IPPROTO_IP, _IP_MTU)
+            except OSError:
+                return 1500
+
+    def _probe_size(self, address, size, tries, timeout):
+        """
+        Send tries probes of size bytes with Don't Fragment set at once.
+
+        :return: ('fits', RTT in ms), ('big', reported MTU or None, sender
+        or None) or ('lost', None).
+        """
+        _pending = {}
+        for _ in range(tries):
+            _seq = self._next_seq()
+            try:
+                self._send(address, _seq, 64, size)
+            except OSError as e:
+                if e.errno == errno.EMSGSIZE:  # larger than the interface MTU
+                    return 'big', None, None
+                continue
+            _pending[_seq] = time.monotonic()
+        _deadline = time.monotonic() + timeout
+        while _pending and time.monotonic() < _deadline:
+            self._wait(_deadline)
+            for _seq, _from, _received, _type, _code, _mtu in self._drain():
+                if _seq not in _pending:
+                    continue
+                if _type == _ECHO_REPLY:
+                    return 'fits', (_received - _pending[_seq]) * 1000
+                if _type == _UNREACHABLE and _code == _FRAGMENTATION_NEEDED:
+                    return 'big', _mtu, _from
+                del _pending[_seq]
+        return 'lost', None
+
+    def pmtu(self, host, timeout=1.0, tries=2):
+        """
+        Discover the path MTU to host.
+
+        The first probe is as large as the route out of this host allows.
+        When it does not get a reply, the search goes on to the MTU a router
+        reported in Fragmentation Needed, or binary-searches between
+        MIN_MTU and the size that failed; a probe that gets neither a reply
+        nor a Fragmentation Needed within timeout counts as too big.
+
+        :param host: string, hostname or IPv4 address.
+        :param timeout: number, seconds to wait for each probe round.
+        :param tries: integer, probes per size sent at once, so that one
+        lost packet does not pass for a size that does not fit.
+        :return: results.PmtuResult; raises socket.gaierror, OSError, or
+        TimeoutError when not even MIN_MTU gets a reply.
+        """
+        _address = socket.gethostbyname(host)
+        _local = min(self._route_mtu(_address), 65535)
+        _previous = self._sock.getsockopt(socket.IPPROTO_IP, _IP_MTU_DISCOVER)
+        self._sock.setsockopt(socket.IPPROTO_IP, _IP_MTU_DISCOVER,
+                              _IP_PMTUDISC_PROBE)
+        _fits, _big = None, _local + 1  # largest that fit, smallest that not
+        _hop = None  # (router, MTU it reported)
+        _probes = 0
+        _size = _local
+        try:
+            while True:
+                _timeout = timeout if self.timeouts is None else \
+                    self.timeouts.timeout(_address, timeout)
+                _outcome = self._probe_size(_address, _size, tries, _timeout)
+                _probes += 1
+                if _outcome[0] == 'fits':
+                    _fits = _size
+                    if self.timeouts is not None:
+                        self.timeouts.observe(_address, _outcome[1] / 1000)
+                elif _outcome[0] == 'big' and _outcome[1] and \
+                        (_fits or 0) < _outcome[1] < _size:
+                    # Nothing larger than the MTU a router reported fits.
+                    _big, _hop = _outcome[1] + 1, (_outcome[2], _outcome[1])
+                    _size = _outcome[1]
+                    continue
+                else:
+                    _big = _size
+                if _fits is None:
+                    if _size <= MIN_MTU:
+                        break
+                    _size = MIN_MTU  # is the host answering at all?
+                    continue
+                if _big - _fits <= 1:
+                    break
+                _size = (_fits + _big) // 2
+        finally:
+            self._sock.setsockopt(socket.IPPROTO_IP, _IP_MTU_DISCOVER,
+                                  _previous)
+        if _fits is None:
+            raise TimeoutError('no reply to {} byte probes'.format(MIN_MTU))
+        return PmtuResult(node=host, address=_address, mtu=_fits, local=_local,
+                          hop=_hop[0] if _hop and _hop[1] == _fits else None,
+                          probes=_probes)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Trace the route and path MTU to a host.')
+    parser.add_argument('host')
+    parser.add_argument('--max-hops', type=int, default=30)
+    parser.add_argument('--queries', type=int, default=3,
+                        help='probes per TTL')
+    parser.add_argument('--timeout', type=float, default=2.0)
+    args = parser.parse_args()
+
+    with PathTracer() as tracer:
+        _start = time.monotonic()
+        trace = tracer.trace(args.host, args.max_hops, args.queries,
+                             args.timeout)
+        print('traceroute to {} ({}), {:.3f}s'.format(
+            args.host, trace.address, time.monotonic() - _start))
+        for hop in trace.hops:
+            print(hop)
+        print('path MTU:', tracer.pmtu(args.host))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+
+__author__ = 'rafael'
+__version__ = '0.0.0'
+
+"""
+This module is an embedded time-series store for probe results: packet loss,
+RTT, HTTP status, port state and DNS success per element. Every (element,
+metric) series owns a fixed-size ring buffer in each of three memory-mapped
+files, one per resolution:
+
+    raw.ring     the last raw_slots samples, as (timestamp, value)
+    minute.ring  one-minute rollups (count, min, max, sum), minute_slots long
+    hour.ring    one-hour rollups, hour_slots long
+
+Rollups are updated in place as each sample arrives, and a rollup slot is
+picked by bucket number (bucket % slots), so older data is downsampled and
+aged out without a compaction pass, the files only grow when new series are
+added (each time to double the room, 16 series at least, so they are seldom
+remapped), and a range query reads at most two contiguous stretches of a
+ring.
+query() picks the finest resolution that still covers the requested range.
+
+>>> from tsdb import SeriesStore
+>>> store = SeriesStore('sleuth-data')
+>>> store.add('google.com', 'rtt', 22.735)
+>>> store.query('google.com', 'rtt', time.time() - 60)
+[(1700000000.25, 22.735)]
+>>> store.query('google.com', 'rtt', time.time() - 86400 * 90)
+[(1700000000.0, 1, 22.735, 22.735, 22.735)]
+
+A store belongs to one process at a time; threads may share it.
+"""
+
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from results import (DnsResult, HttpResult, PingResult, SocketResult,
+                     TlsResult)
+
+# File header: magic, version, step, slots, record size, series allocated.
+_HEADER = struct.Struct('<8sIIIIQ')
+_HEADER_SIZE = 64
+_MAGIC = b'SLEUTHTS'
+_VERSION = 1
+
+_RAW = struct.Struct('<dd')  # timestamp, value
+_RAW_COUNT = struct.Struct('<Q')  # samples ever written to the series
+_RAW_BLOCK_HEADER = 16
+_ROLLUP = struct.Struct('<qIddd')  # bucket, count, min, max, sum
+
+RESOLUTIONS = ('raw', '1m', '1h')
+
+
+def result_metrics(result):
+    """
+    The (metric, value) pairs recorded for a result record: 'loss' (ratio)
+    and 'rtt' (ms) for a ping, 'http:<url>' (status code, 0 when the request
+    failed), 'port:<port>' (1 when open, else 0) and 'dns:<qtype>' (1 when
+    the query was answered, else 0), 'tls:<port>' (days until the certificate
+    expires) and 'handshake:<port>' (TLS handshake in ms).
+
+    :param result: a record from module results.
+    :return: list of (string, float) tuples.
+    """
+    if isinstance(result, PingResult):
+        if result.error is not None:
+            return []
+        return [('loss', result.loss),
+                ('rtt', math.nan if result.rtt is None else result.rtt)]
+    if isinstance(result, HttpResult):
+        return [('http:{}'.format(result.url), float(result.status or 0))]
+    if isinstance(result, SocketResult):
+        return [('port:{}'.format(result.port),
+                 1.0 if result.state == 'open' else 0.0)]
+    if isinstance(result, DnsResult):
+        return [('dns:{}'.format(result.qtype.lower()),
+                 0.0 if result.error is not None else 1.0)]
+    if isinstance(result, TlsResult):
+        if result.error is not None:
+            return []
+        return [('tls:{}'.format(result.port), result.days),
+                ('handshake:{}'.format(result.port), result.handshake)]
+    return []
+
+
+class _Ring:
+    """ One memory-mapped file holding a ring buffer block per series."""
+
+    def __init__(self, path, step, slots, record, block_header=0):
+        self.path = path
+        self.step = step
+        self.slots = slots
+        self.record = record
+        self.block_header = block_header
+        self.block = block_header + slots * record.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size < _HEADER_SIZE:
+            self.allocated = 0
+            os.ftruncate(self._fd, _HEADER_SIZE)
+            self._map()
+            self._write_header()
+        else:
+            self._map()
+            _magic, _version, _step, _slots, _size, self.allocated = \
+                _HEADER.unpack_from(self.map, 0)
+            if _magic != _MAGIC or _version != _VERSION:
+                raise ValueError('{} is not a sleuth series file'.format(path))
+            if (_step, _slots, _size) != (step, slots, record.size):
+                raise ValueError('{} was created with {} slots, received {}'
+                                 .format(path, _slots, slots))
+
+    def _map(self):
+        self.map = mmap.mmap(self._fd, os.fstat(self._fd).st_size)
+
+    def _write_header(self):
+        _HEADER.pack_into(self.map, 0, _MAGIC, _VERSION, self.step, self.slots,
+                          self.record.size, self.allocated)
+
+    def reserve(self, count):
+        """ Make room for count series, doubling the file as needed."""
+        if count <= self.allocated:
+            return
+        self.allocated = max(count, self.allocated * 2, 16)
+        self.map.close()
+        os.ftruncate(self._fd, _HEADER_SIZE + self.allocated * self.block)
+        self._map()
+        self._write_header()
+
+    def offset(self, series):
+        return _HEADER_SIZE + series * self.block
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.close()
+        os.close(self._fd)
+
+
+class SeriesStore:
+
+    def __init__(self, path, raw_slots=4096, minute_slots=2880,
+                 hour_slots=8784):
+        """
+        Open (or create) the store in directory path. The slot counts are
+        fixed when the store is created; opening it with other values raises
+        ValueError.
+
+        :param path: string, directory holding the store files.
+        :param raw_slots: integer, raw samples kept per series (about 11
+        hours of 10s pings).
+        :param minute_slots: integer, one-minute rollups kept (2 days).
+        :param hour_slots: integer, one-hour rollups kept (a leap year).
+        With the defaults a series takes about 480KB of disk once its rings
+        have filled up.
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._raw = _Ring(os.path.join(path, 'raw.ring'), 0, raw_slots, _RAW,
+                          _RAW_BLOCK_HEADER)
+        self._rollups = {
+            '1m': _Ring(os.path.join(path, 'minute.ring'), 60, minute_slots,
+                        _ROLLUP),
+            '1h': _Ring(os.path.join(path, 'hour.ring'), 3600, hour_slots,
+                        _ROLLUP)}
+        self._series = {}  # (name, metric) -> series number
+        _index_path = os.path.join(path, 'series.idx')
+        if os.path.exists(_index_path):
+            with open(_index_path, encoding='utf-8') as _index:
+                for _line in _index:
+                    _name, _, _metric = _line.rstrip('\n').partition('\t')
+                    self._series[(_name, _metric)] = len(self._series)
+        self._index = open(_index_path, 'a', encoding='utf-8')
+        for _ring in self._rings():
+            _ring.reserve(len(self._series))
+
+    def _rings(self):
+        return [self._raw] + list(self._rollups.values())
+
+    def __len__(self):
+        return len(self._series)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def series(self):
+        """ :return: list of (name, metric) tuples, in creation order."""
+        with self._lock:
+            return list(self._series)
+
+    def _series_number(self, name, metric):
+        _key = (name, metric)
+        _series = self._series.get(_key)
+        if _series is None:
+            if '\t' in name + metric or '\n' in name + metric:
+                raise ValueError('tabs and newlines are not allowed in series '
+                                 'names, received {!r}'.format(_key))
+            _series = len(self._series)
+            for _ring in self._rings():
+                _ring.reserve(_series + 1)
+            self._index.write('{}\t{}\n'.format(name, metric))
+            self._index.flush()
+            self._series[_key] = _series
+        return _series
+
+    def add(self, name, metric, value, timestamp=None):
+        """
+        Record one sample and fold it into the minute and hour rollups.
+        NaN values (e.g. the RTT of an unreachable host) are kept as raw
+        samples but left out of the rollups.
+
+        :param name: string, element name.
+        :param metric: string, metric name such as 'rtt' or 'port:t80'.
+        :param value: number.
+        :param timestamp: number or None, seconds since the epoch; defaults
+        to now.
+        """
+        _value = float(value)
+        _timestamp = time.time() if timestamp is None else float(timestamp)
+        with self._lock:
+            _series = self._series_number(name, metric)
+            _offset = self._raw.offset(_series)
+            _written = _RAW_COUNT.unpack_from(self._raw.map, _offset)[0]
+            _RAW.pack_into(self._raw.map, _offset + _RAW_BLOCK_HEADER +
+                           _written % self._raw.slots * _RAW.size,
+                           _timestamp, _value)
+            _RAW_COUNT.pack_into(self._raw.map, _offset, _written + 1)
+            if math.isnan(_value):
+                return
+            for _ring in self._rollups.values():
+                self._roll(_ring, _series, _timestamp, _value)
+
+    @staticmethod
+    def _roll(ring, series, timestamp, value):
+        _bucket = int(timestamp // ring.step)
+        _position = ring.offset(series) + _bucket % ring.slots * _ROLLUP.size
+        _slot, _count, _low, _high, _total = _ROLLUP.unpack_from(ring.map,
+                                                                 _position)
+        if _count and _slot == _bucket:
+            _ROLLUP.pack_into(ring.map, _position, _bucket, _count + 1,
+                              min(_low, value), max(_high, value),
+                              _total + value)
+        elif not _count or _slot < _bucket:
+            _ROLLUP.pack_into(ring.map, _position, _bucket, 1, value, value,
+                              value)
+        # Otherwise the slot already holds a newer bucket; the sample is
+        # older than this ring's retention.
+
+    def add_results(self, name, results, timestamp=None):
+        """
+        Record the metrics of every result record (see result_metrics) of
+        one element under the same timestamp.
+
+        :param name: string, element name.
+        :param results: iterable of records from module results.
+        :param timestamp: number or None, seconds since the epoch.
+        """
+        _timestamp = time.time() if timestamp is None else timestamp
+        for _result in results:
+            for _metric, _value in result_metrics(_result):
+                self.add(name, _metric, _value, _timestamp)
+
+    def _raw_samples(self, series):
+        _offset = self._raw.offset(series)
+        _written = _RAW_COUNT.unpack_from(self._raw.map, _offset)[0]
+        _start = _offset + _RAW_BLOCK_HEADER
+        _samples = list(_RAW.iter_unpack(
+            self._raw.map[_start:_start + self._raw.slots * _RAW.size]))
+        if _written <= self._raw.slots:
+            return _samples[:_written]
+        _oldest = _written % self._raw.slots
+        return _samples[_oldest:] + _samples[:_oldest]
+
+    def _pick(self, series, start, end):
+        """ The finest resolution whose retention covers start."""
+        _offset = self._raw.offset(series)
+        _written = _RAW_COUNT.unpack_from(self._raw.map, _offset)[0]
+        if _written <= self._raw.slots:
+            return 'raw'  # nothing has aged out of the raw ring yet
+        _oldest = _RAW.unpack_from(self._raw.map, _offset + _RAW_BLOCK_HEADER +
+                                   _written % self._raw.slots * _RAW.size)[0]
+        if _oldest <= start:
+            return 'raw'
+        _minute = self._rollups['1m']
+        if start >= (int(end // 60) - _minute.slots + 1) * 60:
+            return '1m'
+        return '1h'
+
+    def query(self, name, metric, start, end=None, resolution=None):
+        """
+        Samples of one series between start and end, oldest first.
+
+        :param name: string, element name.
+        :param metric: string, metric name.
+        :param start: number, seconds since the epoch.
+        :param end: number or None, seconds since the epoch; defaults to now.
+        :param resolution: 'raw', '1m', '1h' or None to pick the finest one
+        that covers start.
+        :return: list of (timestamp, value) tuples for raw samples, or of
+        (bucket start, count, min, max, mean) tuples for rollups.
+        """
+        if resolution is not None and resolution not in RESOLUTIONS:
+            raise ValueError('resolution must be one of {}, received {!r}'
+                             .format(RESOLUTIONS, resolution))
+        _end = time.time() if end is None else end
+        with self._lock:
+            _series = self._series.get((name, metric))
+            if _series is None:
+                return []
+            if resolution is None:
+                resolution = self._pick(_series, start, _end)
+            if resolution == 'raw':
+                return [(_timestamp, _value) for _timestamp, _value
+                        in self._raw_samples(_series)
+                        if start <= _timestamp <= _end]
+            return self._query_rollup(self._rollups[resolution], _series,
+                                      start, _end)
+
+    @staticmethod
+    def _query_rollup(ring, series, start, end):
+        _last = int(end // ring.step)
+        _first = max(int(start // ring.step), _last - ring.slots + 1)
+        if _first > _last:
+            return []
+        _base = ring.offset(series)
+        _output = []
+        # Buckets _first.._last occupy at most two contiguous slot ranges.
+        _bucket = _first
+        while _bucket <= _last:
+            _slot = _bucket % ring.slots
+            _count = min(_last - _bucket + 1, ring.slots - _slot)
+            _position = _base + _slot * _ROLLUP.size
+            for _index, (_stored, _n, _low, _high, _total) in enumerate(
+                    _ROLLUP.iter_unpack(ring.map[
+                        _position:_position + _count * _ROLLUP.size])):
+                if _n and _stored == _bucket + _index:
+                    _output.append((float(_stored * ring.step), _n, _low,
+                                    _high, _total / _n))
+            _bucket += _count
+        return _output
+
+    def flush(self):
+        """ Write dirty pages to disk now rather than when the OS decides."""
+        with self._lock:
+            for _ring in self._rings():
+                _ring.flush()
+
+    def close(self):
+        with self._lock:
+            for _ring in self._rings():
+                _ring.flush()
+                _ring.close()
+            self._index.close()
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The modules of sleuth import each other by module name.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'sleuth'))
@@ -0,0 +1,159 @@
+"""
+Sweeps of a small inventory of 127.0.0.x elements on worker processes
+started on this machine (Coordinator.sweep(local=N)).
+"""
+
+import json
+import socket
+import threading
+import time
+import pytest
+from results import RemoteError
+from shard import Coordinator, ShardWorker
+
+# Port 1 is closed on every 127.0.0.x address, so each element is quick.
+RECORDS = [{'name': '127.0.0.{}'.format(_host), 'kind': 'server',
+            'ports': ['t1']} for _host in range(1, 41)]
+RECORDS[7] = {'name': '127.0.0.8', 'kind': 'server', 'bogus': True}
+RECORDS[21] = ['not', 'a', 'record']
+
+
+def _names(records):
+    return [_record.get('name') if isinstance(_record, dict) else None
+            for _record in records]
+
+
+class _Client:
+
+    # A worker driven by hand, over the coordinator's line protocol.
+
+    def __init__(self, coordinator):
+        self._sock = socket.create_connection(coordinator.address, timeout=10)
+        self._reader = self._sock.makefile('rb')
+        self._writer = self._sock.makefile('wb')
+
+    def send(self, message):
+        self._writer.write((json.dumps(message) + '\n').encode())
+        self._writer.flush()
+
+    def ask(self, message):
+        self.send(message)
+        _answer = self._reader.readline()
+        return json.loads(_answer) if _answer else None
+
+    def close(self):
+        self._reader.close()
+        self._writer.close()
+        self._sock.close()
+
+
+def _sweep(coordinator, records, local):
+    # Sweep in a thread; returns the thread, the result holder and the
+    # indexes in the order on_result saw them.
+    _reported = []
+    _out = {}
+    _thread = threading.Thread(target=lambda: _out.update(
+        results=coordinator.sweep(records, local=local,
+                                  on_result=lambda index, name, report:
+                                  _reported.append(index))), daemon=True)
+    _thread.start()
+    return _thread, _out, _reported
+
+
+def test_every_element_once_in_inventory_order():
+    coordinator = Coordinator(chunk=4)
+    thread, out, reported = _sweep(coordinator, RECORDS, local=3)
+    thread.join(120)
+    assert not thread.is_alive()
+
+    assert sorted(reported) == list(range(len(RECORDS)))
+    assert [name for name, _ in out['results']] == _names(RECORDS)
+    assert sum(coordinator.completed.values()) == len(RECORDS)
+    assert len(coordinator.completed) == 3
+    for index, (name, report) in enumerate(out['results']):
+        if index in (7, 21):
+            # Malformed records are reported, not swept.
+            assert isinstance(report, RemoteError)
+        else:
+            assert 'Element: {}'.format(name) in report
+            assert 'Port t1:' in report
+
+
+def test_bad_token_is_rejected_and_a_lost_worker_requeued():
+    coordinator = Coordinator(chunk=4)
+    coordinator.listen()
+
+    intruder = _Client(coordinator)
+    assert intruder.ask({'op': 'hello', 'token': 'wrong'}) == \
+        {'error': 'bad token'}
+    assert intruder.ask({'op': 'next'}) is None  # connection closed
+    intruder.close()
+    with pytest.raises(PermissionError):
+        ShardWorker(*coordinator.address, token='wrong').run()
+
+    lost = _Client(coordinator)
+    assert 'defaults' in lost.ask({'op': 'hello', 'token': coordinator.token,
+                                   'name': 'lost'})
+    thread, out, reported = _sweep(coordinator, RECORDS, local=2)
+    _deadline = time.monotonic() + 30
+    while True:
+        answer = lost.ask({'op': 'next'})
+        if 'chunk' in answer or time.monotonic() > _deadline:
+            break
+        time.sleep(answer.get('wait', .05))
+    held = [index for index, _ in answer['chunk']]
+    assert held
+    lost.close()  # goes away without reporting its chunk
+
+    thread.join(120)
+    assert not thread.is_alive()
+    assert coordinator.requeued >= len(held)
+    assert sorted(reported) == list(range(len(RECORDS)))
+    assert [name for name, _ in out['results']] == _names(RECORDS)
+    assert coordinator.completed['lost#0'] == 0
+
+
+def test_idle_worker_steals_from_the_tail():
+    # One host, so one shard holds every record and the other worker has
+    # to steal.
+    records = [{'name': 'one.test', 'kind': 'server'}] * 12
+    coordinator = Coordinator(chunk=4)
+    coordinator.listen()
+    clients = [_Client(coordinator) for _ in range(2)]
+    for name, client in zip('ab', clients):
+        client.ask({'op': 'hello', 'token': coordinator.token, 'name': name})
+    thread, out, reported = _sweep(coordinator, records, local=0)
+
+    chunks = []
+    for client in clients:
+        answer = client.ask({'op': 'next'})
+        while 'wait' in answer:
+            time.sleep(answer['wait'])
+            answer = client.ask({'op': 'next'})
+        chunks.append([index for index, _ in answer['chunk']])
+    # The thief took the tail; the owner works from the head (of what was
+    # read by then, since records are read lazily).
+    assert coordinator.steals == 1
+    assert [8, 9, 10, 11] in chunks
+    assert min(chunks)[0] == 0
+
+    pending = dict(zip(clients, chunks))
+    while pending:
+        for client in list(pending):
+            for index in pending[client]:
+                client.send({'op': 'result', 'index': index,
+                             'name': 'one.test', 'report': str(index)})
+            answer = client.ask({'op': 'next'})
+            if 'done' in answer:
+                del pending[client]
+                client.close()
+            else:
+                pending[client] = [index for index, _ in
+                                   answer.get('chunk', ())]
+                time.sleep(answer.get('wait', 0))
+
+    thread.join(30)
+    assert not thread.is_alive()
+    assert sorted(reported) == list(range(12))
+    assert [report for _, report in out['results']] == \
+        [str(index) for index in range(12)]
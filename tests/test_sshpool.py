@@ -0,0 +1,122 @@
+"""
+SshPool against stand-in ssh and sshpass programs: the master is a file at
+the control path, commands run in a local shell, and every invocation is
+logged.
+"""
+
+import os
+import stat
+import subprocess
+import sys
+import pytest
+from sshpool import SshPool
+
+PASSWORD = 'right'
+
+SSHPASS = '''#!{python}
+import os, sys
+with open(os.environ['STAND_IN_LOG'], 'a') as log:
+    log.write('auth\\n')
+if os.environ.get('SSHPASS') != os.environ['STAND_IN_PASSWORD']:
+    sys.exit(5)  # sshpass: invalid password
+os.execvp(sys.argv[2], sys.argv[2:])  # sshpass -e ssh ...
+'''
+
+SSH = '''#!{python}
+import os, subprocess, sys
+args = sys.argv[1:]
+options = dict(args[i + 1].split('=', 1) for i, arg in enumerate(args)
+               if arg == '-o')
+path = options['ControlPath']
+
+
+def alive(path):
+    # A master that died leaves its socket behind; the stand-in marks it.
+    if not os.path.exists(path):
+        return False
+    with open(path) as master:
+        return master.read() != 'dead'
+
+
+with open(os.environ['STAND_IN_LOG'], 'a') as log:
+    if '-O' in args:
+        operation = args[args.index('-O') + 1]
+        log.write(operation + '\\n')
+        if operation == 'exit' and os.path.exists(path):
+            os.unlink(path)
+        sys.exit(0 if alive(path) or operation == 'exit' else 255)
+    if options.get('ControlMaster') == 'yes':
+        if os.path.exists(path):
+            sys.exit(255)  # a real ssh would fall back to a lone session
+        log.write('master\\n')
+        open(path, 'w').close()
+        sys.exit(0)
+    if not alive(path):
+        sys.exit(255)  # BatchMode, no master
+    log.write('command\\n')
+sys.exit(subprocess.run(args[-1], shell=True).returncode)
+'''
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    for _name, _source in (('ssh', SSH), ('sshpass', SSHPASS)):
+        _path = tmp_path / _name
+        _path.write_text(_source.format(python=sys.executable))
+        _path.chmod(_path.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv('PATH', '{}{}{}'.format(tmp_path, os.pathsep,
+                                                os.environ['PATH']))
+    monkeypatch.setenv('STAND_IN_LOG', str(tmp_path / 'log'))
+    monkeypatch.setenv('STAND_IN_PASSWORD', PASSWORD)
+    _pool = SshPool()
+    yield _pool
+    _pool.close()
+
+
+def _log():
+    with open(os.environ['STAND_IN_LOG']) as log:
+        return log.read().split()
+
+
+def test_master_is_reused(pool):
+    assert pool.run('user', PASSWORD, 'node', 'echo one') == 'one'
+    assert pool.run('user', PASSWORD, 'node', 'echo two') == 'two'
+    assert _log().count('master') == 1
+    assert _log().count('auth') == 1
+    assert _log().count('command') == 2
+    assert stat.S_IMODE(os.stat(pool._control_dir).st_mode) == 0o700
+
+
+def test_expired_master_is_replaced(pool):
+    assert pool.run('user', PASSWORD, 'node', 'echo one') == 'one'
+    _path, = pool._masters.values()
+    os.unlink(_path)  # ControlPersist ran out
+    assert pool.run('user', PASSWORD, 'node', 'echo two') == 'two'
+    assert _log().count('master') == 2
+    assert 'check' in _log()
+
+
+def test_socket_of_a_dead_master_is_removed(pool):
+    assert pool.run('user', PASSWORD, 'node', 'echo one') == 'one'
+    _path, = pool._masters.values()
+    with open(_path, 'w') as master:
+        master.write('dead')  # dropped, socket left behind
+    assert pool.run('user', PASSWORD, 'node', 'echo two') == 'two'
+    assert _log().count('master') == 2
+
+
+def test_command_exiting_255_runs_once(pool):
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        pool.run('user', PASSWORD, 'node', 'exit 255')
+    assert e.value.returncode == 255
+    assert _log().count('command') == 1
+    assert _log().count('master') == 1
+
+
+def test_wrong_password_does_not_reuse_a_master(pool):
+    assert pool.run('user', PASSWORD, 'node', 'echo one') == 'one'
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        pool.run('user', 'wrong', 'node', 'echo two')
+    assert e.value.returncode == 5
+    assert _log().count('command') == 1
+    assert len(pool._masters) == 1